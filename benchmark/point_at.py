@@ -0,0 +1,65 @@
+"""
+Benchmark of control point picking: linear scan vs spatial index
+
+Compare the time taken by `ControlPointsView.point_at` to find the control 
+point selected by random rays, with and without spatial index.
+
+usage: python benchmark/point_at.py [mtg-file [query-number]]
+
+By default, it uses the shared data file 'puu1.bmtg'
+"""
+import sys
+import time
+import random
+
+import openalea.plantgl.all as _pgl
+
+from treeeditor.io import get_shared_data
+from treeeditor.tree.model import create_mtg_model
+from treeeditor.tree.view import ControlPointsView
+
+
+def random_rays(model, number, distance=1000):
+    """ return `number` rays (start,direction) pointing toward model nodes """
+    nodes = model.get_nodes()
+    rays = []
+    for i in xrange(number):
+        target = _pgl.Vector3(*model.get_position(random.choice(nodes)))
+        direction = _pgl.direction(_pgl.Vector3(*[random.gauss(0,1) for k in range(3)]))
+        rays.append((target-distance*direction, direction))
+    return rays
+    
+def timeit(view, rays, z_min=0, z_max=1e9):
+    """ return selected node ids and time taken by `view` to process `rays` """
+    t = time.time()
+    selected = [view.point_at(start, direction, z_min, z_max) for start,direction in rays]
+    return [p.id if p else None for p in selected], time.time()-t
+    
+def main(filename=None, number=100):
+    if filename is None:
+        filename = get_shared_data('puu1.bmtg')
+    random.seed(42)
+    
+    model = create_mtg_model(presenter=None, tree=filename)
+    print 'model loaded:', len(model.get_nodes()), 'nodes'
+    
+    linear = ControlPointsView(spatial_index=False)
+    grid   = ControlPointsView(spatial_index=True)
+    linear.create(model, None)
+    t = time.time()
+    grid.create(model, None)
+    print 'view creation with spatial index: %.3fs' % (time.time()-t)
+    
+    rays = random_rays(model, number)
+    linear_result, linear_time = timeit(linear, rays)
+    grid_result,   grid_time   = timeit(grid,   rays)
+    
+    print '%d queries' % number
+    print '  linear scan:   %.4fs per query' % (linear_time/number)
+    print '  spatial index: %.4fs per query' % (grid_time/number)
+    print '  speed up:      %.1f' % (linear_time/max(grid_time,1e-9))
+    if linear_result!=grid_result:
+        print '*** results differ for %d queries ***' % sum(a!=b for a,b in zip(linear_result,grid_result))
+    
+if __name__=='__main__':
+    main(*sys.argv[1:2], **(dict(number=int(sys.argv[2])) if len(sys.argv)>2 else {}))
@@ -0,0 +1,60 @@
+"""
+Benchmark of mtg binary files: pickle (.bmtg) vs .tmtg
+
+Compare the time to write and read a mtg, and the file size, with the pickle
+format (`io.writefile` and `io.readfile`) and the .tmtg format (`io.write_tmtg`
+and `io.read_tmtg`). It also times the loading of a TreeModel from both files.
+
+usage: python benchmark/tmtg.py [bmtg-file [repeat]]
+
+By default, it uses the shared data file 'puu1.bmtg'
+"""
+import os
+import sys
+import time
+import tempfile
+
+from treeeditor import io
+from treeeditor.io import get_shared_data
+from treeeditor.tree.model import create_mtg_model
+
+
+def timeit(fct, repeat, *args):
+    """ return the result of `fct(*args)` and its (best) time over `repeat` calls """
+    best = float('inf')
+    for i in xrange(repeat):
+        t = time.time()
+        result = fct(*args)
+        best = min(best, time.time()-t)
+    return result, best
+
+def main(filename=None, repeat=3):
+    if filename is None:
+        filename = get_shared_data('puu1.bmtg')
+
+    g = io.readfile(filename)
+    print 'mtg loaded:', len(g), 'vertices'
+
+    tmpdir = tempfile.mkdtemp()
+    bmtg = os.path.join(tmpdir, 'tree.bmtg')
+    tmtg = os.path.join(tmpdir, 'tree.tmtg')
+    try:
+        results = []
+        for name, write, read, tmpfile in [('pickle (.bmtg)', io.writefile, io.readfile,  bmtg),
+                                           ('.tmtg',          io.write_tmtg, io.read_tmtg, tmtg)]:
+            _, write_time = timeit(write, repeat, tmpfile, g)
+            _, read_time  = timeit(read,  repeat, tmpfile)
+            _, model_time = timeit(lambda f: create_mtg_model(None, f), repeat, tmpfile)
+            results.append((name, write_time, read_time, model_time, os.path.getsize(tmpfile)))
+
+        print '%-16s %10s %10s %10s %12s' % ('format','write(s)','read(s)','model(s)','size(kB)')
+        for name, write_time, read_time, model_time, size in results:
+            print '%-16s %10.3f %10.3f %10.3f %12d' % (name, write_time, read_time, model_time, size/1024)
+    finally:
+        for f in (bmtg, tmtg):
+            if os.path.exists(f):
+                os.remove(f)
+        os.rmdir(tmpdir)
+
+if __name__=='__main__':
+    main(*sys.argv[1:2], **(dict(repeat=int(sys.argv[2])) if len(sys.argv)>2 else {}))
@@ -63,6 +63,8 @@ setup(
     entry_points = {
         #'wralea' : ['treeeditor = vplants.treeeditor_wralea' if has_project else 'treeeditor = treeeditor_wralea' ],
          'gui_scripts':  ['TreeEditor = treeeditor.editor:main'],
+         'console_scripts': ['treeeditor-batch = treeeditor.batch:main',
+                             'treeeditor-convert = treeeditor.batch:convert_main'],
          'oalab.applet': ['TreeEditorApp = treeeditor.plugins:TreeEditorWidgetPlugin'],
         },
 
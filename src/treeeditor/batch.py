@@ -0,0 +1,291 @@
+"""
+Headless batch edition of tree files
+
+The `treeeditor-batch` command applies edit operations to all the mtg files
+(.mtg, .bmtg and .tmtg) of a directory, without graphical interface: it only
+uses the `treeeditor.tree.model` TreeModel classes, and never imports Qt,
+PyQGLViewer or OpenGL.
+
+Files are processed in parallel by a pool of processes, one file per task.
+For each file, a json line is written in the report as soon as it is done,
+with the file name, status ('ok' or 'error'), timings and the results of the
+operations.
+
+Files are not saved by default. Edited files, i.e. which model has been
+changed by the operations (see `treeeditor.mvp.Model.subscribe`), are saved
+in an output directory (option -d), or replace the original ones with option
+--in-place. Unchanged files are never written: saving can drop mtg features
+which are not managed by the model.
+
+Operations are either:
+  - named operations, registered in `OPERATIONS` (see `operation`), such as
+    'check_axes'
+  - a python script, executed with the variables `model` (the TreeModel of
+    the file) and `filename`. The script can store results in the `result`
+    dictionary, which is added to the report.
+
+Usage
+-----
+    treeeditor-batch DIRECTORY -o check_axes -s script.py -d edited/ -j 4 -r report.jsonl
+    treeeditor-batch DIRECTORY -o stats -r report.jsonl     # no file is saved
+
+or, from python:
+    process_directory(directory, operations=['check_axes'], script='script.py', in_place=True)
+
+The `treeeditor-convert` command converts tree files between formats, in
+parallel, without loading them in a model (see `treeeditor.io.convert_files`):
+    treeeditor-convert -f .tmtg -d converted/ DIRECTORY_OR_FILES...
+"""
+import os as _os
+import sys as _sys
+import json as _json
+import time as _time
+import traceback as _traceback
+import multiprocessing as _multiprocessing
+
+EXTENSIONS = ('.mtg', '.bmtg', '.tmtg')
+OPERATIONS = {}   # name -> function(model), registered with `operation`
+
+
+def operation(name):
+    """ decorator registering a function as the named batch operation `name`
+
+    The function is called with the TreeModel to edit, and can return a dict
+    of results which is added to the report.
+    """
+    def register(function):
+        OPERATIONS[name] = function
+        return function
+    return register
+
+@operation('check_axes')
+def check_axes(model):
+    """ repair the axe and plant scales of PASModel """
+    if not hasattr(model, 'check_axes'):
+        return dict(repaired=0)
+    model.push_backup()
+    return dict(repaired=len(model.check_axes()))
+
+@operation('validate')
+def validate(model):
+    """ number of segments violating each structural invariant """
+    return dict((kind,len(vids)) for kind,vids in model.validate().iteritems())
+
+@operation('stats')
+def stats(model):
+    """ number of segments and of roots """
+    nodes = model.get_nodes()
+    return dict(segments=len(nodes),
+                roots=sum(1 for vid in nodes if model.parent(vid) is None))
+
+
+class _Messages(object):
+    """ Presenter of batch processed models: it records their messages """
+    def __init__(self):
+        self.messages = []
+    def show_message(self, message):
+        self.messages.append(message)
+    def updateGL(self):
+        pass
+
+
+def list_files(directory, extensions=EXTENSIONS):
+    """ return the sorted list of the tree files in `directory` """
+    names = sorted(name for name in _os.listdir(directory)
+                        if _os.path.splitext(name)[1].lower() in extensions)
+    return [_os.path.join(directory,name) for name in names]
+
+def process_file(filename, operations=(), script=None, output=None, in_place=False):
+    """ load tree file `filename`, apply the edit `operations`, and save it
+
+    The position and radius properties are detected automatically (see
+    `TreeModel.select_mtg_api`). The file is only saved if its model has been
+    changed (by editions notified by the model, not by direct edition of its
+    mtg), and if `output` or `in_place` is given.
+
+    `operations`: list of names of registered operations (see `OPERATIONS`)
+    `script`:     optional python script file, executed after the operations
+    `output`:     the directory to save the edited file in, or None
+    `in_place`:   if True and `output` is None, replace the edited file
+
+    Errors are not raised: they are reported in the returned dict, which gives
+    the file status, the timings and the results of operations.
+    """
+    from treeeditor.tree.model import create_mtg_model
+
+    report = dict(file=filename, status='ok', time={}, results={})
+    timing = report['time']
+    start = _time.time()
+    try:
+        messages = _Messages()
+        model = create_mtg_model(presenter=messages, tree=filename, position=None, radius=None)
+        timing['load'] = _time.time()-start
+        changes = []
+        model.subscribe(changes.append)
+
+        t = _time.time()
+        for name in operations:
+            report['results'][name] = OPERATIONS[name](model)
+        if script:
+            namespace = dict(model=model, filename=filename, result={})
+            execfile(script, namespace)
+            report['results']['script'] = namespace['result']
+        timing['edit'] = _time.time()-t
+        report['segments'] = len(model.get_nodes())
+        report['modified'] = len(changes)>0
+
+        if changes and (output or in_place):
+            t = _time.time()
+            if output:
+                filename = _os.path.join(output, _os.path.basename(filename))
+            model.save_model(filename)
+            report['saved'] = filename
+            timing['save'] = _time.time()-t
+        if messages.messages:
+            report['messages'] = messages.messages
+
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = '%s: %s' % (type(e).__name__, e)
+        report['traceback'] = _traceback.format_exc()
+
+    timing['total'] = _time.time()-start
+    return report
+
+def _process_file(args):
+    """ call `process_file` in a pool worker """
+    filename, kargs = args
+    return process_file(filename, **kargs)
+
+def process_directory(directory, operations=(), script=None, output=None,
+                      in_place=False, report=None, processes=None):
+    """ apply `process_file` to all tree files of `directory`, in parallel
+
+    `report`:    an optional file object where each file report is written,
+                 as json lines, as soon as they are done
+    `processes`: number of worker processes, default is the cpu number.
+                 If 1, files are processed in the current process.
+
+    return the list of file reports (see `process_file`)
+    """
+    unknown = [name for name in operations if name not in OPERATIONS]
+    if unknown:
+        raise ValueError('unknown operations: '+', '.join(unknown))
+    if output:
+        if not _os.path.exists(output):
+            _os.makedirs(output)
+
+    kargs = dict(operations=list(operations), script=script, output=output, in_place=in_place)
+    tasks = [(filename, kargs) for filename in list_files(directory)]
+
+    if processes==1 or len(tasks)<=1:
+        results = (_process_file(task) for task in tasks)
+        pool = None
+    else:
+        pool = _multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_process_file, tasks, chunksize=1)
+
+    reports = []
+    try:
+        for file_report in results:
+            reports.append(file_report)
+            if report is not None:
+                report.write(_json.dumps(file_report)+'\n')
+                report.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return reports
+
+
+def main(argv=None):
+    """ treeeditor-batch command """
+    from optparse import OptionParser
+
+    parser = OptionParser(usage='%prog [options] DIRECTORY',
+                          description='Apply edit operations to all the tree files of DIRECTORY')
+    parser.add_option('-o', '--operation', dest='operations', action='append', default=[],
+                      help='named operation to apply (%s). Can be given several times'
+                           % ', '.join(sorted(OPERATIONS)))
+    parser.add_option('-s', '--script', dest='script',
+                      help="python script to apply, with variables 'model', 'filename' and 'result'")
+    parser.add_option('-d', '--output-dir', dest='output',
+                      help='directory where to save edited files (default: not saved)')
+    parser.add_option('-i', '--in-place', dest='in_place', action='store_true', default=False,
+                      help='replace edited files')
+    parser.add_option('-j', '--processes', dest='processes', type='int',
+                      help='number of worker processes (default: number of cpu)')
+    parser.add_option('-r', '--report', dest='report',
+                      help='json lines report file (default: stdout)')
+    options, args = parser.parse_args(argv)
+    if len(args)!=1:
+        parser.error('one DIRECTORY is expected')
+    if not options.operations and not options.script:
+        parser.error('no operation or script given')
+    if options.output and options.in_place:
+        parser.error('options --output-dir and --in-place are exclusive')
+
+    report = open(options.report,'w') if options.report else _sys.stdout
+    start = _time.time()
+    try:
+        reports = process_directory(args[0], operations=options.operations,
+                                    script=options.script, output=options.output,
+                                    in_place=options.in_place, report=report, processes=options.processes)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if report is not _sys.stdout:
+            report.close()
+
+    errors = sum(1 for r in reports if r['status']!='ok')
+    print >> _sys.stderr, '%d files processed in %.2fs, %d errors' \
+                          % (len(reports), _time.time()-start, errors)
+    return 1 if errors else 0
+
+def convert_main(argv=None):
+    """ treeeditor-convert command """
+    from optparse import OptionParser
+    from treeeditor.io import convert_files, TREE_WRITERS
+
+    parser = OptionParser(usage='%prog [options] DIRECTORY_OR_FILES...',
+                          description='Convert tree files to another format')
+    parser.add_option('-f', '--format', dest='format',
+                      help='extension of the converted files (%s)' % ', '.join(sorted(TREE_WRITERS)))
+    parser.add_option('-d', '--output-dir', dest='output',
+                      help='directory where to write converted files (default: next to sources)')
+    parser.add_option('--skip', dest='skip', choices=['mtime','hash','none'], default='mtime',
+                      help="skip up-to-date files by 'mtime' (default), content 'hash', or 'none'")
+    parser.add_option('--no-verify', dest='verify', action='store_false', default=True,
+                      help='do not check converted files')
+    parser.add_option('-j', '--processes', dest='processes', type='int',
+                      help='number of worker processes (default: number of cpu)')
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error('no DIRECTORY or file given')
+    if options.format not in TREE_WRITERS:
+        parser.error('invalid format: %s' % options.format)
+
+    sources = []
+    for arg in args:
+        if _os.path.isdir(arg):
+            sources.extend(list_files(arg))
+        else:
+            sources.append(arg)
+    sources = [s for s in sources if _os.path.splitext(s)[1].lower()!=options.format]
+
+    def print_report(report):
+        if report['status']=='error':
+            print >> _sys.stderr, '%s: %s' % (report['source'], report['error'])
+    skip = None if options.skip=='none' else options.skip
+    reports, throughput = convert_files(sources, options.format, output=options.output,
+                                        verify=options.verify, skip=skip,
+                                        processes=options.processes, callback=print_report)
+
+    print >> _sys.stderr, ('%(converted)d files converted, %(skipped)d skipped, %(errors)d errors'
+                           ' in %(time).2fs (%(files_per_s).1f files/s, %(mb_per_s).2f MB/s)') % throughput
+    return 1 if throughput['errors'] else 0
+
+if __name__ == '__main__':
+    _sys.exit(main())
@@ -16,7 +16,7 @@ from PyQGLViewer import QGLViewer as _QGLViewer
 
 # tree editor components
 from treeeditor.mvp import AbstractEditor as _AbstractEditor
-from treeeditor.tree import TreePresenter as _TreePresenter
+from treeeditor.tree.presenter import TreePresenter as _TreePresenter
 from treeeditor.background import BackgroundPresenter as _BackgroundPresenter
 
 
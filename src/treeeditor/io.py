@@ -2,11 +2,24 @@
 File input and output
 """
 
+import os as _os
+import re as _re
+import json as _json
+import tempfile as _tempfile
+import struct as _struct
 import cPickle as _pickle
+import time as _time
+import hashlib as _hashlib
+import numbers as _numbers
+import multiprocessing as _multiprocessing
 
-from os.path import join as _pjoin
+from contextlib import contextmanager as _contextmanager
 
-from openalea.mtg    import io as _mtg_io
+from os.path import join as _pjoin, getsize as _getsize
+
+import numpy as _np
+
+from openalea.mtg    import MTG as _MTG
 from openalea.mtg.io import read_mtg_file
 
 
@@ -26,22 +39,912 @@ def readfile(filename, mode='rb'):
     return obj
     
 
+# atomic writing
+# --------------
+@_contextmanager
+def atomic_write(filename):
+    """ context manager to write file `filename` atomically
+    
+    It yields the name of a temporary file, created in the same directory, 
+    which replaces `filename` when the context exits without error. Otherwise
+    the temporary file is removed and `filename` is left unchanged.
+    
+    Usage:
+        with atomic_write('tree.mtg') as tmpname:
+            write_mtg_stream(tmpname, g, features)
+    """
+    dirname, basename = _os.path.split(_os.path.abspath(filename))
+    fd, tmpname = _tempfile.mkstemp(prefix='.'+basename+'.', suffix='.tmp', dir=dirname)
+    _os.close(fd)
+    try:
+        yield tmpname
+        
+        # mkstemp creates file readable by user only: use standard permissions
+        if _os.path.exists(filename):
+            mode = _os.stat(filename).st_mode & 0777
+        else:
+            umask = _os.umask(0)
+            _os.umask(umask)
+            mode = 0666 & ~umask
+        _os.chmod(tmpname, mode)
+        
+        if _os.name=='nt' and _os.path.exists(filename):
+            _os.remove(filename)   # rename does not overwrite files on windows
+        _os.rename(tmpname, filename)
+    except:
+        if _os.path.exists(tmpname):
+            _os.remove(tmpname)
+        raise
+        
+
 # mtg
 # ---
 def write_mtg_file(filename, g, properties=[], nb_tab=20):
     """
     Write mtg `g` in file `filename`
     
-    Same input parameters as mtg.io.write_mtg
+    Same input parameters as mtg.io.write_mtg. See `write_mtg_stream`.
     """
     if properties == []:
         properties = [(p, 'REAL') for p in g.property_names() if p not in ['edge_type', 'index', 'label']]
 
-    str = _mtg_io.write_mtg(g, properties, nb_tab=nb_tab)
+    features = [(name, ftype, g.property(name).get) for name,ftype in properties]
+    write_mtg_stream(filename, g, features, nb_tab=nb_tab)
+    
+    
+# streaming mtg writer
+# --------------------
+_DEFAULT_SYMBOLS = 'SAPUVWXYZQRTBCDEFGHIJKLMNO'  # preferred symbols, from finest scale
+
+def write_mtg_stream(filename, g, features, nb_tab=20):
+    """ write mtg `g` in coded mtg file `filename`
+    
+    The mtg topology is walked once, and each vertex row is written directly
+    to the file: no intermediate copy of the mtg, nor of the file content, is
+    made. Only the vertices connected to segments (i.e. vertices at the 
+    finest scale) are written.
+    
+    `features` is a list of (name, type, get_value) where `type` is the mtg 
+    feature type (e.g. 'REAL') and `get_value(vid)` returns the value of the 
+    feature for vertex `vid`, or None if it is missing.
+    `nb_tab` is the number of columns of the code table. An IOError is raised
+    if the mtg branching depth requires more.
+    """
+    symbols, default = _mtg_classes(g)
+    label = g.property('label')
+    edge_type = g.property('edge_type')
+    complex_of = g._complex.get
+    children_of = g._children.get
+    max_scale = g.max_scale()
+    
+    index = {}  # complex -> number of components written with a default label
+    def vertex_code(vid):
+        """ return the label of `vid` as written in the code table """
+        name = label.get(vid)
+        scale = g._scale[vid]
+        if name and symbols.get(name[0])==scale and name[1:].isalnum():
+            return name
+        cpx = complex_of(vid)
+        index[cpx] = index.get(cpx,0) + 1
+        return default[scale]+str(index[cpx])
+        
+    def complexes(vid):
+        """ list of `vid` and its complexes, from scale 1 to vid scale """
+        chain = []
+        while vid is not None and g._scale[vid]>0:
+            chain.append(vid)
+            vid = complex_of(vid)
+        return chain[::-1]
+        
+    def entity_code(vid, parent):
+        """ code of `vid` relative to `parent` (None for tree roots) """
+        chain = complexes(vid)
+        if parent is None:
+            return ''.join('/'+vertex_code(v) for v in chain)
+        parent_chain = complexes(parent)
+        k = 0
+        while k<len(chain)-1 and k<len(parent_chain) and chain[k]==parent_chain[k]:
+            k += 1
+        edge = edge_type.get(vid)
+        if edge not in ('<','+'):
+            edge = '+'
+        return edge + vertex_code(chain[k]) + ''.join('/'+vertex_code(v) for v in chain[k+1:])
+        
+    def format_value(value):
+        if value is None or value!=value:   # value!=value for NaN
+            return ''
+        if isinstance(value, float):
+            return repr(value)
+        return str(value)
+        
     with open(filename, 'w') as f:
-        f.write(str)
+        # header
+        f.write('CODE:\tFORM-A\n\n')
+        f.write('CLASSES:\nSYMBOL\tSCALE\tDECOMPOSITION\tINDEXATION\tDEFINITION\n')
+        f.write('$\t0\tFREE\tFREE\tIMPLICIT\n')
+        for symbol, scale in sorted(symbols.iteritems(), key=lambda (s,scale):(scale,s)):
+            f.write('%s\t%d\tCONNECTED\tFREE\tIMPLICIT\n' % (symbol, scale))
+        f.write('\nDESCRIPTION:\nLEFT\tRIGHT\tRELTYPE\tMAX\n')
+        for symbol, scale in sorted(symbols.iteritems(), key=lambda (s,scale):(scale,s)):
+            same_scale = ','.join(sorted(s for s,sc in symbols.iteritems() if sc==scale))
+            f.write('%s\t%s\t<\t?\n%s\t%s\t+\t?\n' % (symbol, same_scale, symbol, same_scale))
+        f.write('\nFEATURES:\nNAME\tTYPE\n')
+        for name, ftype, get_value in features:
+            f.write('%s\t%s\n' % (name, ftype))
+        f.write('\nMTG:\nENTITY-CODE' + '\t'*nb_tab + '\t'.join(name for name,ftype,get in features) + '\n')
+        
+        # code table: segments are walked in pre-order with an explicit stack
+        # of (vertex, parent, column, is_successor). Branches are written one
+        # column to the right, before the successor of their parent ('^' row)
+        roots = sorted(vid for vid,scale in g._scale.iteritems() 
+                                if scale==max_scale and g._parent.get(vid) is None)
+        stack = [(root, None, 0, False) for root in reversed(roots)]
+        while stack:
+            vid, parent, column, is_successor = stack.pop()
+            if column>=nb_tab:
+                raise IOError("mtg branching depth is higher than the number of columns (nb_tab=%d)" % nb_tab)
+                
+            code = ('^' if is_successor else '') + entity_code(vid, parent)
+            values = '\t'.join(format_value(get_value(vid)) for name,ftype,get_value in features)
+            f.write('\t'*column + code + '\t'*(nb_tab-column) + values + '\n')
+            
+            children = children_of(vid) or []
+            successor = None
+            for child in children:
+                if edge_type.get(child)=='<':
+                    successor = child
+                    break
+            if successor is not None:
+                stack.append((successor, vid, column, True))
+            for child in reversed(children):
+                if child!=successor:
+                    stack.append((child, vid, column+1, False))
+                    
+def _mtg_classes(g):
+    """ return the mtg classes of `g` used by `write_mtg_stream`
+    
+    return a dict (symbol, scale) of all the classes, and the dict of the 
+    default symbol of each scale: the symbol of the first labeled vertex of 
+    this scale, or a unused symbol otherwise.
+    """
+    symbols = {}   # symbol -> scale
+    default = {}   # scale  -> symbol
+    scale_of = g._scale
+    for vid, name in g.property('label').iteritems():
+        scale = scale_of.get(vid)
+        if not name or not scale or not name[0].isalpha():
+            continue
+        if symbols.setdefault(name[0], scale)==scale:
+            default.setdefault(scale, name[0])
+            
+    for scale in range(g.max_scale(),0,-1):
+        if scale not in default:
+            symbol = [s for s in _DEFAULT_SYMBOLS if s not in symbols][0]
+            symbols[symbol] = scale
+            default[scale] = symbol
+            
+    return symbols, default
+    
+    
+# streaming mtg reader
+# --------------------
+def read_mtg_stream(filename, **options):
+    """ read the mtg stored in coded mtg file `filename`
+    
+    It is an alternative to `read_mtg_file` which parses the file line by line.
+    See `MTGReader` for the `options`.
+    """
+    return MTGReader(filename, **options).read()
+    
+    
+_FEATURE_TYPES = {'REAL':float, 'INT':int}
+_ENTITY_CODE   = _re.compile(r'([/<+])([^/<+]+)')
+
+class MTGReader(object):
+    """ 
+    Streaming reader of coded mtg (.mtg) files
+    
+    The file is parsed line by line: only the last vertex of each column of the
+    code table is kept by the parser, such that its memory use does not depend
+    on the file size. 
+    
+    Reading can be stopped after a given number of segments (i.e. vertices at 
+    the finest scale), or limited to a region of space: segments outside this 
+    region are not loaded, nor their descendants.
+    
+    The segment positions and radius are also stored in numpy arrays, which
+    are available after `read` in attributes `vids`, `positions` and `radii`.
+    These are None if the position features are not found.
+    
+    Usage:
+        reader = MTGReader('tree.mtg', progress=callback)
+        g = reader.read()
+        positions = reader.positions
+    """
+    progress_step = 1000   # number of mtg lines parsed between progress calls
+    
+    def __init__(self, filename, position=None, radius=None, 
+                       progress=None, max_vertices=None, bbox=None):
+        """ create a reader of mtg file `filename`
+        
+        `position`: the list of the names of the x, y and z features. If None,
+                    use the first found of 'XX','YY','ZZ' or 'x','y','z'.
+        `radius`:   name of the radius feature. If None, use 'r' if it exists 
+                    or 'radius' otherwise.
+        `progress`: optional function called regularly during reading with the
+                    fraction of the file that has been read, in [0,1]
+        `max_vertices`: if not None, stop reading after this number of segments
+        `bbox`: if not None, load only the segments which position is in this
+                box, given as a pair ((xmin,ymin,zmin),(xmax,ymax,zmax)),
+                and none of their descendants. Segments without position are
+                not filtered.
+        """
+        self.filename = filename
+        self.position = position
+        self.radius   = radius
+        self.progress = progress
+        self.max_vertices = max_vertices
+        self.bbox = bbox
+        
+        self.vids = self.positions = self.radii = None
+        
+    def read(self):
+        """ parse the file, and return the mtg """
+        self._size = max(_getsize(self.filename),1)
+        self._read_size = 0
+        
+        with open(self.filename) as f:
+            lines = self._lines(f)
+            self._read_header(lines)
+            g = self._read_code(lines)
+            
+        if self.progress:
+            self.progress(1.)
+        return g
+        
+    def _lines(self, f):
+        """ generate the (stripped) lines of `f` and keep track of read size """
+        for line in f:
+            self._read_size += len(line)
+            line = line.rstrip('\r\n')
+            if line.strip() and not line.lstrip().startswith('#'):
+                yield line
+        
+    def _read_header(self, lines):
+        """ read the header of the mtg, until the 'MTG:' line """
+        self.classes  = {}   # symbol -> scale
+        self.features = []   # list of (name, type)
+        section = None
+        for line in lines:
+            fields = [field.strip() for field in line.split('\t')]
+            if fields[0].endswith(':'):
+                section = fields[0]
+                if section=='MTG:':
+                    break
+            elif section=='CLASSES:' and fields[0]!='SYMBOL':
+                self.classes[fields[0]] = int(fields[1])
+            elif section=='FEATURES:' and fields[0]!='NAME':
+                self.features.append((fields[0],fields[1]))
+        else:
+            raise IOError("invalid mtg file '%s': no MTG section" % self.filename)
+        self.max_scale = max(self.classes.values())
+        
+        # column of the features in the code table
+        header = lines.next().split('\t')
+        names  = dict(self.features)
+        self._columns = [(i,name.strip(),_FEATURE_TYPES.get(names.get(name.strip()),str))
+                            for i,name in enumerate(header) if name.strip() in names]
+        
+        # features used for positions and radius
+        names = [name for i,name,ftype in self._columns]
+        position = self.position
+        if position is None:
+            if 'XX' in names and 'YY' in names and 'ZZ' in names:
+                position = ['XX','YY','ZZ']
+            elif 'x' in names and 'y' in names and 'z' in names:
+                position = ['x','y','z']
+        if position is None or not all(name in names for name in position):
+            position = None
+        radius = self.radius
+        if radius is None:
+            radius = 'r' if 'r' in names else 'radius'
+        self._position_features = position
+        self._radius_feature = radius
+            
+    def _read_code(self, lines):
+        """ parse the code table and return the mtg """
+        g = _MTG()
+        properties = g.properties()
+        for i,name,ftype in self._columns:
+            properties.setdefault(name,{})
+        edge_type = properties.setdefault('edge_type',{})
+        label     = properties.setdefault('label',{})
+        
+        SKIP = -1
+        columns = {-1:g.root}  # column -> last vertex of this column
+        vids, positions, radii = [], [], []
+        segment_number = 0
+        nan = float('nan')
         
+        bbox = self.bbox
+        position_features = self._position_features
+        radius_feature = self._radius_feature
         
+        for n,line in enumerate(lines):
+            if self.progress and n%self.progress_step==0:
+                self.progress(self._read_size/float(self._size))
+                
+            fields = line.split('\t')
+            column = 0
+            while not fields[column]:
+                column += 1
+            code = fields[column].strip()
+            
+            # vertex that the line refers to
+            if code.startswith('^'):
+                vertex = columns.get(column, SKIP)
+                code = code[1:]
+            else:
+                vertex = columns.get(column-1, SKIP)
+            if vertex==SKIP:
+                columns[column] = SKIP
+                continue
+            
+            # read features
+            features = {}
+            for i,name,ftype in self._columns:
+                value = fields[i].strip() if i<len(fields) else ''
+                if value:
+                    features[name] = ftype(value)
+            
+            if position_features is not None:
+                position = [features.get(name,nan) for name in position_features]
+                if bbox is not None and not self._in_bbox(position):
+                    columns[column] = SKIP
+                    continue
+                
+            # create vertices
+            fine_parent = None  # parent at finer scale of decomposed vertices
+            for relation, name in _ENTITY_CODE.findall(code):
+                vertex, fine_parent = self._add_vertex(g, vertex, relation, 
+                                                       name, fine_parent)
+                label[vertex] = name
+            columns[column] = vertex
+            
+            for name,value in features.iteritems():
+                properties[name][vertex] = value
+                
+            if g.scale(vertex)==self.max_scale:
+                segment_number += 1
+                if position_features is not None:
+                    vids.append(vertex)
+                    positions.append(position)
+                    radii.append(features.get(radius_feature,1))
+                if self.max_vertices is not None and segment_number>=self.max_vertices:
+                    break
+                    
+        if position_features is not None and g.max_scale()==self.max_scale:
+            self.vids = _np.array(vids, dtype=int)
+            self.positions = _np.array(positions, dtype=float).reshape(-1,3)
+            self.radii = _np.array(radii, dtype=float)
+                
+        return g
+        
+    def _add_vertex(self, g, vertex, relation, name, fine_parent):
+        """ add vertex `name` with `relation` to `vertex`
+        
+        `fine_parent` is the (vertex, edge_type) of the parent of the next
+        added vertex if it is at a finer scale than `vertex`. 
+        
+        return the added vertex id and the updated `fine_parent`
+        """
+        edge_type = g.property('edge_type')
+        scale = self.classes[name[0]]
+        
+        if relation=='/':
+            new = g.add_component(vertex)
+            if fine_parent is not None:
+                parent, edge = fine_parent
+                while g.scale(parent)>scale:
+                    parent = g.complex(parent)
+                self._set_parent(g, new, parent)
+                edge_type[new] = edge
+                if g.scale(fine_parent[0])==scale:
+                    fine_parent = None
+            return new, fine_parent
+            
+        # successor or branch: the parent is the complex of `vertex` at `scale`
+        parent = vertex
+        while g.scale(parent)>scale:
+            parent = g.complex(parent)
+        if g.scale(parent)<scale:
+            raise IOError("invalid mtg code '%s': scale of %s is higher than its parent" % (relation+name,name))
+        
+        complex_id = g.complex(parent)
+        new = g.add_component(complex_id)
+        self._set_parent(g, new, parent)
+        edge_type[new] = relation
+        if parent!=vertex:
+            fine_parent = (vertex, relation)
+        return new, fine_parent
+        
+    @staticmethod
+    def _set_parent(g, vertex, parent):
+        g._parent[vertex] = parent
+        g._children.setdefault(parent,[]).append(vertex)
+        
+    def _in_bbox(self, position):
+        """ True if `position` is in the reader bbox (or has missing coordinates) """
+        lower, upper = self.bbox
+        for x,lo,hi in zip(position,lower,upper):
+            if x==x and not lo<=x<=hi:   # x!=x for NaN
+                return False
+        return True
+        
+
+
+# binary mtg (.tmtg)
+# ------------------
+# A .tmtg file contains:
+#   - a header: the magic string 'TMTG', the format version and the size of
+#     the directory, packed as '<4sII'
+#   - the directory: a json dict describing the mtg (root id and property 
+#     kinds) and the stored arrays (dtype, shape and offset)
+#   - the arrays, each aligned on `_TMTG_ALIGN` bytes
+# 
+# The topology is stored in arrays, indexed by vertex: 'vids', 'parent',
+# 'complex' (-1 if None), 'scale', 'child_rank' and 'component_rank' (the 
+# position of the vertex in the children (resp. components) list of its 
+# parent (resp. complex)). Each property 'p' is stored by the arrays 
+# 'p:vids' and 'p:values' of the ids and values of the vertices that have it.
+_TMTG_MAGIC   = 'TMTG'
+_TMTG_VERSION = 1
+_TMTG_HEADER  = '<4sII'
+_TMTG_ALIGN   = 64
+
+def write_tmtg(filename, g):
+    """ write mtg `g` in binary file `filename` (.tmtg format)
+    
+    Property values should all be either numbers, strings, or sequences of
+    numbers with same length. Otherwise a TypeError is raised. None values 
+    are considered missing, and are not stored.
+    """
+    arrays = _tmtg_topology(g)
+    directory = dict(root=g.root, properties={}, arrays={})
+    for name, prop in g.properties().iteritems():
+        vids = [vid for vid,value in prop.iteritems() if value is not None]
+        arrays[name+':vids']   = _np.array(vids, dtype='<i8')
+        arrays[name+':values'] = _tmtg_values(name, [prop[vid] for vid in vids])
+        kind = 'vector' if arrays[name+':values'].ndim==2 else 'scalar'
+        directory['properties'][name] = kind
+        
+    offset = 0
+    for name, array in arrays.iteritems():
+        directory['arrays'][name] = dict(dtype=array.dtype.str, shape=array.shape, offset=offset)
+        offset += _tmtg_aligned(array.nbytes)
+    
+    directory = _json.dumps(directory)
+    header = _struct.pack(_TMTG_HEADER, _TMTG_MAGIC, _TMTG_VERSION, len(directory))
+    with open(filename, 'wb') as f:
+        f.write(header)
+        f.write(directory)
+        f.write('\0'*(_tmtg_aligned(f.tell())-f.tell()))
+        for name, array in arrays.iteritems():
+            f.write(array.tostring())
+            f.write('\0'*(_tmtg_aligned(array.nbytes)-array.nbytes))
+
+def read_tmtg(filename):
+    """ read mtg stored in binary file `filename` (.tmtg format) """
+    return TMTGReader(filename).read()
+    
+def _tmtg_aligned(size):
+    return -(-size//_TMTG_ALIGN)*_TMTG_ALIGN
+    
+def _tmtg_topology(g):
+    """ return the dict of topology arrays of mtg `g` """
+    vids = _np.array(sorted(g._scale), dtype='<i8')
+    rank = lambda lists: dict((vid,i) for content in lists.itervalues() 
+                                      for i,vid in enumerate(content))
+    get_parent  = g._parent.get
+    get_complex = g._complex.get
+    child_rank     = rank(g._children)
+    component_rank = rank(g._components)
+    
+    as_array = lambda values, dtype: _np.array([-1 if v is None else v for v in values], dtype=dtype)
+    vid_list = vids.tolist()
+    return dict(vids=vids,
+                parent =as_array(map(get_parent,  vid_list), '<i8'),
+                complex=as_array(map(get_complex, vid_list), '<i8'),
+                scale  =as_array(map(g._scale.get,vid_list), '<i4'),
+                child_rank    =as_array(map(child_rank.get,    vid_list), '<i4'),
+                component_rank=as_array(map(component_rank.get,vid_list), '<i4'))
+    
+def _tmtg_values(name, values):
+    """ convert the list of values of property `name` to a typed array """
+    try:
+        if all(isinstance(v,basestring) for v in values):
+            if all(isinstance(v,str) for v in values):
+                return _np.array(values, dtype='S')
+            return _np.array(values, dtype=unicode)
+        array = _np.array(values)
+        if array.dtype.kind in 'biuf' and array.ndim in (1,2):
+            return array.astype(array.dtype.newbyteorder('<'))
+    except (TypeError, ValueError):
+        pass
+    raise TypeError("property '%s' cannot be stored in .tmtg file" % name)
+    
+    
+class TMTGReader(object):
+    """ 
+    Reader of binary mtg (.tmtg) files
+    
+    The arrays of the file are accessed through read-only numpy.memmap, and are 
+    only read from disk when used. Thus, loading part of the file (such as the
+    topology arrays or some properties) does not require to read all of it.
+    
+    Usage:
+        reader = TMTGReader('tree.tmtg')
+        g = reader.read()            # the full mtg
+        x = reader.array('XX:values')  # one property array
+    """
+    def __init__(self, filename):
+        """ open the .tmtg file `filename` and read its directory """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(_struct.calcsize(_TMTG_HEADER))
+            if len(header)<_struct.calcsize(_TMTG_HEADER):
+                raise IOError("invalid .tmtg file '%s': header is too short" % filename)
+            magic, version, size = _struct.unpack(_TMTG_HEADER, header)
+            if magic!=_TMTG_MAGIC:
+                raise IOError("invalid .tmtg file '%s'" % filename)
+            if version>_TMTG_VERSION:
+                raise IOError("unsupported .tmtg version %d (max is %d)" % (version,_TMTG_VERSION))
+            self.version   = version
+            self.directory = _json.loads(f.read(size))
+            self._data_offset = _tmtg_aligned(f.tell())
+        
+    def property_names(self):
+        return self.directory['properties'].keys()
+        
+    def array(self, name):
+        """ return the (read-only) memmap of stored array `name` """
+        info  = self.directory['arrays'][name]
+        shape = tuple(info['shape'])
+        if _np.prod(shape)==0:
+            return _np.empty(shape, dtype=info['dtype'])
+        return _np.memmap(self.filename, dtype=info['dtype'], mode='r', 
+                          offset=self._data_offset+info['offset'], shape=shape)
+        
+    def property_values(self, name, vids, default=_np.nan):
+        """ return the array of the values of property `name` for `vids` 
+        
+        `default` is used for missing values
+        """
+        prop_vids = self.array(name+':vids')
+        values    = self.array(name+':values')
+        order = _np.argsort(prop_vids)
+        index = _np.searchsorted(prop_vids, vids, sorter=order).clip(0,max(len(order)-1,0))
+        result = _np.empty((len(vids),)+values.shape[1:])
+        result[:] = default
+        if len(order):
+            index = order[index]
+            found = prop_vids[index]==vids
+            result[found] = values[index[found]]
+        return result
+        
+    def read(self):
+        """ return the stored mtg """
+        g = _MTG()
+        
+        vids    = self.array('vids')
+        parent  = self.array('parent')
+        complex = self.array('complex')
+        vid_list = vids.tolist()
+        
+        g._scale = dict(zip(vid_list, self.array('scale').tolist()))
+        g._parent = dict.fromkeys(vid_list)
+        g._parent.update(self._links(vids, parent))
+        g._complex = dict(self._links(vids, complex))
+        g._children   = self._lists(vids, parent,  self.array('child_rank'))
+        g._components = self._lists(vids, complex, self.array('component_rank'))
+        g._root = self.directory['root']
+        g._id = max(vid_list)
+        
+        properties = g.properties()
+        properties.clear()
+        for name, kind in self.directory['properties'].iteritems():
+            values = self.array(name+':values').tolist()
+            if kind=='vector':
+                values = map(tuple, values)
+            properties[name] = dict(zip(self.array(name+':vids').tolist(), values))
+            
+        return g
+        
+    @staticmethod
+    def _links(vids, targets):
+        """ return the list of (vid,target) for targets not -1 """
+        linked = targets>=0
+        return zip(vids[linked].tolist(), targets[linked].tolist())
+        
+    @staticmethod
+    def _lists(vids, targets, ranks):
+        """ return the dict (target,[vids]) of vids sorted by rank """
+        linked = _np.flatnonzero(targets>=0)
+        order = linked[_np.lexsort((ranks[linked],targets[linked]))]
+        lists = {}
+        for vid, target in zip(vids[order].tolist(), targets[order].tolist()):
+            lists.setdefault(target,[]).append(vid)
+        return lists
+        
+        
+# bulk conversion
+# ---------------
+def detect_position(names):
+    """ return the position properties found in property `names`, or None 
+    
+    Either ['XX','YY','ZZ'], ['x','y','z'] or 'position' (a vector property)
+    """
+    if 'XX' in names and 'YY' in names and 'ZZ' in names:
+        return ['XX','YY','ZZ']
+    elif 'x' in names and 'y' in names and 'z' in names:
+        return ['x','y','z']
+    elif 'position' in names:
+        return 'position'
+    return None
+    
+def mtg_features(g):
+    """ return the features of `g` that can be written by `write_mtg_stream`
+    
+    These are the properties with numerical values. A vector 'position' 
+    property is written as the 'XX', 'YY' and 'ZZ' features.
+    """
+    features = []
+    if detect_position(g.property_names())=='position':
+        position = g.property('position')
+        def coordinate(i):
+            def get_value(vid):
+                value = position.get(vid)
+                return None if value is None else value[i]
+            return get_value
+        features = [(name,'REAL',coordinate(i)) for i,name in enumerate(['XX','YY','ZZ'])]
+        
+    for name in sorted(g.property_names()):
+        if name in ('edge_type','index','label','position'):
+            continue
+        values = [value for value in g.property(name).itervalues() if value is not None]
+        if all(isinstance(value,_numbers.Integral) for value in values):
+            features.append((name,'INT',g.property(name).get))
+        elif all(isinstance(value,_numbers.Real) for value in values):
+            features.append((name,'REAL',g.property(name).get))
+    return features
+    
+def _write_mtg(filename, g):
+    write_mtg_stream(filename, g, mtg_features(g))
+    
+TREE_READERS = {'.bmtg':readfile, '.tmtg':read_tmtg, '.mtg':read_mtg_stream}
+TREE_WRITERS = {'.bmtg':writefile, '.tmtg':write_tmtg, '.mtg':_write_mtg}
+
+def read_tree(filename):
+    """ read the mtg stored in `filename`, with the reader of its extension """
+    ext = _os.path.splitext(filename)[1].lower()
+    return TREE_READERS.get(ext, read_mtg_stream)(filename)
+    
+def write_tree(filename, g):
+    """ write mtg `g` in `filename` atomically, with the writer of its extension """
+    ext = _os.path.splitext(filename)[1].lower()
+    if ext not in TREE_WRITERS:
+        raise IOError('unknown tree file format: '+ext)
+    with atomic_write(filename) as tmpname:
+        TREE_WRITERS[ext](tmpname, g)
+
+def _canonical_segments(g):
+    """ return the segments of `g` in the order written by `write_mtg_stream` """
+    max_scale = g.max_scale()
+    edge_type = g.property('edge_type')
+    roots = sorted(vid for vid,scale in g._scale.iteritems() 
+                            if scale==max_scale and g._parent.get(vid) is None)
+    order = []
+    stack = roots[::-1]
+    while stack:
+        vid = stack.pop()
+        order.append(vid)
+        children = g._children.get(vid) or []
+        successors = [child for child in children if edge_type.get(child)=='<'][:1]
+        stack.extend(successors)
+        stack.extend(child for child in reversed(children) if child not in successors)
+    return order
+    
+def tree_signature(g):
+    """ return a description of the segments of `g` that does not depend on ids
+    
+    It is a dict of:
+      - 'parents':   the canonical index of the parent of each segment (or -1)
+      - 'edges':     the edge type of each segment ('<' or '+')
+      - 'complexes': the canonical index of the first segment of the complex
+                     of each segment, for each coarser scale
+      - 'positions': the (N,3) array of segments position
+    where segments are given in the order of `write_mtg_stream`.
+    """
+    segments = _canonical_segments(g)
+    index = dict((vid,i) for i,vid in enumerate(segments))
+    edge_type = g.property('edge_type')
+    complex_of = g._complex.get
+    
+    parents = [index.get(g._parent.get(vid),-1) for vid in segments]
+    edges = ['<' if edge_type.get(vid)=='<' else '+' for vid in segments]
+    
+    complexes = []
+    vertices = segments
+    for scale in range(g.max_scale()-1,0,-1):
+        vertices = map(complex_of, vertices)
+        first = {}
+        complexes.append([first.setdefault(cid,i) for i,cid in enumerate(vertices)])
+    
+    position = detect_position(g.property_names())
+    nan = float('nan')
+    if position is None:
+        positions = _np.empty((len(segments),3))
+        positions[:] = nan
+    elif isinstance(position,basestring):
+        prop = g.property(position)
+        positions = _np.array([tuple(prop.get(vid,(nan,)*3)) for vid in segments], dtype=float)
+    else:
+        props = map(g.property,position)
+        positions = _np.array([[prop.get(vid,nan) for prop in props] for vid in segments], dtype=float)
+        
+    return dict(parents=parents, edges=edges, complexes=complexes, 
+                positions=positions.reshape(-1,3))
+    
+def compare_trees(g1, g2):
+    """ return None if `g1` and `g2` have the same `tree_signature`, or a message """
+    s1, s2 = tree_signature(g1), tree_signature(g2)
+    if len(s1['parents'])!=len(s2['parents']):
+        return 'different number of segments: %d and %d' % (len(s1['parents']),len(s2['parents']))
+    for key, description in [('parents','parents'),('edges','edge types'),('complexes','complexes')]:
+        if s1[key]!=s2[key]:
+            return 'different segment '+description
+    p1, p2 = s1['positions'], s2['positions']
+    if not ((p1==p2)|(_np.isnan(p1)&_np.isnan(p2))).all():
+        return 'different segment positions'
+    return None
+    
+def _file_hash(filename):
+    sha = _hashlib.sha1()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(1<<20), ''):
+            sha.update(block)
+    return sha.hexdigest()
+    
+_CONVERSION_MANIFEST = '.treeeditor-conversion.json'
+    
+def convert_file(source, target, verify=True, skip='mtime', source_hash=None):
+    """ convert tree file `source` to `target`, with format given by extensions
+    
+    `verify`: if True, `target` is read back and compared to `source` with
+              `compare_trees`. An IOError is raised if they differ
+    `skip`:   if 'mtime', nothing is done if `target` is more recent than 
+              `source`. If 'hash', nothing is done if `target` exists and the
+              sha1 of `source` is `source_hash`. If None, always convert.
+              
+    return a dict of the conversion report: 'source', 'target', 'status' (
+    'converted', 'skipped' or 'error'), 'bytes' (source size), 'time', 'hash'
+    (the source sha1, if skip is 'hash') and 'error' (the error message)
+    """
+    start = _time.time()
+    report = dict(source=source, target=target, status='converted', bytes=0)
+    try:
+        report['bytes'] = _getsize(source)
+        if skip=='hash':
+            report['hash'] = _file_hash(source)
+        if _os.path.exists(target):
+            if skip=='mtime' and _os.path.getmtime(target)>=_os.path.getmtime(source):
+                report['status'] = 'skipped'
+            elif skip=='hash' and report['hash']==source_hash:
+                report['status'] = 'skipped'
+                
+        if report['status']!='skipped':
+            g = read_tree(source)
+            write_tree(target, g)
+            if verify:
+                difference = compare_trees(g, read_tree(target))
+                if difference:
+                    raise IOError('conversion is not exact: '+difference)
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = '%s: %s' % (type(e).__name__, e)
+    report['time'] = _time.time()-start
+    return report
+    
+def _convert_file(args):
+    """ call `convert_file` in a pool worker """
+    source, target, kargs = args
+    return convert_file(source, target, **kargs)
+    
+def convert_files(sources, extension, output=None, verify=True, skip='mtime',
+                  processes=None, callback=None):
+    """ convert the tree files `sources` to format `extension`, concurrently
+    
+    `extension`: the extension of the converted files, such as '.tmtg'
+    `output`:    the directory of the converted files. If None, they are 
+                 written in the directory of their source.
+    `verify`, `skip`: see `convert_file`. With skip='hash', the sha1 of the 
+                 converted sources are stored in a '.treeeditor-conversion.json'
+                 file in the directories of converted files.
+    `processes`: number of worker processes, default is the cpu number.
+                 If 1, files are converted in the current process.
+    `callback`:  optional function called with each conversion report, as 
+                 soon as it is done
+    
+    return the list of conversion reports (see `convert_file`), and a dict 
+    of the throughput: number of 'files', of 'converted', 'skipped' and 
+    'errors', the converted 'bytes', the 'time' and 'files_per_s', 'mb_per_s'.
+    """
+    start = _time.time()
+    if output and not _os.path.exists(output):
+        _os.makedirs(output)
+    
+    def target_of(source):
+        directory = output or _os.path.dirname(source)
+        name = _os.path.splitext(_os.path.basename(source))[0]+extension
+        return _os.path.join(directory, name)
+    targets = map(target_of, sources)
+    
+    # conversion manifests: target name -> source sha1, for each directory
+    manifests = {}
+    def manifest(target):
+        directory = _os.path.dirname(target)
+        if directory not in manifests:
+            filename = _os.path.join(directory, _CONVERSION_MANIFEST)
+            if _os.path.exists(filename):
+                with open(filename) as f:
+                    manifests[directory] = _json.load(f)
+            else:
+                manifests[directory] = {}
+        return manifests[directory]
+        
+    tasks = []
+    for source, target in zip(sources, targets):
+        kargs = dict(verify=verify, skip=skip)
+        if skip=='hash':
+            kargs['source_hash'] = manifest(target).get(_os.path.basename(target))
+        tasks.append((source, target, kargs))
+        
+    if processes==1 or len(tasks)<=1:
+        results = (_convert_file(task) for task in tasks)
+        pool = None
+    else:
+        pool = _multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_convert_file, tasks, chunksize=1)
+        
+    reports = []
+    try:
+        for report in results:
+            reports.append(report)
+            if report['status']=='converted' and skip=='hash':
+                manifest(report['target'])[_os.path.basename(report['target'])] = report['hash']
+            if callback:
+                callback(report)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+            
+    for directory, content in manifests.iteritems():
+        with atomic_write(_os.path.join(directory, _CONVERSION_MANIFEST)) as tmpname:
+            with open(tmpname,'w') as f:
+                _json.dump(content, f)
+    
+    duration = max(_time.time()-start, 1e-9)
+    converted = [r for r in reports if r['status']=='converted']
+    nbytes = sum(r['bytes'] for r in converted)
+    throughput = dict(files=len(reports), converted=len(converted),
+                      skipped=sum(1 for r in reports if r['status']=='skipped'),
+                      errors=sum(1 for r in reports if r['status']=='error'),
+                      bytes=nbytes, time=duration,
+                      files_per_s=len(converted)/duration, mb_per_s=nbytes/duration/2.**20)
+    return reports, throughput
+    
+    
 # shared data
 # -----------
 def get_shared_data(*args):
@@ -21,6 +21,7 @@ MAGENTA = _Material((220,  0,100))
 THEME = {'point_diameter': 30,
          'point_slices': 8,
          'point_stacks': 8,
+         'point_width': 6,
          'point_color':    LGREEN,
          'pointset_color': BROWN,
          'background':     LGRAY,
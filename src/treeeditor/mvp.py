@@ -36,8 +36,7 @@ AbstractMVP
     It also manage the action registering.
 
 Model
-    Simply an AbstractMVP. Maybe it will later provide some standard interfaces 
-    for model edition and updates.
+    An AbstractMVP which publishes its changes to subscribers (see below)
 
 AbstractViewable
     Abstract class parent of View and Presenter, which can both be displayed.
@@ -50,7 +49,7 @@ Presenter
     It manages a list AbstractViewable (View and sub-presenters) and all 
     downward communication (container-to-component). It should be used as base
     class to implement specific Model-View-Presenter block.
-    Typical subclass is `treeeditor.tree.TreePresenter`
+    Typical subclass is `treeeditor.tree.presenter.TreePresenter`
 
 AbstractEditor
     Definition of a part of the Editor API. Mainly, it is a Presenter that keep
@@ -94,6 +93,25 @@ _compute_boundingbox
     Note that this method can also be used to set the bounding box.
 
 
+Change notification
+-------------------
+Models publish the changes of their content as `ModelChanges`: the sets of 
+element ids that have been added, removed, moved, retyped or reparented.
+Views, caches and indices which depend on a model `subscribe` to it, instead 
+of relying on the code that edits the model to tell them what to update.
+
+notify
+    Called by model edition methods to record changed elements.
+    
+batch
+    Context manager which groups the notifications of all editions done within
+    it: subscribers are called once, at the end, with the merged changes. 
+    Outside of batches, notifications are published immediately.
+    
+subscribe
+    Register a function which is called with the published `ModelChanges`
+
+
 Actions
 -------
 Any components can define actions, using the `add_***_actions` methods. The list
@@ -134,6 +152,9 @@ Possible improvements:
  * add 'isenable' callback to action dict
 """
 
+from contextlib import contextmanager as _contextmanager
+from functools  import wraps          as _wraps
+
 
 class AbstractMVP(object):
 
@@ -253,10 +274,133 @@ class AbstractMVP(object):
         self._view_actions.append(action)
 
 
+class ModelChanges(object):
+
+    """ Sets of the ids of model elements changed by a batch of editions
+
+    The kinds of change are:
+      - added:      new elements
+      - removed:    deleted elements
+      - moved:      elements which geometry has changed
+      - retyped:    elements which type (e.g. edge type or complex) has changed
+      - reparented: elements which parent has changed
+
+    Elements added or removed are not reported in the other kinds of change, 
+    and elements added then removed are not reported at all.
+    """
+    KINDS = ('added', 'removed', 'moved', 'retyped', 'reparented')
+
+    def __init__(self):
+        for kind in self.KINDS:
+            setattr(self, kind, set())
+        self._transient = set()   # elements added then removed
+
+    def __len__(self):
+        """ number of changed elements """
+        return len(set().union(*[getattr(self, kind) for kind in self.KINDS]))
+
+    def add(self, kind, ids):
+        """ record that elements `ids` have had change `kind` """
+        if kind == 'added':
+            for eid in ids:
+                if eid in self.removed:
+                    # removed then restored: an update of all kinds
+                    self.removed.discard(eid)
+                    for other in self.KINDS[2:]:
+                        getattr(self, other).add(eid)
+                else:
+                    self.added.add(eid)
+        elif kind == 'removed':
+            for eid in ids:
+                if eid in self.added:
+                    self.added.discard(eid)
+                    self._transient.add(eid)
+                else:
+                    self.removed.add(eid)
+        else:
+            getattr(self, kind).update(ids)
+
+    def updated(self):
+        """ return the set of elements moved, retyped or reparented """
+        return self.moved | self.retyped | self.reparented
+
+    def _finalize(self):
+        """ remove elements added or removed from the other changes """
+        for kind in self.KINDS[2:]:
+            changed = getattr(self, kind)
+            changed.difference_update(self.added)
+            changed.difference_update(self.removed)
+            changed.difference_update(self._transient)
+
+
+def batched(method):
+    """ decorator of Model methods which changes are published at once """
+    @_wraps(method)
+    def batched_method(self, *args, **kargs):
+        with self.batch():
+            return method(self, *args, **kargs)
+    return batched_method
+
+
 class Model(AbstractMVP):
 
-    """ unspecialized class """
-    pass
+    """ Base class of models, which publish their changes to subscribers """
+
+    def __init__(self, theme=None, presenter=None):
+        AbstractMVP.__init__(self, theme=theme, presenter=presenter)
+        self._subscribers = []
+        self._changes = None     # ModelChanges of the current batch
+        self._batch_depth = 0
+
+    def subscribe(self, callback):
+        """ call `callback` with the `ModelChanges` of each model edition """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """ stop calling `callback` at model edition """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def notify(self, kind, ids):
+        """ record change `kind` of the elements `ids` (an id or list of ids)
+
+        The change is published at the end of the current batch, if any, or
+        immediately otherwise. See `ModelChanges` for the kinds of change
+        """
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids or not self._subscribers:
+            return
+        if self._changes is None:
+            self._changes = ModelChanges()
+        self._changes.add(kind, ids)
+        if self._batch_depth == 0:
+            self._publish()
+
+    @_contextmanager
+    def batch(self):
+        """ context manager grouping the notifications done in its scope """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._publish()
+
+    def discard_changes(self):
+        """ drop the changes recorded in the current batch """
+        self._changes = None
+
+    def _publish(self):
+        """ call subscribers with the recorded changes, if any """
+        changes, self._changes = self._changes, None
+        if not changes:
+            return
+        changes._finalize()
+        for callback in list(self._subscribers):
+            callback(changes)
 
 
 class AbstractViewable(AbstractMVP):
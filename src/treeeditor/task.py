@@ -0,0 +1,73 @@
+"""
+Background tasks
+
+A `Task` runs a function in a worker thread, such that long operations (such
+as loading or saving files) do not freeze the GUI. The task result, or the
+exception it raised, is retrieved with `get_result` once it is done.
+
+The function is called with a `progress` keyword argument: a function that
+it can call with the fraction of the work done (in [0,1]), which is then
+available as `Task.progress`.
+
+Task objects do not call back the GUI: the GUI thread should poll them
+(typically using a timer), for example:
+
+    task = Task(load, filename)
+    task.start()
+    ...
+    if task.is_done():
+        model = task.get_result()
+"""
+import sys as _sys
+import threading as _threading
+
+
+class Task(object):
+    """ A function call processed in a worker thread """
+    def __init__(self, function, *args, **kargs):
+        """ create the task calling `function(*args, progress=callback, **kargs)` """
+        self.function = function
+        self.args  = args
+        self.kargs = kargs
+
+        self.progress = None   # last reported progress, in [0,1]
+        self._result = None
+        self._error  = None    # exc_info of the exception raised by function
+        self._done   = _threading.Event()
+        self._thread = None
+
+    def start(self):
+        """ start processing the task in a worker thread """
+        self._thread = _threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        """ process the task in the current thread """
+        try:
+            self._result = self.function(progress=self.set_progress, *self.args, **self.kargs)
+        except Exception:
+            self._error = _sys.exc_info()
+        finally:
+            self._done.set()
+
+    def set_progress(self, fraction):
+        """ called by the task function to report its progress """
+        self.progress = fraction
+
+    def is_done(self):
+        """ True if the task has been processed """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """ wait for the task to be processed, return `is_done()` """
+        self._done.wait(timeout)
+        return self.is_done()
+
+    def get_result(self):
+        """ return the task result, or raise the exception of the task function """
+        if not self.is_done():
+            raise RuntimeError("task is not done")
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
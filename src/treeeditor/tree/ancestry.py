@@ -0,0 +1,183 @@
+"""
+Ancestry index of dynamic forests
+
+`AncestryIndex` answers ancestry queries - `is_ancestor`, `lca` (lowest common
+ancestor) and `root` - on a forest which is edited by changing the parent of
+its vertices. It is implemented as a link-cut tree (Sleator & Tarjan): the
+forest is decomposed in paths, each stored in a splay tree ordered by depth.
+Queries and editions run in O(log n) amortized time, n being the number of
+vertices: contrary to labeling schemes (such as Euler tour intervals or depth
+with jump pointers), moving a subtree does not require to relabel it.
+
+Usage
+-----
+    index = AncestryIndex(parents)          # dict vertex -> parent (or None)
+    index.is_ancestor(a, b)                 # True if a is b or one of its ancestors
+    index.update({b:c}, removed=[d])        # set c as parent of b, remove d
+
+The index only stores the forest structure: the user should call `update`
+with all the vertices which parent has changed.
+"""
+
+class AncestryIndex(object):
+    """ Link-cut tree of a forest, to answer ancestry queries in O(log n) """
+    def __init__(self, parents=None):
+        """ create the index of the forest given by dict `parents`
+
+        `parents` maps vertex ids to their parent id, or None for roots.
+        """
+        self._parent = {}   # vertex -> parent in the forest
+        self._up     = {}   # splay tree parent, or path parent for splay tree roots
+        self._left   = {}   # splay tree children: ancestors on the path...
+        self._right  = {}   # ... and descendants
+        if parents:
+            self._parent.update(parents)
+            self._up.update(parents)   # each vertex is its own path
+            for pid in parents.itervalues():
+                if pid is not None and pid not in self._parent:
+                    self._parent[pid] = None
+
+    def __len__(self):
+        return len(self._parent)
+
+    def __contains__(self, vid):
+        return vid in self._parent
+
+    def parent(self, vid):
+        """ return the parent of `vid` stored in the index """
+        return self._parent.get(vid)
+
+    # queries
+    # -------
+    def is_ancestor(self, ancestor, vid):
+        """ True if `ancestor` is `vid`, or one of its ancestors """
+        if ancestor==vid:
+            return True
+        if ancestor not in self._parent or vid not in self._parent:
+            return False
+        self._access(ancestor)
+        return self._access(vid)==ancestor
+
+    def lca(self, vid1, vid2):
+        """ return the lowest common ancestor of `vid1` and `vid2`, or None """
+        if vid1 not in self._parent or vid2 not in self._parent:
+            return None
+        if self.root(vid1)!=self.root(vid2):
+            return None
+        self._access(vid1)
+        return self._access(vid2)
+
+    def root(self, vid):
+        """ return the root of the tree containing `vid` """
+        if vid not in self._parent:
+            return vid
+        self._access(vid)
+        left = self._left
+        root = vid
+        while left.get(root) is not None:
+            root = left[root]
+        self._splay(root)
+        return root
+
+    # edition
+    # -------
+    def update(self, parents, removed=()):
+        """ update the index
+
+        `parents`: dict of vertex ids to their new parent (or None for roots).
+                   Vertices not in the index are added.
+        `removed`: list of the vertices to remove from the index
+
+        All the vertices which parent has changed should be given at once,
+        such that the updated forest does not contain cycles.
+        """
+        removed = [vid for vid in removed if vid in self._parent]
+        changed = [vid for vid,pid in parents.iteritems()
+                           if vid not in self._parent or self._parent[vid]!=pid]
+
+        for vid in removed+changed:
+            if self._parent.get(vid) is not None:
+                self._cut(vid)
+        for vid in removed:
+            for content in (self._parent, self._up, self._left, self._right):
+                content.pop(vid,None)
+        for vid in changed:
+            self._parent.setdefault(vid,None)
+            pid = parents[vid]
+            if pid is not None:
+                self._parent.setdefault(pid,None)
+                self._link(vid, pid)
+
+    def _link(self, vid, parent):
+        """ attach root `vid` to `parent` """
+        self._access(vid)
+        self._up[vid] = parent
+        self._parent[vid] = parent
+
+    def _cut(self, vid):
+        """ detach `vid` from its parent """
+        self._access(vid)
+        ancestors = self._left.pop(vid,None)
+        if ancestors is not None:
+            self._up[ancestors] = None
+        self._parent[vid] = None
+
+    # link-cut tree
+    # -------------
+    def _access(self, vid):
+        """ make the path from the root to `vid` preferred, and splay `vid`
+
+        return the last vertex where the path joined the root path
+        """
+        right, up = self._right, self._up
+        last = None
+        node = vid
+        while node is not None:
+            self._splay(node)
+            right[node] = last
+            last = node
+            node = up.get(node)
+        self._splay(vid)
+        return last
+
+    def _is_splay_root(self, node):
+        up = self._up.get(node)
+        return up is None or (self._left.get(up)!=node and self._right.get(up)!=node)
+
+    def _rotate(self, node):
+        """ rotate `node` with its splay tree parent """
+        left, right, up = self._left, self._right, self._up
+        parent = up[node]
+        grand  = up.get(parent)
+        parent_is_root = self._is_splay_root(parent)
+
+        if left.get(parent)==node:
+            child = right.get(node)
+            left[parent] = child
+            right[node]  = parent
+        else:
+            child = left.get(node)
+            right[parent] = child
+            left[node]    = parent
+        if child is not None:
+            up[child] = parent
+
+        if not parent_is_root:
+            if left.get(grand)==parent: left[grand]  = node
+            else:                       right[grand] = node
+        up[node]   = grand   # splay parent, or the path parent of `parent`
+        up[parent] = node
+
+    def _splay(self, node):
+        """ move `node` to the root of its splay tree """
+        left, up = self._left, self._up
+        is_root = self._is_splay_root
+        while not is_root(node):
+            parent = up[node]
+            if not is_root(parent):
+                grand = up[parent]
+                if (left.get(grand)==parent)==(left.get(parent)==node):
+                    self._rotate(parent)
+                else:
+                    self._rotate(node)
+            self._rotate(node)
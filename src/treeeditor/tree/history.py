@@ -0,0 +1,332 @@
+"""
+Undo/redo journal of mtg edition
+
+Instead of storing a copy of the whole mtg at each backup, the `History`
+records the state of the vertices that are touched by an edition: their
+topology (parent, children, complex, components and scale) and their
+properties. Undoing an edition restores the recorded *before* states, and
+redoing it restores the *after* states. The cost of both operations, as well
+as the memory used, is proportional to the number of touched vertices, not to
+the size of the mtg.
+
+Usage
+-----
+    history = History(mtg)
+    history.begin(state)      # start recording an edition
+    history.touch(vertex)     # before modifying `vertex`
+    history.created(vertex)   # after creating `vertex`
+    history.touch_properties(names, vertices)  # before modifying only properties
+    ...
+    history.undo()            # restore state before edition (and return it)
+    history.redo()            # restore state after edition
+
+The current edition can also be cancelled with `history.rollback()`.
+
+Vertices should be touched *before* they are modified, which is done by the
+edition methods of `treeeditor.tree.model.TreeModel`. A vertex `v` has to be
+touched when any of these is changed: its parent, its list of children, its
+complex, its list of components or any of its properties.
+
+Bulk editions of some properties only, such as the positions of all segments,
+can use `touch_properties` instead: only the values of these properties are
+recorded, which is much cheaper than the whole vertex state.
+"""
+
+# mtg topology dictionaries recorded for each vertex
+_TOPOLOGY = ('_parent', '_children', '_complex', '_components', '_scale')
+_LISTS    = ('_children', '_components')
+_COMPLEX  = _TOPOLOGY.index('_complex')
+_SCALE    = _TOPOLOGY.index('_scale')
+_ABSENT   = object()
+
+
+def capture_vertex(mtg, vid):
+    """ return the recorded state of vertex `vid` of `mtg` (None if absent) """
+    if not mtg.has_vertex(vid):
+        return None
+
+    topology = []
+    for name in _TOPOLOGY:
+        value = getattr(mtg,name).get(vid,_ABSENT)
+        if name in _LISTS and value is not _ABSENT:
+            value = list(value)
+        topology.append(value)
+
+    properties = dict((name,prop[vid]) for name,prop in mtg.properties().iteritems()
+                                       if vid in prop)
+    return topology, properties
+
+def restore_properties(mtg, records):
+    """ restore the property values `records`: dict (name, dict (vid, value)) """
+    for name, values in records.iteritems():
+        prop = mtg.property(name)
+        for vid, value in values.iteritems():
+            if value is _ABSENT:
+                prop.pop(vid,None)
+            else:
+                prop[vid] = value
+
+def restore_vertex(mtg, vid, record):
+    """ restore vertex `vid` of `mtg` to `record` (see `capture_vertex`) """
+    if record is None:
+        topology = [_ABSENT]*len(_TOPOLOGY)
+        properties = {}
+    else:
+        topology, properties = record
+
+    for name, value in zip(_TOPOLOGY, topology):
+        content = getattr(mtg,name)
+        if value is _ABSENT:
+            content.pop(vid,None)
+        elif name in _LISTS:
+            content[vid] = list(value)
+        else:
+            content[vid] = value
+
+    for name, prop in mtg.properties().iteritems():
+        if name in properties:
+            prop[vid] = properties[name]
+        else:
+            prop.pop(vid,None)
+
+
+class HistoryEntry(object):
+    """ Record of one edition: the before and after states of touched vertices """
+    def __init__(self, state=None):
+        self.state  = state
+        self.before = {}     # vertex id -> record before edition
+        self.after  = None   # vertex id -> record after edition (set by `close`)
+        self.properties_before = {}   # name -> dict (vertex id -> property value)
+        self.properties_after  = None # for vertices with only recorded properties
+        self._property_scales  = {}   # vertex id -> scale, of these vertices
+
+    def __len__(self):
+        """ number of vertices touched by the edition """
+        return len(self.before) + len(self._property_vertices())
+
+    def size(self):
+        """ number of stored vertex records """
+        values = sum(map(len, self.properties_before.itervalues()))
+        if self.after is None:
+            return len(self.before) + values
+        return 2*(len(self.before) + values)
+
+    def vertices(self):
+        """ return the list of vertices touched by the edition """
+        return self.before.keys() + list(self._property_vertices())
+
+    def _property_vertices(self):
+        """ vertices which properties only have been recorded """
+        vertices = set()
+        for values in self.properties_before.itervalues():
+            vertices.update(values)
+        vertices.difference_update(self.before)
+        return vertices
+
+    def close(self, mtg):
+        """ record the after-edition state of touched vertices """
+        self.after = dict((vid,capture_vertex(mtg,vid)) for vid in self.before)
+        self.properties_after = {}
+        for name, values in self.properties_before.iteritems():
+            prop = mtg.property(name)
+            self.properties_after[name] = dict((vid,prop.get(vid,_ABSENT)) for vid in values)
+        self._property_scales = dict((vid,mtg._scale.get(vid)) for vid in self._property_vertices())
+
+    def restore(self, mtg, undo=True):
+        """ restore the state of `mtg` before (or after) the edition """
+        if undo:
+            records, properties = self.before, self.properties_before
+        else:
+            records, properties = self.after, self.properties_after
+        for vid, record in records.iteritems():
+            restore_vertex(mtg, vid, record)
+        restore_properties(mtg, properties)
+
+    def changes(self, undo=True, scale=None):
+        """ return the (added, removed, updated) vertices by undo (or redo)
+
+        If `scale` is given, only the vertices at this scale are returned
+        """
+        if undo: src, dst = self.after,  self.before
+        else:    src, dst = self.before, self.after
+        vertices = dst
+        if scale is not None:
+            record = lambda vid: src[vid] or dst[vid]
+            vertices = [vid for vid in dst if record(vid) and record(vid)[0][_SCALE]==scale]
+        added   = set(vid for vid in vertices if src[vid] is None and dst[vid] is not None)
+        removed = set(vid for vid in vertices if dst[vid] is None and src[vid] is not None)
+        updated = set(vid for vid in vertices if src[vid] is not None and dst[vid] is not None)
+        updated.update(vid for vid,vid_scale in self._property_scales.iteritems()
+                               if scale is None or vid_scale==scale)
+        return added, removed, updated
+
+    def complex_changed(self):
+        """ return the vertices which complex differs before and after edition """
+        if self.after is None:
+            return []
+        after = self.after
+        return [vid for vid,record in self.before.iteritems()
+                    if record and after[vid] and record[0][_COMPLEX]!=after[vid][0][_COMPLEX]]
+
+
+class History(object):
+    """ Undo/redo journal of the editions of an mtg """
+    def __init__(self, mtg, depth=10, budget=1000000):
+        """ create an empty History for `mtg`
+
+        `depth`:  maximum number of stored editions
+        `budget`: maximum number of vertex records stored in all editions.
+                  It is the memory budget of the history. The last edition is
+                  always kept, whatever its size.
+        """
+        self.mtg = mtg
+        self.depth  = depth
+        self.budget = budget
+        self.clear()
+
+    def clear(self):
+        """ remove all recorded editions """
+        self._undo    = []
+        self._redo    = []
+        self._current = None
+        self._size    = 0
+
+    # recording
+    # ---------
+    def begin(self, state=None):
+        """ start recording a new edition, with associated `state` """
+        self.close()
+        self._current = HistoryEntry(state)
+
+    def is_recording(self):
+        """ True if an edition is being recorded """
+        return self._current is not None
+
+    def touch(self, vertices):
+        """ record the current state of `vertices` (an id or list of ids)
+
+        To be called before these vertices are modified. Vertices already
+        recorded by the current edition are ignored.
+        If no edition is being recorded, it only drops the redo list.
+        """
+        if isinstance(vertices,(int,long)):
+            vertices = [vertices]
+
+        if self._current is None:
+            self._redo = []
+            return
+
+        before = self._current.before
+        for vid in vertices:
+            if vid is not None and vid not in before:
+                before[vid] = capture_vertex(self.mtg, vid)
+
+    def touch_properties(self, names, vertices):
+        """ record the current values of properties `names` of `vertices`
+
+        To be called before these properties, and only them, are modified.
+        Vertices already recorded by the current edition are ignored.
+        If no edition is being recorded, it only drops the redo list.
+        """
+        if self._current is None:
+            self._redo = []
+            return
+
+        before = self._current.before
+        properties = self._current.properties_before
+        for name in names:
+            prop = self.mtg.property(name)
+            values = properties.setdefault(name,{})
+            for vid in vertices:
+                if vid not in values and vid not in before:
+                    values[vid] = prop.get(vid,_ABSENT)
+
+    def created(self, vertices):
+        """ record that `vertices` (an id or list of ids) did not exist before """
+        if isinstance(vertices,(int,long)):
+            vertices = [vertices]
+
+        if self._current is None:
+            self._redo = []
+            return
+
+        before = self._current.before
+        for vid in vertices:
+            before.setdefault(vid, None)
+
+    def close(self):
+        """ end recording of current edition, if any, and return it
+
+        Empty editions are dropped (and None is returned). Otherwise, it is 
+        added to the undo list, the redo list is cleared and older editions 
+        are dropped if the depth or the budget of the history is exceeded.
+        """
+        entry = self._current
+        self._current = None
+        if entry is None or len(entry)==0:
+            return None
+
+        entry.close(self.mtg)
+        self._undo.append(entry)
+        self._redo = []
+        self._size += entry.size()
+
+        while len(self._undo)>1 and (len(self._undo)>self.depth or self._size>self.budget):
+            self._size -= self._undo.pop(0).size()
+
+        return entry
+
+    def rollback(self):
+        """ cancel current edition: restore the state before it and drop it
+
+        return the cancelled HistoryEntry, or None if no edition is recorded
+        """
+        entry = self._current
+        self._current = None
+        if entry is None:
+            return None
+        entry.restore(self.mtg, undo=True)
+        return entry
+
+    # undo/redo
+    # ---------
+    def undo(self):
+        """ restore state before last edition, and return its HistoryEntry """
+        self.close()
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._size -= entry.size()
+        entry.restore(self.mtg, undo=True)
+        self._redo.append(entry)
+        return entry
+
+    def redo(self):
+        """ restore state after last undone edition, and return its HistoryEntry """
+        self.close()
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        entry.restore(self.mtg, undo=False)
+        self._undo.append(entry)
+        self._size += entry.size()
+        return entry
+
+    def next_undo(self):
+        """ return the HistoryEntry restored by the next `undo`, or None """
+        self.close()
+        return self._undo[-1] if self._undo else None
+
+    def next_redo(self):
+        """ return the HistoryEntry restored by the next `redo`, or None """
+        self.close()
+        return self._redo[-1] if self._redo else None
+
+    def undo_number(self):
+        """ number of undo available """
+        current = 1 if self._current is not None and len(self._current) else 0
+        return len(self._undo) + current
+
+    def redo_number(self):
+        """ number of redo available """
+        return len(self._redo)
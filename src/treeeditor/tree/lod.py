@@ -0,0 +1,327 @@
+"""
+Level of detail of the edges of a tree
+
+`AxisLOD` splits the axes of a tree (chains of successors, see
+`TreeModel.local_axis`) in chunks of at most `AxisLOD.chunk_size` edges. For
+each chunk, it stores the chunk bounding box and the Douglas-Peucker error of
+all its points (see `simplification_errors`), such that the chunk polylines
+simplified at any tolerance are computed at once. Consecutive edges of
+different colors are in different polylines, which end points are kept at all
+levels.
+
+Levels are indexed by an integer: level 0 is the full resolution, and level
+`i>0` is the simplification with tolerance `tolerances[i-1]`, which increase
+geometrically from a fraction of the tree size. Level -1 is empty: it is used
+for the chunks culled out of the camera view.
+
+At draw time, `select` returns the level of each chunk: the coarsest one with
+a tolerance smaller than the size of a pixel at the chunk distance from the
+camera (see `distances`). Chunks close to given positions, such as the
+selected node, are kept at full resolution.
+
+Usage
+-----
+    lod = AxisLOD()
+    lod.build(model, key_of)                  # key_of(vids) -> color key of edges
+    chunks, levels = lod.select(pixel_size*lod.distances(eye))
+    for key, points in lod.lines(chunks[0], levels[0]): ...
+
+    # after edition
+    removed_chunks = lod.update(model, key_of, changed_vids, removed_vids)
+"""
+import numpy as _np
+
+_INF = float('inf')
+
+
+def simplification_errors(points, fixed=None):
+    """ return the Douglas-Peucker error of the `points` of a polyline
+
+    The error of a point is the distance at which the Douglas-Peucker algorithm
+    splits the polyline at this point (and infinite for the end points). It is
+    bounded by the error of the enclosing split, such that the points which
+    error is greater than a tolerance are those kept by the Douglas-Peucker
+    simplification with this tolerance.
+
+    `fixed`: optional boolean array of the points to keep at all tolerances
+             (by default, the end points). Points between consecutive fixed
+             points are independent polylines, which are processed together:
+             each iteration splits all the polylines at their farthest point.
+    """
+    points = _np.asarray(points, dtype=float).reshape(-1,3)
+    errors = _np.empty(len(points))
+    errors[:] = _INF
+    if len(points)<3:
+        return errors
+    if fixed is None:
+        split = _np.zeros(len(points), dtype=bool)
+        split[[0,-1]] = True
+    else:
+        split = _np.array(fixed, dtype=bool)
+
+    active = _np.flatnonzero(~split)
+    while len(active):
+        # segment [first,last] enclosing each active point
+        split_index = _np.flatnonzero(split)
+        index = _np.searchsorted(split_index, active)
+        first = split_index[index-1]
+        last  = split_index[index]
+        distances = _segment_distances(points[active], points[first], points[last])
+        distances[_np.isnan(distances)] = _INF
+
+        # split each segment at its farthest point, bounded by the enclosing split error
+        starts = _np.flatnonzero(_np.r_[True, index[1:]!=index[:-1]])
+        segment = _np.cumsum(_np.r_[True, index[1:]!=index[:-1]])-1
+        farthest = _np.maximum.reduceat(distances, starts)
+        candidates = _np.flatnonzero(distances==farthest[segment])
+        candidates = candidates[_np.unique(segment[candidates], return_index=True)[1]]
+        bound = _np.minimum(errors[first[candidates]], errors[last[candidates]])
+        errors[active[candidates]] = _np.minimum(distances[candidates], bound)
+        split[active[candidates]] = True
+        active = _np.delete(active, candidates)
+    return errors
+
+def douglas_peucker(points, tolerance):
+    """ return the indices of the `points` of a polyline kept at `tolerance` """
+    return _np.flatnonzero(simplification_errors(points)>tolerance)
+
+def _segment_distances(points, starts, ends):
+    """ return the distances of `points` to the segments [`starts`,`ends`] """
+    directions = ends-starts
+    length2 = (directions**2).sum(axis=1)
+    relative = points-starts
+    t = (relative*directions).sum(axis=1)/_np.where(length2>0,length2,1)
+    t = _np.clip(t, 0, 1)
+    return ((relative - t[:,None]*directions)**2).sum(axis=1)**.5
+
+
+class _Chunk(object):
+    """ Chain of edges, from the `anchor` parent to the last of `vids` """
+    def __init__(self, anchor, vids):
+        self.anchor = anchor   # parent of the first vertex (None for a root)
+        self.vids = vids       # chained vertices, each the parent of the next
+        self.points = None     # positions of anchor (if any) and vids
+        self.errors = None     # simplification error of points
+        self.runs = []         # list of (color key, first, last) index of points
+        self.lines = {}        # level -> list of (color key, points)
+
+    def edges(self):
+        """ the vertices of the edges drawn by this chunk """
+        return self.vids if self.anchor is not None else self.vids[1:]
+
+
+class AxisLOD(object):
+    """ Multi-resolution polylines of the axes of a tree """
+    chunk_size   = 64     # maximum number of edges in a chunk
+    level_number = 4      # number of simplified levels
+    level_ratio  = 4.     # ratio of consecutive tolerances
+    base_tolerance = 1./4096  # tolerance of level 1, relative to the tree size
+
+    def __init__(self):
+        """ create an empty AxisLOD """
+        self.clear()
+
+    def clear(self):
+        """ remove all chunks """
+        self.tolerances = _np.array([])
+        self._chunks = {}      # chunk id -> _Chunk
+        self._chunk_of = {}    # vertex id -> chunk id
+        self._next_id = 0
+        self._bounds = None    # (ids, lower, upper) arrays of chunks, sorted by id
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def chunk_of(self, vid):
+        """ return the id of the chunk containing vertex `vid` (or None) """
+        return self._chunk_of.get(vid)
+
+    # creation and update
+    # -------------------
+    def build(self, model, key_of):
+        """ create the chunks of all the axes of `model`
+
+        `key_of`: function that returns the list of color keys of the edges
+                  of a list of vertices
+        """
+        self.clear()
+        self._add_chunks(model, key_of, self._chain(model, model.get_nodes()))
+
+        ids, lower, upper = self.bounds()
+        size = _np.nanmax(upper-lower) if len(ids) else 0
+        if not size>0:
+            size = 1.
+        self.tolerances = size*self.base_tolerance*self.level_ratio**_np.arange(self.level_number)
+
+    def update(self, model, key_of, vertices, removed=()):
+        """ update the chunks containing `vertices` and `removed` vertices
+
+        Chunks which parent chain is still valid are only refreshed (positions
+        and colors). Otherwise, their vertices are chained again, with the new
+        `vertices`.
+
+        return the set of the ids of the chunks which have been replaced
+        """
+        chunk_of = self._chunk_of
+        removed = set(removed)
+        dirty = set(chunk_of[vid] for vid in vertices if vid in chunk_of)
+        dirty.update(chunk_of[vid] for vid in removed if vid in chunk_of)
+
+        rechain = set(vid for vid in vertices if vid not in chunk_of and vid not in removed)
+        chunks = []
+        for chunk_id in dirty:
+            chunk = self._chunks.pop(chunk_id)
+            for vid in chunk.vids:
+                del chunk_of[vid]
+            if removed.isdisjoint(chunk.vids) and self._is_valid(model, chunk):
+                chunks.append(_Chunk(chunk.anchor, chunk.vids))
+            else:
+                rechain.update(vid for vid in chunk.vids if vid not in removed)
+
+        chunks.extend(self._chain(model, rechain))
+        self._add_chunks(model, key_of, chunks)
+        return dirty
+
+    @staticmethod
+    def _is_valid(model, chunk):
+        """ True if each vertex of `chunk` is the parent of the next """
+        parent = model.parent
+        previous = chunk.anchor
+        for vid in chunk.vids:
+            if parent(vid)!=previous:
+                return False
+            previous = vid
+        return True
+
+    def _chain(self, model, vertices):
+        """ return the chunks of successor chains of `vertices` """
+        vertices = set(vertices)
+        parent_of = model.parent
+        successor = model.successor
+        size = self.chunk_size
+        chunks = []
+        for vid in vertices:
+            parent = parent_of(vid)
+            if parent in vertices and successor(parent)==vid:
+                continue
+            chain = [vid]
+            next_vid = successor(vid)
+            while next_vid in vertices:
+                chain.append(next_vid)
+                next_vid = successor(next_vid)
+
+            chunks.append(_Chunk(parent, chain[:size]))
+            for start in xrange(size, len(chain), size):
+                chunks.append(_Chunk(chain[start-1], chain[start:start+size]))
+        return chunks
+
+    def _add_chunks(self, model, key_of, chunks):
+        """ compute the points, bounds and errors of `chunks`, and store them """
+        if not chunks:
+            return
+        vertices = []
+        edges = []
+        for chunk in chunks:
+            if chunk.anchor is not None:
+                vertices.append(chunk.anchor)
+            vertices.extend(chunk.vids)
+            edges.extend(chunk.edges())
+        positions = model.get_positions(vertices)
+        keys = key_of(edges)
+
+        fixed = _np.zeros(len(positions), dtype=bool)
+        point_start = 0
+        edge_start  = 0
+        for chunk in chunks:
+            edge_number = len(chunk.edges())
+            chunk_keys  = keys[edge_start:edge_start+edge_number]
+            chunk.runs  = self._runs(chunk_keys)
+            fixed[point_start] = fixed[point_start+edge_number] = True
+            for key, first, last in chunk.runs:
+                fixed[point_start+first] = fixed[point_start+last] = True
+            chunk.points = positions[point_start:point_start+edge_number+1]
+            point_start += edge_number+1
+            edge_start  += edge_number
+
+            chunk_id = self._next_id
+            self._next_id += 1
+            self._chunks[chunk_id] = chunk
+            for vid in chunk.vids:
+                self._chunk_of[vid] = chunk_id
+
+        # errors of all chunks, computed together
+        errors = simplification_errors(positions, fixed)
+        point_start = 0
+        for chunk in chunks:
+            chunk.errors = errors[point_start:point_start+len(chunk.points)]
+            point_start += len(chunk.points)
+        self._bounds = None
+
+    @staticmethod
+    def _runs(keys):
+        """ return the list of (key, first, last) points of runs of same edge `keys` """
+        runs = []
+        first = 0
+        for i in xrange(1,len(keys)+1):
+            if i==len(keys) or keys[i]!=keys[first]:
+                runs.append((keys[first], first, i))
+                first = i
+        return runs
+
+    # draw
+    # ----
+    def bounds(self):
+        """ return the arrays of chunk ids (sorted), lower and upper corners """
+        if self._bounds is None:
+            ids = sorted(self._chunks)
+            points = [self._chunks[chunk_id].points for chunk_id in ids]
+            lower = _np.array([p.min(axis=0) for p in points], dtype=float).reshape(-1,3)
+            upper = _np.array([p.max(axis=0) for p in points], dtype=float).reshape(-1,3)
+            self._bounds = _np.array(ids, dtype=int), lower, upper
+        return self._bounds
+
+    def distances(self, position):
+        """ return the distance of `position` to each chunk bounding box
+
+        The chunks are ordered as the ids returned by `bounds`.
+        """
+        ids, lower, upper = self.bounds()
+        position = _np.asarray(position, dtype=float)
+        nearest = _np.minimum(_np.maximum(position,lower),upper)
+        return ((nearest-position)**2).sum(axis=1)**.5
+
+    def select(self, pixel_sizes, protected=()):
+        """ return the level of detail of chunks, for given `pixel_sizes`
+
+        `pixel_sizes`: the size of a pixel at each chunk (ordered as `bounds`),
+                       or one size for all chunks
+        `protected`:   list of (position, distance): chunks closer than
+                       distance to position are kept at full resolution
+
+        return the arrays of chunk ids and of their level
+        """
+        ids = self.bounds()[0]
+        pixel_sizes = _np.zeros(len(ids)) + pixel_sizes
+        levels = _np.searchsorted(self.tolerances, pixel_sizes, side='right')
+        for position, distance in protected:
+            levels[self.distances(position)<=distance] = 0
+        return ids, levels
+
+    def lines(self, chunk_id, level):
+        """ return the list of (color key, points) of chunk `chunk_id` at `level`
+
+        Level -1 is empty, i.e. it can be used for hidden chunks.
+        """
+        if level<0:
+            return []
+        chunk = self._chunks[chunk_id]
+        lines = chunk.lines.get(level)
+        if lines is None:
+            if level==0:
+                lines = [(key, chunk.points[first:last+1]) for key,first,last in chunk.runs]
+            else:
+                keep = chunk.errors>self.tolerances[level-1]
+                lines = [(key, chunk.points[first:last+1][keep[first:last+1]])
+                                for key,first,last in chunk.runs]
+            chunk.lines[level] = lines
+        return lines
@@ -0,0 +1,405 @@
+"""
+Cached geometric and topological metrics of tree segments
+
+`TreeMetrics` computes, for all the segments of a TreeModel:
+
+  - length:      distance between the segment position and its parent one
+                 (0 for roots)
+  - path_length: cumulated length of the segments from the tree base
+  - order:       branching order, i.e. the number of branches ('+' edges) on
+                 the path from the tree base (0 on the trunk)
+  - depth:       topological order, i.e. number of segments from the base
+  - strahler:    Strahler order: 1 for leaves, and for other segments the
+                 maximum of their children order, plus 1 if it is reached by
+                 several children
+
+All metrics are first computed in vectorized passes over the flattened
+arrays of segment parents and positions: path metrics are accumulated from
+the roots by pointer jumping, and Strahler orders are computed by depth level.
+The results are cached.
+
+The metrics follow the model changes (see `treeeditor.mvp.Model.subscribe`)
+and only the values that can change are invalidated then recomputed: the
+length of moved segments and of their children, the path metrics of the
+subtrees of moved and reconnected segments, and the Strahler orders on the
+path from reconnected segments to their root.
+
+Usage
+-----
+    metrics = TreeMetrics(model)
+    metrics.get('strahler')               # array of the values of all segments
+    metrics.get('length', [v1,v2])        # or of some of them
+    metrics.value('order', v1)
+"""
+import numpy as _np
+
+METRICS = ('length', 'path_length', 'order', 'depth', 'strahler')
+PATH_METRICS = ('path_length', 'order', 'depth')
+
+
+class TreeMetrics(object):
+    """ Cached metrics of the segments of a TreeModel """
+    def __init__(self, model):
+        """ create the metrics of `model`, which follow its changes """
+        self.model = model
+        self._arrays = None      # metric -> array of values, by row
+        self._rows = None        # segment -> row in arrays
+        self._steps = {}         # metric -> color step of continuous metrics
+        self._clear_invalid()
+        model.subscribe(self._model_changed)
+
+    def close(self):
+        """ stop following the model changes """
+        self.model.unsubscribe(self._model_changed)
+
+    def _clear_invalid(self):
+        self._moved = set()        # segments which length is invalid
+        self._subtrees = set()     # segments which subtree path metrics are invalid
+        self._paths = set()        # segments which path to root Strahler orders are invalid
+
+    # accessors
+    # ---------
+    def get(self, name, vertices=None):
+        """ return the array of metric `name` for `vertices` (or all segments) """
+        values = self._get_array(name)
+        if vertices is None:
+            vertices = self.model.get_nodes()
+        rows = self._rows
+        return values[_np.fromiter((rows[vid] for vid in vertices), dtype=int, count=len(vertices))]
+
+    def value(self, name, vid):
+        """ return metric `name` of segment `vid` """
+        return self._get_array(name)[self._rows[vid]].item()
+
+    def color(self, name, vid):
+        """ return the color index of segment `vid` for metric `name`
+
+        Discrete metrics are used directly. Continuous ones are binned in the
+        number of colors of the model theme colormap, by steps computed when
+        all metrics are computed.
+        """
+        value = self.value(name, vid)
+        step = self._steps.get(name)
+        if step is None:
+            return int(value)
+        if not value>=0:   # missing positions
+            return 'default'
+        return min(int(value/step), self._color_number-1)
+
+    def pipe_model_radii(self, tip_radius=1., exponent=2., fixed=None):
+        """ return the segments and their radius estimated by the pipe model
+
+        The radius `r` of segments is such that r**exponent is the sum of the
+        r**exponent of their children, and `tip_radius` for segments without
+        children. An exponent of 2 is the pipe model (the cross section area
+        is conserved), other values give allometric rules, such as 3 for the
+        Murray's law.
+        `fixed` is an optional dict of the radius of segments which are kept,
+        such as measured radius: they are used for the estimation of their 
+        ancestors radius.
+
+        It is computed in one pass over the depth levels of the segments,
+        from the deepest ones.
+        return the list of segments ids, and the array of their radius
+        """
+        depth = self._get_array('depth')
+        vids = self._rows.keys()
+        rows = _np.fromiter(self._rows.itervalues(), dtype=int, count=len(vids))
+        size = len(self._vids)
+        powered = _np.zeros(size)    # r**exponent of segments
+        children = _np.zeros(size)   # sum of the r**exponent of their children
+        is_fixed = _np.zeros(size, dtype=bool)
+        if fixed:
+            fixed_rows = _np.fromiter((self._rows[vid] for vid in fixed), dtype=int, count=len(fixed))
+            powered[fixed_rows] = _np.fromiter(fixed.itervalues(), dtype=float, count=len(fixed))**exponent
+            is_fixed[fixed_rows] = True
+
+        rows = rows[_np.argsort(depth[rows], kind='mergesort')[::-1]]
+        ends = _np.append(_np.flatnonzero(_np.diff(depth[rows])), len(rows)-1)+1
+        starts = _np.append(0, ends[:-1])
+        tip = float(tip_radius)**exponent
+        parent_rows = self._parent_rows
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            level = rows[start:end]
+            level = level[~is_fixed[level]]
+            powered[level] = _np.where(children[level]>0, children[level], tip)
+            level = rows[start:end]
+            parents = parent_rows[level]
+            connected = parents>=0
+            _np.add.at(children, parents[connected], powered[level[connected]])
+
+        return vids, powered[_np.fromiter(self._rows.itervalues(), dtype=int, count=len(vids))]**(1./exponent)
+
+    def _get_array(self, name):
+        if name not in METRICS:
+            raise KeyError('unknown metric: '+str(name))
+        if self._arrays is None:
+            self._compute_all()
+        elif self._moved or self._subtrees or self._paths:
+            self._update()
+        return self._arrays[name]
+
+    # rows
+    # ----
+    def _parent(self, vid):
+        """ return the parent segment of `vid` at last update, or None """
+        row = self._rows.get(vid)
+        if row is None:
+            return None
+        parent_row = self._parent_rows[row]
+        return None if parent_row<0 else int(self._vids[parent_row])
+
+    def _add_row(self, vid):
+        """ add a row for segment `vid`, if it has none, and return it """
+        rows = self._rows
+        row = rows.get(vid)
+        if row is None:
+            row = rows[vid] = self._size
+            self._size += 1
+            if self._size>len(self._vids):
+                for name in ('_vids','_parent_rows'):
+                    setattr(self, name, _np.resize(getattr(self,name), 2*self._size))
+                for name, values in self._arrays.items():
+                    self._arrays[name] = _np.resize(values, 2*self._size)
+            self._vids[row] = vid
+            for values in self._arrays.itervalues():
+                values[row] = 0
+        return row
+
+    # change tracking
+    # ---------------
+    def _model_changed(self, changes):
+        """ invalidate the metrics which depend on `changes` """
+        if self._arrays is None:
+            return
+        g = self.model.mtg
+        is_segment = self.model._geometry.__contains__
+
+        reconnected = changes.added | changes.reparented | changes.retyped
+        if len(reconnected)+len(changes.moved) > max(len(self._rows)/8, 64):
+            self._arrays = None   # too many changes: all is recomputed
+            for cache in [self.model._color_cache.get(name) for name in METRICS]:
+                if cache:
+                    cache.clear()
+            return
+        for vid in changes.removed:
+            self._paths.add(self._parent(vid))
+            self._rows.pop(vid,None)
+        for vid in reconnected:
+            self._paths.add(self._parent(vid))
+            self._add_row(vid)
+        for vid in reconnected:
+            parent = g.parent(vid)
+            self._parent_rows[self._rows[vid]] = self._rows.get(parent,-1) if is_segment(parent) else -1
+        self._paths.update(reconnected)
+        self._subtrees.update(reconnected)
+        self._subtrees.update(changes.moved)
+        self._moved.update(reconnected)
+        self._moved.update(changes.moved)
+        for vid in changes.moved:
+            self._moved.update(self._children(vid))
+        self._paths.discard(None)
+        self._paths.difference_update(changes.removed)
+        self._moved.difference_update(changes.removed)
+        self._invalidate_colors()
+
+    def _children(self, vid):
+        """ return the segment children of `vid` """
+        is_segment = self.model._geometry.__contains__
+        return [cid for cid in self.model.mtg._children.get(vid,()) if is_segment(cid)]
+
+    def _subtree(self, vertices):
+        """ return the list of the segments of the subtrees of `vertices`
+
+        Segments are given in depth first order: parents before children.
+        """
+        rows = self._rows
+        subtree = set()
+        stack = list(vertices)
+        while stack:
+            vid = stack.pop()
+            if vid in subtree or vid not in rows:
+                continue
+            subtree.add(vid)
+            stack.extend(self._children(vid))
+
+        ordered = []
+        stack = [vid for vid in subtree if self._parent(vid) not in subtree]
+        while stack:
+            vid = stack.pop()
+            ordered.append(vid)
+            stack.extend(cid for cid in self._children(vid) if cid in subtree)
+        return ordered
+
+    def _root_path(self, vertices):
+        """ return the list of the segments on the path from `vertices` to their root """
+        path = set()
+        for vid in vertices:
+            while vid is not None and vid not in path:
+                path.add(vid)
+                vid = self._parent(vid)
+        return list(path)
+
+    def _invalidate_colors(self):
+        """ remove the invalidated values from the colors cached by the model """
+        caches = [self.model._color_cache.get(name) for name in METRICS]
+        caches = [cache for cache in caches if cache]
+        if not caches:
+            return
+        invalid = set(self._moved)
+        invalid.update(self._subtree(self._subtrees))
+        invalid.update(self._root_path(self._paths))
+        for cache in caches:
+            for vid in invalid:
+                cache.pop(vid,None)
+
+    # computation
+    # -----------
+    def _compute_all(self):
+        """ compute all metrics of all segments, with vectorized operations """
+        model = self.model
+        g = model.mtg
+        geometry = model._geometry
+        vids = geometry.vids.copy()
+        vid_list = vids.tolist()
+        positions = geometry.positions
+        n = len(vid_list)
+
+        parents = _np.array([-1 if pid is None else pid for pid in map(g._parent.get, vid_list)],
+                            dtype=int).reshape(-1)
+        size = max(vids.max() if n else 0, parents.max() if n else 0)+1
+        row_of = _np.empty(size, dtype=int)
+        row_of[:] = -1
+        row_of[vids] = _np.arange(n)
+        parent_rows = _np.where(parents>=0, row_of[_np.maximum(parents,0)], -1)
+        connected = parent_rows>=0
+
+        successor_ids = [vid for vid,edge in g.property('edge_type').iteritems()
+                                 if edge=='<' and vid<size]
+        successor_rows = row_of[_np.array(successor_ids, dtype=int)]
+        is_successor = _np.zeros(n, dtype=bool)
+        is_successor[successor_rows[successor_rows>=0]] = True
+
+        length = _np.zeros(n)
+        length[connected] = _np.sqrt(((positions[connected]-positions[parent_rows[connected]])**2).sum(axis=1))
+        weights = _np.column_stack([length, connected & ~is_successor, connected])
+        path_length, order, depth = self._accumulate(parent_rows, weights).T
+        lost = _np.isnan(depth)     # on, or below, a parent cycle
+        depth[lost] = order[lost] = 0
+        depth = depth.astype(int)
+        strahler = self._strahler(_np.where(lost, -1, parent_rows), depth)
+
+        self._arrays = dict(length=length, path_length=path_length, order=order.astype(int),
+                            depth=depth, strahler=strahler)
+        self._rows = dict(zip(vid_list, xrange(n)))
+        self._vids = vids
+        self._parent_rows = parent_rows
+        self._size = n
+
+        self._color_number = len(model.theme.get('colormap',())) or 8
+        for name in ('length','path_length'):
+            finite = self._arrays[name][_np.isfinite(self._arrays[name])]
+            top = finite.max() if len(finite) else 0
+            self._steps[name] = top/self._color_number if top>0 else 1.
+        for cache in [model._color_cache.get(name) for name in METRICS]:
+            if cache:
+                cache.clear()
+        self._clear_invalid()
+
+    @staticmethod
+    def _accumulate(parent_rows, weights):
+        """ return the sums of the rows of `weights` from each row to its root
+
+        `parent_rows` are the rows of the parents, -1 for roots. Sums are
+        computed by pointer jumping: after k steps, `up` is the 2^k-th
+        ancestor of each row, or the sentinel row n if it is a root.
+        Sums of rows which do not reach a root (i.e. in parent cycles) are NaN.
+        """
+        n = len(parent_rows)
+        up = _np.append(_np.where(parent_rows>=0, parent_rows, n), n)
+        total = _np.vstack([weights, _np.zeros((1,weights.shape[1]))])
+        for step in xrange(n.bit_length()+1):
+            if (up==n).all():
+                break
+            total += total[up]
+            up = up[up]
+        total[up!=n] = _np.nan
+        return total[:n]
+
+    @staticmethod
+    def _strahler(parent_rows, depth):
+        """ return the Strahler orders, computed by decreasing depth levels """
+        n = len(parent_rows)
+        strahler  = _np.zeros(n, dtype=int)
+        top_child = _np.zeros(n, dtype=int)   # maximum order of children
+        top_count = _np.zeros(n, dtype=int)   # number of children with this order
+        if not n:
+            return strahler
+        levels = _np.argsort(depth, kind='mergesort')
+        ends = _np.cumsum(_np.bincount(depth))
+        starts = _np.append(0, ends[:-1])
+        for start, end in reversed(zip(starts.tolist(), ends.tolist())):
+            rows = levels[start:end]
+            order = _np.where(top_child[rows]==0, 1, top_child[rows]+(top_count[rows]>1))
+            strahler[rows] = order
+            parents = parent_rows[rows]
+            connected = parents>=0
+            parents, order = parents[connected], order[connected]
+            _np.maximum.at(top_child, parents, order)
+            _np.add.at(top_count, parents, order==top_child[parents])
+        return strahler
+
+    # incremental update
+    # ------------------
+    def _update(self):
+        """ recompute the invalidated metrics """
+        rows = self._rows
+        if len(self._subtrees)+len(self._paths) > max(len(rows)/8, 64):
+            self._compute_all()   # too many changes: vectorized is faster
+            return
+
+        length, path_length, order, depth, strahler = [self._arrays[name] for name in METRICS]
+        geometry = self.model._geometry
+        for vid in self._moved:
+            row = rows.get(vid)
+            if row is None:
+                continue
+            pid = self._parent(vid)
+            if pid is None:
+                length[row] = 0.
+            else:
+                delta = _np.subtract(geometry.get_position(vid), geometry.get_position(pid))
+                length[row] = _np.sqrt((delta**2).sum())
+
+        # path metrics, from the top of each invalid subtree
+        edge_type = self.model.mtg.property('edge_type')
+        for vid in self._subtree(self._subtrees):
+            row = rows[vid]
+            parent_row = self._parent_rows[row]
+            if parent_row<0:
+                path_length[row], order[row], depth[row] = length[row], 0, 0
+            else:
+                path_length[row] = path_length[parent_row] + length[row]
+                order[row] = order[parent_row] + (edge_type.get(vid)!='<')
+                depth[row] = depth[parent_row] + 1
+
+        # Strahler orders, from the deepest invalid segments until they do not 
+        # change. Strahler orders are 0 for segments not yet computed
+        # Invalid segments may have a new parent: it is always updated
+        for start in sorted(self._paths, key=lambda vid: depth[rows[vid]], reverse=True):
+            vid = start
+            walked = set()
+            while vid is not None and vid not in walked:
+                walked.add(vid)
+                children = [strahler[rows[cid]] for cid in self._children(vid)]
+                if 0 in children:
+                    self._compute_all()
+                    return
+                top = max(children) if children else 0
+                new = 1 if top==0 else top+(children.count(top)>1)
+                row = rows[vid]
+                if strahler[row]==new and vid!=start:
+                    break
+                strahler[row] = new
+                vid = self._parent(vid)
+        self._clear_invalid()
@@ -1,10 +1,24 @@
 """
 Implement TreeModel(s)
 """
+import numpy as _np
+
+from contextlib import contextmanager as _contextmanager
+from functools  import partial        as _partial
+from weakref    import WeakSet        as _WeakSet
+
 from openalea.mtg import algo as _mtgalgo
 from openalea.mtg import MTG  as _MTG
 from treeeditor import io
 from treeeditor.mvp import Model as _Model
+from treeeditor.mvp import batched as _batched
+from treeeditor.tree.history import History as _History
+from treeeditor.tree.ancestry import AncestryIndex as _AncestryIndex
+from treeeditor.tree.snapshot import Snapshot as _Snapshot
+from treeeditor.tree.store import GeometryStore as _GeometryStore
+from treeeditor.tree.validator import TreeValidator as _TreeValidator
+from treeeditor.tree.metrics import TreeMetrics as _TreeMetrics
+from treeeditor.tree.metrics import METRICS as _METRICS
 
 ##todo: register model classes and associated test functions
 def create_mtg_model(presenter, tree, **kargs):
@@ -53,9 +67,9 @@ class TreeModel(_Model):
     open_title   = 'open mtg file'
     save_title   = 'save mtg file'
     saveas_title = 'save mtg file as'
-    opened_extension = ['.mtg','.bmtg']
+    opened_extension = ['.mtg','.bmtg','.tmtg']
     
-    def __init__(self, presenter=None, mtg=None, position='position', radius='radius'):
+    def __init__(self, presenter=None, mtg=None, position='position', radius='radius', progress=None):
         """ create a TreeModel to interact with given `mtg` 
         
         `mtg`: 
@@ -73,30 +87,41 @@ class TreeModel(_Model):
             to detect it automatically (see `select_mtg_api`) and if it does not
             find it, it create its.
             Unfound radius are set to 1
+        `progress`:
+            optional function called with the loading progress, in [0,1], if
+            `mtg` is a .mtg file name (see `io.MTGReader`)
         """
         _Model.__init__(self, presenter=presenter)
         # backup (undo) system
-        self.backupmtg = []
-        self.maxbackup = 10
+        self.maxbackup = 10            # maximum number of undo
+        self.maxbackup_size = 1000000  # maximum number of vertex states stored
 
         # color
         self._color_fct = [('branch',self.branch_color)]
+        self._color_cache = {}   # color mode name -> dict (vertex id -> color)
         self._current_color = -2
         self.next_color()
+        self._color_fct.extend((name,_partial(self.metric_color,name)) for name in _METRICS)
 
         self.set_presenter(presenter)
         
+        geometry = None
         if isinstance(mtg,basestring):
             filename = mtg
-            mtg = self.load_model(filename)
+            mtg, geometry = self.load_model_geometry(filename, position=position, radius=radius,
+                                                     progress=progress)
         else:
             filename = None
-        self.set_mtg(mtg,filename,position=position,radius=radius)
+        self.set_mtg(mtg,filename,position=position,radius=radius,geometry=geometry)
             
         
         
-    def set_mtg(self,mtg,filename=None, position=None, radius=None):
-        """ set the `mtg` of this TreeModel """
+    def set_mtg(self,mtg,filename=None, position=None, radius=None, geometry=None):
+        """ set the `mtg` of this TreeModel 
+        
+        `geometry` is an optional GeometryStore of the segments position and
+        radius, otherwise it is read from the mtg. See `select_mtg_api`
+        """
         if mtg is None:
             # create a default mtg with one 'segment' vertex
             mtg = _MTG()
@@ -106,10 +131,20 @@ class TreeModel(_Model):
             
         self.mtg     = mtg
         self.mtgfile = filename
-        
-        self.select_mtg_api(position=position, radius=radius)
+        self.history = _History(mtg, depth=self.maxbackup, budget=self.maxbackup_size)
+        self._transaction = None   # current Transaction, if any
+        self._color_cache = {}
+        self._snapshots = _WeakSet()
+        if getattr(self,'_validator',None) is not None:
+            self._validator.close()
+        self._validator = None
+        if getattr(self,'_metrics',None) is not None:
+            self._metrics.close()
+        self._metrics = None
+        
+        self.select_mtg_api(position=position, radius=radius, geometry=geometry)
             
-    def select_mtg_api(self, position=None, radius=None):
+    def select_mtg_api(self, position=None, radius=None, geometry=None):
         """ select position and radius api:
         
         if `position` is:
@@ -126,37 +161,28 @@ class TreeModel(_Model):
               * 'radius'
               * 'r'
               
+        If `geometry` is given, it is used as the GeometryStore of the segments
+        position and radius. It should match the selected properties.
+        
         Raise an IOError if one of the automatic position detection does not work
         """
         # autodetect position
         if position is None:
-            prop = self.mtg.property_names()
-            if 'XX' in prop and 'YY' in prop and 'ZZ' in prop:
-                position = ['XX','YY','ZZ']
-            elif 'x' in prop and 'y' in prop and 'z' in prop:
-                position = ['x','y','z']
-            elif 'position' in prop:
-                position = 'position'
-            elif position is None:
+            position = self._detect_position(self.mtg.property_names())
+            if position is None:
                 raise IOError("could not find position properties: either XX,YY,ZZ ; x,y,z ; position")
                     
         # autodetect radius
         if radius is None:
-            prop = self.mtg.property_names()
-            if 'r' in prop:
-                radius = 'r'
-            else:
-                radius = 'radius'
+            radius = self._detect_radius(self.mtg.property_names())
                     
         self.position_property = position
         self.radius_property = radius
         
         if isinstance(position,basestring):
-            self.get_position = self.get_position_tuple
-            self.set_position = self.set_position_tuple
+            self._set_mtg_position = self.set_position_tuple
         else:
-            self.get_position = self.get_position_triplet
-            self.set_position = self.set_position_triplet
+            self._set_mtg_position = self.set_position_triplet
 
         # assert position and radius properties exists
         prop = self.mtg.properties()
@@ -167,9 +193,132 @@ class TreeModel(_Model):
                 prop.setdefault(pos,{})
                 
         prop.setdefault(radius,{})
+        
+        if geometry is None:
+            self._load_geometry()
+        else:
+            self._geometry = geometry
+        self._load_topology()
 
+    @staticmethod
+    def _detect_position(prop):
+        """ return the position properties found in names `prop`, or None """
+        return io.detect_position(prop)
+        
+    @staticmethod
+    def _detect_radius(prop):
+        """ return the radius property name to use given property names `prop` """
+        if 'r' in prop:
+            return 'r'
+        else:
+            return 'radius'
+        
     # position and radius accessors
     # -----------------------------
+    # Positions and radius of the segments are stored in a GeometryStore, 
+    # which provides fast (vectorized) bulk accessors. The mtg properties are 
+    # kept up to date by all setters (the store is "write-through").
+    def _read_positions(self, vertices):
+        """ read the positions of `vertices` from the mtg, as a (N,3) array
+        
+        Missing positions are set to NaN
+        """
+        nan = float('nan')
+        if isinstance(self.position_property,basestring):
+            prop = self.mtg.property(self.position_property)
+            missing = (nan,)*3
+            positions = [tuple(prop.get(vid,missing)) for vid in vertices]
+            return _np.array(positions, dtype=float).reshape(-1,3)
+        else:
+            props = map(self.mtg.property,self.position_property)
+            positions = [[prop.get(vid,nan) for vid in vertices] for prop in props]
+            return _np.array(positions, dtype=float).T.reshape(-1,3)
+            
+    def _load_geometry(self):
+        """ (re)create the geometry store from the mtg properties """
+        nodes = list(self.get_nodes())
+        radius = self.mtg.property(self.radius_property)
+        radii  = [radius.get(vid,1) for vid in nodes]
+        self._geometry = _GeometryStore.from_arrays(nodes, self._read_positions(nodes), radii)
+        
+    def _reload_geometry(self, vertices):
+        """ update the geometry store for `vertices` from the mtg """
+        g = self.mtg
+        geometry = self._geometry
+        radius = g.property(self.radius_property)
+        segments = []
+        for vid in vertices:
+            if g.has_vertex(vid) and g.scale(vid)==self._segment_scale:
+                segments.append(vid)
+            else:
+                geometry.remove(vid)
+                
+        positions = self._read_positions(segments)
+        radii = _np.array([radius.get(vid,1) for vid in segments], dtype=float)
+        stored = _np.array([vid in geometry for vid in segments], dtype=bool)
+        
+        # update stored segments in bulk, and add the others
+        rows = _np.flatnonzero(stored)
+        updated = [segments[i] for i in rows]
+        changed = (geometry.get_positions(updated)!=positions[rows]).any(axis=1) \
+                | (geometry.get_radii(updated)!=radii[rows])
+        geometry.set_positions(updated, positions[rows])
+        geometry.set_radii(updated, radii[rows])
+        for i in _np.flatnonzero(~stored):
+            geometry.add(segments[i], positions[i], radii[i])
+        self.notify('moved', [updated[i] for i in _np.flatnonzero(changed)])
+    
+    def get_position(self, vertex):
+        """ return the position of `vertex` as a list """
+        return self._geometry.get_position(vertex)
+        
+    @_batched
+    def set_position(self, vertex, position):
+        """ set the position of `vertex` """
+        self._touch(vertex)
+        position = tuple(position)
+        self._set_mtg_position(vertex, position)
+        self._geometry.set_position(vertex, position)
+        self.notify('moved', vertex)
+        
+    def get_positions(self, vertices=None):
+        """ return the positions of `vertices` as a (N,3) array 
+        
+        If `vertices` is None, return the positions of all nodes, in the order
+        given by `get_nodes`
+        """
+        if vertices is None:
+            vertices = self.get_nodes()
+        return self._geometry.get_positions(vertices)
+        
+    def get_geometry(self):
+        """ return the arrays of the ids and (N,3) positions of all segments
+        
+        Segments are in storage order, which is faster than `get_positions`
+        for all nodes. Missing positions are NaN.
+        """
+        return self._geometry.vids.copy(), self._geometry.get_positions()
+        
+    @_batched
+    def set_positions(self, vertices, positions):
+        """ set the positions of `vertices` from the (N,3) array `positions` """
+        vertices = list(vertices)
+        positions = _np.asarray(positions, dtype=float).reshape(-1,3)
+        if isinstance(self.position_property,basestring):
+            self._touch_properties([self.position_property], vertices)
+        else:
+            self._touch_properties(self.position_property, vertices)
+        self._geometry.set_positions(vertices, positions)
+        
+        if isinstance(self.position_property,basestring):
+            prop = self.mtg.property(self.position_property)
+            prop.update(zip(vertices, map(tuple,positions.tolist())))
+        else:
+            props = map(self.mtg.property,self.position_property)
+            for prop,coordinate in zip(props,positions.T):
+                prop.update(zip(vertices, coordinate.tolist()))
+        self.notify('moved', vertices)
+            
     def get_position_tuple(self, vertex):
         """ get position stored as vectors """
         return self.mtg.property(self.position_property)[vertex]
@@ -188,11 +337,37 @@ class TreeModel(_Model):
             
     def get_radius(self, vertex):
         """ return radius of vertex `vertex` """
-        return self.mtg.property(self.radius_property).setdefault(vertex,1)
+        if vertex in self._geometry:
+            return self._geometry.get_radius(vertex)
+        return self.mtg.property(self.radius_property).get(vertex,1)
         
+    @_batched
     def set_radius(self, vertex, radius):
         """ return radius of vertex `vertex` """
+        self._touch(vertex)
         self.mtg.property(self.radius_property)[vertex] = radius
+        self._geometry.set_radius(vertex, radius)
+        self.notify('moved', vertex)
+        
+    def get_radii(self, vertices=None):
+        """ return the radius of `vertices` as an array 
+        
+        If `vertices` is None, return the radius of all nodes, in the order
+        given by `get_nodes`
+        """
+        if vertices is None:
+            vertices = self.get_nodes()
+        return self._geometry.get_radii(vertices)
+        
+    @_batched
+    def set_radii(self, vertices, radii):
+        """ set the radius of `vertices` from array `radii` """
+        vertices = list(vertices)
+        radii = _np.asarray(radii, dtype=float).ravel()
+        self._touch_properties([self.radius_property], vertices)
+        self._geometry.set_radii(vertices, radii)
+        self.mtg.property(self.radius_property).update(zip(vertices, radii.tolist()))
+        self.notify('moved', vertices)
         
         
     # vertex ids accessors
@@ -209,26 +384,139 @@ class TreeModel(_Model):
         """ return the list of ids of the children vertices of `vid` """
         return self.mtg.children(vid)
     def successor(self,vid):
-        """ return the id of the successor ('<') child of `vid` (or None) """
-        children = dict((self.mtg.edge_type(c),c) for c in self.mtg.children(vid))
-        return children.get('<',None)
+        """ return the id of the successor ('<') child of segment `vid` (or None) """
+        return self._successor.get(vid)
+        
+    def successors(self, vertices):
+        """ return the list of the successor of all `vertices` (None if none) """
+        get = self._successor.get
+        return [get(vid) for vid in vertices]
+        
+    def local_axis(self, vid):
+        """ return the list of `vid` and its successors, recursively """
+        axis = [vid]
+        successor = self._successor.get(vid)
+        while successor is not None:
+            axis.append(successor)
+            successor = self._successor.get(successor)
+        return axis
         
     def siblings(self,vid):
         """ return the list of ids of the children vertices of `vid` """
         return self.mtg.siblings(vid)
         
+    # topology indices
+    # ----------------
+    # The successor ('<' child) of all segments is stored in `_successor`, and 
+    # `_successor_parent` is the reverse map. The segments ancestry is stored 
+    # in the `_ancestry` index (see `treeeditor.tree.ancestry`).
+    # Edition methods call `_update_topology` on all vertices which edge type 
+    # or parent changed.
+    def is_ancestor(self, ancestor, vid):
+        """ True if segment `ancestor` is `vid` or one of its ancestors 
+        
+        It runs in O(log n) (amortized), n being the number of segments
+        """
+        return self._ancestry.is_ancestor(ancestor, vid)
+        
+    def common_ancestor(self, vid1, vid2):
+        """ return the lowest common ancestor of segments `vid1` and `vid2` (or None) """
+        return self._ancestry.lca(vid1, vid2)
+        
+    def tree_root(self, vid):
+        """ return the root segment of the tree containing segment `vid` """
+        return self._ancestry.root(vid)
+        
+    def _load_topology(self):
+        """ (re)create the topology indices from the mtg """
+        self._load_successors()
+        parent = self.mtg._parent.get
+        self._ancestry = _AncestryIndex(dict((vid,parent(vid)) for vid in self.get_nodes()))
+        
+    def _update_topology(self, vertices):
+        """ update the topology indices for `vertices` (after their edition) 
+        
+        And notify the segments added, removed, reparented and retyped
+        """
+        vertices = [vid for vid in vertices if vid is not None]
+        successor_parent = self._successor_parent
+        was_successor = [vid in successor_parent for vid in vertices]
+        self._update_successors(vertices)
+        
+        g = self.mtg
+        ancestry = self._ancestry
+        parents = {}
+        removed = []
+        added = []
+        reparented = []
+        for vid in vertices:
+            if g.has_vertex(vid) and g.scale(vid)==self._segment_scale:
+                pid = parents[vid] = g.parent(vid)
+                if vid not in ancestry:
+                    added.append(vid)
+                elif ancestry.parent(vid)!=pid:
+                    reparented.append(vid)
+            else:
+                removed.append(vid)
+        
+        self.notify('removed', [vid for vid in removed if vid in ancestry])
+        self.notify('added', added)
+        self.notify('reparented', reparented)
+        self.notify('retyped', [vid for vid,was in zip(vertices,was_successor) 
+                                    if (vid in successor_parent)!=was])
+        ancestry.update(parents, removed=removed)
+        
+    def _load_successors(self):
+        """ (re)create the successor index from the mtg """
+        parent = self.mtg.parent
+        scale  = self.mtg.scale
+        self._successor = {}
+        self._successor_parent = {}
+        for vid, edge_type in self.mtg.property('edge_type').iteritems():
+            if edge_type=='<' and scale(vid)==self._segment_scale:
+                pid = parent(vid)
+                if pid is not None:
+                    self._successor[pid] = vid
+                    self._successor_parent[vid] = pid
+                    
+    def _update_successors(self, vertices):
+        """ update the successor index for `vertices` (after their edition) """
+        g = self.mtg
+        edge_type = g.property('edge_type')
+        successor = self._successor
+        successor_parent = self._successor_parent
+        for vid in vertices:
+            if vid is None: continue
+            pid = successor_parent.pop(vid,None)
+            if pid is not None and successor.get(pid)==vid:
+                del successor[pid]
+            if not g.has_vertex(vid):
+                successor.pop(vid,None)
+            elif edge_type.get(vid)=='<' and g.scale(vid)==self._segment_scale:
+                pid = g.parent(vid)
+                if pid is not None:
+                    successor[pid] = vid
+                    successor_parent[vid] = pid
+        
     # mtg edition
     # -----------
+    @_batched
     def new_vertex(self, position, radius=1):
         """ add a new *unconnected* vertex """
         vid = self.mtg.root
         for s in range(self._segment_scale-1):
+            self._touch(vid)
             vid = self.mtg.add_component(vid)
+            self._created(vid)
+        self._touch(vid)
         vid = self.mtg.add_component(vid, edge_type='+')
+        self._created(vid)
+        self._update_topology([vid])
         self.set_position(vid, position=position)
         self.set_radius(vid, radius=radius)
         return vid
         
+    @_batched
     def add_successor(self, vertex, position):
         """ add a successor (i.e. edge_type '<') to vertex `vertex` 
         
@@ -236,21 +524,26 @@ class TreeModel(_Model):
           - the id of the created vertex
           - the set of updated vertices
         """
-        # set all existing successors as branching
+        # set existing successor as branching
         edge_type = self.mtg.property('edge_type')
-        successors = [vid for vid in self.mtg.children(vertex) if edge_type[vid]=='<']
+        successors = filter(None,[self.successor(vertex)])
+        self._touch(successors)
         for s in successors:
-            edge_type[child] = '+'
+            edge_type[s] = '+'
         updated = set(successors)
             
         # add new successor
+        self._touch([vertex, self.mtg.complex(vertex)])
         child = self.mtg.add_child(vertex,edge_type='<')
+        self._created(child)
+        self._update_topology(successors+[child])
         self.set_position(child,position)
         updated.add(child)
         updated.add(vertex)
         
         return child, updated
         
+    @_batched
     def add_branching(self, vertex, position):
         """ add a branching vertex (i.e. edge_type '+') to vertex `vertex` 
         
@@ -258,11 +551,15 @@ class TreeModel(_Model):
           - the id of the created vertex
           - the set of updated vertices
         """
+        self._touch([vertex, self.mtg.complex(vertex)])
         child = self.mtg.add_child(vertex,edge_type='+')
+        self._created(child)
+        self._update_topology([child])
         self.set_position(child,position)
         
         return child, set([child, vertex])
     
+    @_batched
     def insert_parent(self, child, position):
         """
         Insert a new vertex as parent of `child`
@@ -285,13 +582,16 @@ class TreeModel(_Model):
             return child, []
             
         child_edge = mtg.edge_type(child)
+        self._touch([child, parent, mtg.complex(child), mtg.complex(parent)])
         if mtg.max_scale()>1 and mtg.complex(child)!=mtg.complex(parent):
             complex_id = mtg.complex(child)
             vertex = mtg.add_component(complex_id, edge_type=child_edge)
+            self._created(vertex)
             mtg.replace_parent(child, vertex, edge_type='<')
             mtg.replace_parent(vertex, parent)
         else:
-            vertex = self.mtg.insert_parent(child)
+            vertex = self.mtg.insert_parent(child, edge_type=child_edge)
+            self._created(vertex)
             #mtg.add_child(parent, vertex, edge_type=child_edge) ## not done by in mtg.insert_parent
         self.set_position(vertex, position)
         
@@ -301,10 +601,12 @@ class TreeModel(_Model):
             edge_type = mtg.property('edge_type')
             edge_type[child] = '<'
             ##up.update(self.replace_parent(child,  vertex, edge_type='<'))
+        self._update_topology(up)
 
         return vertex, up
         
         
+    @_batched
     def replace_parent(self, vertex, new_parent, edge_type=None):
         """ set the parent of `vertex` by `new_parent` 
         
@@ -315,7 +617,7 @@ class TreeModel(_Model):
         
         return the set of updated vertices
         """
-        if new_parent in _mtgalgo.descendants(self.mtg,vertex):
+        if self.is_ancestor(vertex, new_parent):
             raise TypeError("Invalid parent: cannot reparent a node with one of its descendants")
             
         if edge_type is None:
@@ -324,20 +626,24 @@ class TreeModel(_Model):
         
         mtg = self.mtg
         updated = [vertex, new_parent]
+        self._touch([vertex, mtg.parent(vertex), new_parent])
         
         # assert parent has no other successor
         mtg_edge_type = mtg.property('edge_type')
         if edge_type=='<':
-            successors = [vid for vid in mtg.children(new_parent) if mtg_edge_type[vid]=='<']
+            successors = filter(None,[self.successor(new_parent)])
+            self._touch(successors)
             for s in successors:
                 mtg_edge_type[s] = '+'
             updated.extend(successors)
             
         mtg.replace_parent(vertex, new_parent)
         mtg_edge_type[vertex] = edge_type
+        self._update_topology(updated)
             
         return set(updated)
                     
+    @_batched
     def remove_vertex(self, vertex, reparent_child=True):
         """ remove `vertex` from tree 
         
@@ -349,12 +655,14 @@ class TreeModel(_Model):
         return the set of updated vertices
         """
         parent   = self.parent(vertex)
-        children = self.children(vertex)
+        children = list(self.children(vertex))
         updated = set([parent]+children)
         
         if parent is None and len(children):
             raise TypeError("cannot remove root vertex with children")
             
+        self._touch([vertex, parent, self.mtg.complex(vertex)]+children)
+
         if self.mtg.edge_type(vertex)=='+' and self.successor(parent) is not None:
             s = self.successor(vertex)
             if s:
@@ -362,6 +670,8 @@ class TreeModel(_Model):
         
         ##if parent:
         self.mtg.remove_vertex(vertex, reparent_child=reparent_child)
+        self._geometry.remove(vertex)
+        self._update_topology([vertex]+children)
         ##else:
         ##    for child in children[:]:  # make a copy cuz loop modify children 
         ##        print vertex, child, children
@@ -370,13 +680,19 @@ class TreeModel(_Model):
 
         return updated
         
+    @_batched
     def remove_tree(self, vertex):
         """ remove the subtree rooted at `vertx` 
         
             return the set of delted vertices
         """
         removed = _mtgalgo.descendants(self.mtg, vertex)
+        self._touch(removed)
+        self._touch([self.parent(vertex)]+list(set(map(self.mtg.complex,removed))))
         self.mtg.remove_tree(vertex)
+        for vid in removed:
+            self._geometry.remove(vid)
+        self._update_topology(removed)
         return set(removed)
 
     def _disconnect_tree(self, parent, vertex):
@@ -384,27 +700,78 @@ class TreeModel(_Model):
         Disconnect tree starting at `vertex` from `parent` 
         ** works only if scale(parent)==scale(vertex)==max_scale **
         """
+        self._touch([parent, vertex])
         del self.mtg._parent[vertex]
         self.mtg._children[parent].remove(vertex)
+        self._update_topology([vertex])
         ## in general: components(parent)&components(vertex)) should be disconnnected
         
     # appearance
     # ----------
     def next_color(self, name=None):
         """ select next color type 
-        If `fct_index`, select color function with this index
+        If `name`, select color function with this name
         """
         if name:
-            index = [name for name,fct in self._color_fct].index(name)
+            index = [fct_name for fct_name,fct in self._color_fct].index(name)
             self._current_color = index
         else:
             self._current_color = (self._current_color+1)%len(self._color_fct)
             
         name,color_fct = self._color_fct[self._current_color]
-        self.color = color_fct
         self.show_message('color model: '+name)
-        ## return update, removed, added[, selection?]
-        ##return self.get_nodes(), [],[]#,self.selection?
+        
+    def color(self, vid):
+        """ return the color of `vid` with the current color model """
+        name, color_fct = self._color_fct[self._current_color]
+        cache = self._color_cache.setdefault(name,{})
+        color = cache.get(vid)
+        if color is None:
+            color = cache[vid] = color_fct(vid)
+        return color
+        
+    def get_colors(self, vertices=None, name=None):
+        """ return the list of the colors of `vertices` 
+        
+        `vertices`: list of vertex ids, or None for all nodes (see `get_nodes`)
+        `name`: the name of the color model, or None for the current one
+        
+        Colors are cached for each color model, and only recomputed for the 
+        vertices that have been edited since last call.
+        """
+        if vertices is None:
+            vertices = self.get_nodes()
+        if name is None:
+            name, color_fct = self._color_fct[self._current_color]
+        else:
+            color_fct = dict(self._color_fct)[name]
+            
+        cache = self._color_cache.setdefault(name,{})
+        get = cache.get
+        colors = map(get, vertices)
+        for i,(vid,color) in enumerate(zip(vertices,colors)):
+            if color is None:
+                colors[i] = cache[vid] = color_fct(vid)
+        return colors
+        
+    def _invalidate_colors(self, vertices, cascade=False):
+        """ remove `vertices` from the color caches 
+        
+        Color functions which depend on other vertices than the given one 
+        should take care of invalidating the colors of dependent vertices.
+        If `cascade`, also invalidate the components of complexes in `vertices`
+        """
+        caches = [cache for cache in self._color_cache.itervalues() if cache]
+        if not caches:
+            return
+        if cascade:
+            components = self.mtg._components
+            vertices = list(vertices)
+            for vid in vertices:    # vertices is extended while iterating
+                vertices.extend(components.get(vid,()))
+        for cache in caches:
+            for vid in vertices:
+                cache.pop(vid,None)
         
     def branch_color(self, vid):
         """ return the color associated to `vid`
@@ -424,21 +791,132 @@ class TreeModel(_Model):
         else:                            # branching
             return 'highlight'
 
+    def metric_color(self, name, vid):
+        """ return the color associated to metric `name` of segment `vid` 
+        
+        See `get_metric` and `treeeditor.tree.metrics.TreeMetrics.color`
+        """
+        return self.metrics().color(name, vid)
+        
+    # metrics
+    # -------
+    def metrics(self):
+        """ return the `TreeMetrics` of the segments, see `treeeditor.tree.metrics` """
+        if self._metrics is None:
+            self._metrics = _TreeMetrics(self)
+        return self._metrics
+        
+    def get_metric(self, name, vertices=None):
+        """ return the array of metric `name` of `vertices` (or all segments) 
+        
+        Metrics are 'length', 'path_length', 'order', 'depth' and 'strahler'.
+        They are cached, and only recomputed for the segments affected by the 
+        editions done since last call. See `treeeditor.tree.metrics`
+        """
+        return self.metrics().get(name, vertices)
+        
+    def estimate_radii(self, tip_radius=1., exponent=2., missing_only=False):
+        """ set the radius of all segments estimated by the pipe model 
+        
+        `tip_radius`: radius of the segments without children
+        `exponent`:   the radius r of a segment is such that r**exponent is the
+                      sum of its children r**exponent. 2 is the pipe model, 
+                      other values give allometric rules
+        `missing_only`: if True, only set the radius of the segments which have
+                      none in the mtg. The others are used for the estimation.
+        
+        It is recorded as one undoable edition.
+        See `treeeditor.tree.metrics.TreeMetrics.pipe_model_radii`
+        return the list of segments which radius has changed
+        """
+        fixed = None
+        if missing_only:
+            radius = self.mtg.property(self.radius_property)
+            fixed = dict((vid,r) for vid,r in radius.iteritems() if vid in self._geometry)
+        vertices, radii = self.metrics().pipe_model_radii(tip_radius, exponent, fixed)
+        
+        changed = _np.flatnonzero(radii!=self.get_radii(vertices))
+        vertices = [vertices[i] for i in changed]
+        with self.transaction():
+            self.set_radii(vertices, radii[changed])
+        return vertices
+        
     # file IO
     # -------
     @staticmethod
-    def load_model(filename):
-        """ load mtg from `filename`, then call `set_mtg` """
+    def load_model(filename, **options):
+        """ load mtg from `filename`, then call `set_mtg` 
+        
+        .mtg files are read with `io.MTGReader`, which `options` are given to.
+        """
+        return TreeModel.load_model_geometry(filename, **options)[0]
+        
+    @staticmethod
+    def load_model_geometry(filename, position=None, radius=None, **options):
+        """ load mtg from `filename` and, if possible, its segments geometry
+        
+        `position` and `radius` are the properties names, as for `select_mtg_api`
+        `options` are given to `io.MTGReader` for .mtg files, and ignored otherwise
+        
+        return the mtg and a GeometryStore of the segments position and radius,
+        or None if they are not read with the mtg (e.g. for .bmtg files)
+        
+        .bmtg files are pickled mtg, .tmtg files are binary mtg (see `io.write_tmtg`)
+        and other files are read as coded mtg (.mtg).
+        """
         import os.path
         
-        if os.path.splitext(filename)[1] == '.bmtg':
-           mtg = io.readfile(filename)
-        else: # .mtg
-           mtg = io.read_mtg_file(filename)
-        return mtg
+        ext = os.path.splitext(filename)[1]
+        if ext == '.bmtg':
+            return io.readfile(filename), None
+        if ext == '.tmtg':
+            reader = io.TMTGReader(filename)
+            return reader.read(), TreeModel._tmtg_geometry(reader, position, radius)
+            
+        # .mtg
+        if isinstance(position,basestring):
+            # position cannot be stored in a single (text) feature
+            return io.read_mtg_stream(filename, radius=radius, **options), None
+            
+        reader = io.MTGReader(filename, position=position, radius=radius, **options)
+        mtg = reader.read()
+        if reader.vids is None:
+            return mtg, None
+        return mtg, _GeometryStore.from_arrays(reader.vids, reader.positions, reader.radii)
+        
+    @staticmethod
+    def _tmtg_geometry(reader, position=None, radius=None):
+        """ create the GeometryStore of the segments stored in `reader`
+        
+        `reader` is a `io.TMTGReader`, and `position`, `radius` are the names 
+        of the properties, as for `select_mtg_api`.
+        return None if the positions properties are not found
+        """
+        names = reader.property_names()
+        if position is None:
+            position = TreeModel._detect_position(names)
+        if radius is None:
+            radius = TreeModel._detect_radius(names)
+            
+        scale = reader.array('scale')
+        vids  = reader.array('vids')[scale==scale.max()]
+        
+        if isinstance(position,basestring):
+            if reader.directory['properties'].get(position)!='vector':
+                return None
+            positions = reader.property_values(position, vids)
+        elif position is not None and all(name in names for name in position):
+            positions = _np.column_stack([reader.property_values(name, vids) for name in position])
+        else:
+            return None
+            
+        if radius in names: radii = reader.property_values(radius, vids, default=1)
+        else:               radii = None
+        
+        return _GeometryStore.from_arrays(vids, positions, radii)
         
     def save_model_assert_filename(self, filename, default_ext=None):
-        import os.path,shutil
+        import os.path
         
         # test if filename is provided
         if filename is None or filename is False:
@@ -453,59 +931,49 @@ class TreeModel(_Model):
             ext = default_ext
             filename += ext
             
-        # save a copy, in case the save fails
-        if os.path.exists(filename):
-            shutil.copy(filename,filename+'~')
-            
         return filename, ext
         
     def save_model(self,filename=None):
-        """ Save the mtg in file `filename` """ 
+        """ Save the mtg in file `filename` 
+        
+        The file is written atomically: if saving fails, any existing file
+        `filename` is left unchanged.
+        """ 
         filename,ext = self.save_model_assert_filename(filename, '.bmtg')
         
-        if ext=='.bmtg':
-           io.writefile(filename,self.mtg)
-        else: # .mtg
-            # readable mtg format from openalea.mtg module
-            stdmtg, properties = self.get_standard_mtg()
-            io.write_mtg_file(filename, stdmtg, properties=properties)
+        with io.atomic_write(filename) as tmpname:
+            if ext=='.bmtg':
+               io.writefile(tmpname,self.mtg)
+            elif ext=='.tmtg':
+               io.write_tmtg(tmpname,self.mtg)
+            else: # .mtg
+                # readable mtg format from openalea.mtg module
+                io.write_mtg_stream(tmpname, self.mtg, self.get_standard_features())
             
         self.mtgfile = filename
-   
-    def get_standard_mtg(self):
+        
+    def get_standard_features(self):
         """
-        Return a copy the managed mtg with standard format:
-            position are stored in triplet XX,YY,ZZ properties
-            radius   are stored in 'radius' property
+        Return the features list of the standard mtg format, for `io.write_mtg_stream`:
+            position are stored in triplet XX,YY,ZZ features
+            radius   are stored in 'radius' feature
             
-        ##todo: manage position triplet (but convert them to tuple)
-                what's the saving type for such tuple ?? 'TUPLE(REAL)' ?
-        """
-        from copy import deepcopy
-        newg = deepcopy(self.mtg)
-        
-        xx = {}
-        yy = {}
-        zz = {}
-        r  = {}
-        for vid in self.get_nodes():
-            xx[vid],yy[vid],zz[vid] = self.get_position(vid)
-            r[vid]  = self.get_radius(vid)
-        
-        newg.add_property('XX')
-        newg.add_property('YY')
-        newg.add_property('ZZ')
-        newg.add_property('radius')
-        newg.property('XX').update(xx)
-        newg.property('YY').update(yy)
-        newg.property('ZZ').update(zz)
-        newg.property('radius').update(r)
-        
-        properties = [('XX','REAL'), ('YY','REAL'), ('ZZ','REAL'), ('radius','REAL')]
-        
-        return newg, properties
-    
-    
+        Values are read directly in the geometry arrays: the mtg is not copied
+        """
+        rows = self._geometry.rows
+        positions = self._geometry.positions
+        radii = self._geometry.radii
+        
+        def feature(array, column=None):
+            if column is None:
+                return lambda vid: array[rows[vid]] if vid in rows else None
+            return lambda vid: array[rows[vid],column] if vid in rows else None
+            
+        return [('XX','REAL',feature(positions,0)),
+                ('YY','REAL',feature(positions,1)),
+                ('ZZ','REAL',feature(positions,2)),
+                ('radius','REAL',feature(radii))]
+   
     def default_directory(self):
         """ return a default directory to look for mtg files """
         import os
@@ -514,32 +982,195 @@ class TreeModel(_Model):
         else:
             return io.get_shared_data('mtgdata')
         
+    # validation
+    # ----------
+    def validate(self, full=False):
+        """ check the tree structure, and return the violations by kind
+        
+        After the first call, only the segments changed since the previous 
+        call are checked, unless `full` is True. 
+        See `treeeditor.tree.validator`
+        """
+        if self._validator is None:
+            self._validator = _TreeValidator(self)
+        return self._validator.validate(full=full)
+        
+    # snapshots
+    # ---------
+    def snapshot(self):
+        """ return an immutable `Snapshot` of the current mtg 
+        
+        It is created in constant time, and can be read by a worker thread 
+        while the model is being edited. Call its `release` method when done.
+        See `treeeditor.tree.snapshot`
+        """
+        snapshot = _Snapshot(self)
+        self._snapshots.add(snapshot)
+        return snapshot
+        
+    def _release_snapshot(self, snapshot):
+        self._snapshots.discard(snapshot)
+        
+    def _preserve(self, vertices):
+        """ record `vertices` in the live snapshots, before their modification """
+        for snapshot in self._snapshots:
+            snapshot._preserve(vertices)
+        
     # backup and undo
     # ---------------
     def push_backup(self, state=None):
-        """ store a copy of mtg and given state in undo list (i.e. backup) """ 
-        from copy import deepcopy
-        if len(self.backupmtg) == self.maxbackup:
-            del self.backupmtg[0]
-        self.backupmtg.append([deepcopy(self.mtg),state])
+        """ start recording an edition in the undo list, with given `state`
+        
+        All modifications of the mtg done through this model, until the next
+        call to `push_backup` or `undo`, are recorded as one undo step.
+        See `treeeditor.tree.history`
         
+        It does nothing during a `transaction`, which is recorded as one step.
+        """
+        if self._transaction is None:
+            self.history.begin(state=state)
+        
+    @_contextmanager
+    def transaction(self, state=None):
+        """ context manager to group many editions in one
+        
+        Usage:
+            with model.transaction() as transaction:
+                for vid in vertices:
+                    model.remove_vertex(vid)
+        
+        All the editions done in the `with` block are recorded as one undo 
+        step, with given `state`, and their change notifications are published
+        at once, at the end of the block (see `treeeditor.mvp.Model.batch`). 
+        The yielded `Transaction` then gives the sets of added, removed and 
+        updated segments.
+        
+        If an exception is raised in the block, all its editions are cancelled
+        and nothing is published.
+        Transactions started inside a transaction are merged with it.
+        """
+        if self._transaction is not None:
+            yield self._transaction
+            return
+            
+        transaction = Transaction(state)
+        with self.batch():
+            self.history.begin(state=state)
+            self._transaction = transaction
+            try:
+                yield transaction
+            except:
+                self._transaction = None
+                entry = self.history.rollback()
+                if entry is not None:
+                    self._restored(entry, entry.vertices())
+                self.discard_changes()
+                raise
+                
+            self._transaction = None
+            entry = self.history.close()
+            if entry is not None:
+                transaction.set_changes(*entry.changes(undo=False, scale=self._segment_scale))
+        if self._presenter is not None:
+            self._presenter.updateGL()
+        
+    @_batched
     def undo(self):
-        """ pop last backed up mtg and state, and return state """         
-        if len(self.backupmtg) > 0:
-            self.mtg, state = self.backupmtg.pop()
-            return state
-        else:
+        """ undo last recorded edition, and return its state """
+        if self._transaction is not None:
+            raise RuntimeError("cannot undo during a transaction")
+        if self._snapshots:
+            entry = self.history.next_undo()
+            self._preserve(entry.vertices() if entry else [])
+        entry = self.history.undo()
+        if entry is None:
+            return False
+        self._restored(entry, entry.vertices())
+        return entry.state
+        
+    @_batched
+    def redo(self):
+        """ redo last undone edition, and return its state """
+        if self._transaction is not None:
+            raise RuntimeError("cannot redo during a transaction")
+        if self._snapshots:
+            entry = self.history.next_redo()
+            self._preserve(entry.vertices() if entry else [])
+        entry = self.history.redo()
+        if entry is None:
             return False
+        self._restored(entry, entry.vertices())
+        return entry.state
+        
+    def _restored(self, entry, vertices):
+        """ update the model after the history restored `vertices` of `entry` """
+        self._reload_geometry(vertices)
+        self._update_topology(vertices)
+        if entry.after is None:   # rolled back edition
+            self._color_cache = {}
+            return
+        self._invalidate_colors(vertices)
+        
+        # segments which complex, or complex of complex, has changed
+        g = self.mtg
+        retyped = [vid for vid in entry.complex_changed() if g.has_vertex(vid)]
+        for vid in retyped:     # retyped is extended while iterating
+            retyped.extend(g._components.get(vid,()))
+        self._invalidate_colors(retyped)
+        self.notify('retyped', [vid for vid in retyped if g.scale(vid)==self._segment_scale])
         
     def undo_number(self):
         """ number of undo available """
-        return len(self.backupmtg)
+        return self.history.undo_number()
+        
+    def redo_number(self):
+        """ number of redo available """
+        return self.history.redo_number()
+        
+    def _touch(self, vertices):
+        """ to be called before modification of `vertices` (id or list of ids) """
+        if isinstance(vertices,(int,long)):
+            vertices = [vertices]
+        self.history.touch(vertices)
+        self._preserve(vertices)
+        self._invalidate_colors(vertices)
+        
+    def _touch_properties(self, names, vertices):
+        """ to be called before modification of properties `names` only of `vertices` """
+        self.history.touch_properties(names, vertices)
+        self._preserve(vertices)
+        self._invalidate_colors(vertices)
+        
+    def _created(self, vertices):
+        """ to be called after creation of `vertices` (id or list of ids) """
+        self.history.created(vertices)
 
+        
+class Transaction(object):
+    """ The segments changed by a `TreeModel.transaction` 
+    
+    `added`, `removed` and `updated` are the sets of segments added, removed
+    and modified by all editions of the transaction. They are set when the 
+    transaction ends: segments added then removed by the transaction are in 
+    none of them.
+    """
+    def __init__(self, state=None):
+        self.state = state
+        self.set_changes(set(), set(), set())
+        
+    def set_changes(self, added, removed, updated):
+        self.added   = added
+        self.removed = removed
+        self.updated = updated
+        
+    def __len__(self):
+        """ number of changed segments """
+        return len(self.added)+len(self.removed)+len(self.updated)
 
         
 class PASModel(TreeModel):
     """ A TreeModel which manages the Plant,Axe,Segment scales """
-    def __init__(self, presenter=None, mtg=None, position='position', radius='radius'):
+    def __init__(self, presenter=None, mtg=None, position='position', radius='radius', progress=None):
         """ create a PASModel to interact with given `mtg` 
         
         `mtg`: 
@@ -559,17 +1190,22 @@ class PASModel(TreeModel):
             Unfound radius are set to 1
         """
         TreeModel.__init__(self,presenter=presenter, mtg=mtg,
-                           position=position, radius=radius)
+                           position=position, radius=radius, progress=progress)
         
         # color
         self._color_fct.append(('axe',self.axe_color))
         self._color_fct.append(('plant',self.plant_color))
     
-    def set_mtg(self,mtg,filename=None, position=None, radius=None):
-        """ set the `mtg` of this PASModel """
-        TreeModel.set_mtg(self,mtg=mtg,filename=filename,position=position,radius=radius)
+    def set_mtg(self,mtg,filename=None, position=None, radius=None, geometry=None):
+        """ set the `mtg` of this PASModel, and check its axe and plant scales """
+        TreeModel.set_mtg(self,mtg=mtg,filename=filename,position=position,radius=radius,
+                          geometry=geometry)
         self._segment_scale = 3
         
+        repaired = self.check_axes()
+        if repaired:
+            self.show_message('Axe or plant of %d segments repaired' % len(repaired))
+        
     # mtg accessor
     # ------------
     def get_axe(self, segment):
@@ -582,6 +1218,7 @@ class PASModel(TreeModel):
     
     # mtg edition
     # -----------
+    @_batched
     def add_branching(self, segment, position):
         """ add a branching vertex (i.e. edge_type '+') to `segment` 
 
@@ -592,12 +1229,47 @@ class PASModel(TreeModel):
           - the set of updated segment
         """
         parent_axe = self.get_axe(segment)
+        self._touch([segment, parent_axe, self.mtg.complex(parent_axe)])
         child_seg,child_axe = self.mtg.add_child_and_complex(segment, edge_type='+')
+        self._created([child_seg, child_axe])
+        self._update_topology([child_seg])
         self.mtg.property('edge_type')[child_axe] = '+'
         self.set_position(child_seg,position)
         
         return child_seg, set([child_seg, segment])
         
+    @_batched
+    def add_successor(self, segment, position):
+        """ add a successor (i.e. edge_type '<') to `segment`
+        
+        The previous successor of `segment`, if any, starts a new branch axe
+        
+        return 
+          - the id of the created segment
+          - the set of updated segment
+        """
+        child, up = TreeModel.add_successor(self, segment, position)
+        self._check_axe_validity(segment, up)
+        return child, up
+        
+    @_batched
+    def insert_parent(self, segment, position):
+        """ insert a new segment as parent of `segment`, in the same axe 
+        
+        return 
+          - the id of the created segment
+          - the set of updated segment
+        """
+        vertex, up = TreeModel.insert_parent(self, segment, position)
+        if vertex!=segment:
+            # keep axe components in axis order
+            axe = self.get_axe(vertex)
+            components = self.mtg._components[axe]
+            components.remove(vertex)
+            components.insert(components.index(segment), vertex)
+        return vertex, up
+        
+    @_batched
     def replace_parent(self, segment, new_parent, edge_type=None):
         """ set the parent of `segment` by `new_parent` 
         
@@ -620,9 +1292,13 @@ class PASModel(TreeModel):
         # have the same axe complex as its previous ancestor segments
         if prev_parent!=new_parent and self.get_axe(segment)==self.get_axe(prev_parent):
             self._new_axe_branch(segment, up)
+            
+        # the reparented subtree may come from another plant
+        self._check_plant_validity(segment, up)
 
         return up
         
+    @_batched
     def remove_vertex(self, segment, reparent_child=True):
         """ remove `segment` from tree 
         
@@ -635,40 +1311,123 @@ class PASModel(TreeModel):
         plant = self.get_plant(segment)
         
         parent = self.parent(segment)
-        children = self.children(segment)
         up = TreeModel.remove_vertex(self, segment, reparent_child)
         self._check_axe_validity(parent, up)
 
         # remove axe and plant if empty
-        if len(self.mtg.components(axe))==0:
-            self.mtg.remove_vertex(axe)
-        if len(self.mtg.components(plant))==0:
-            self.mtg.remove_vertex(plant)
+        self._remove_if_empty(axe)
+        self._remove_if_empty(plant)
 
         return up
         
+    @_batched
     def remove_tree(self, segment):
         """ remove the subtree starting at `segment` """
-        axe   = self.get_axe(segment)
-        plant = self.get_plant(segment)
+        complex = self.mtg.complex
+        axes   = set(map(complex, _mtgalgo.descendants(self.mtg, segment)))
+        plants = set(map(complex, axes))
         
         up = TreeModel.remove_tree(self, segment)
         
-        # remove empty axes
-        if len(self.mtg.components(axe))==0:
-            self.mtg.remove_tree(axe)
-            
-            # remove plant if empty
-            if len(self.mtg.components(plant))==0:
-                self.mtg.remove_tree(plant)
-        else:
-            for a in self.mtg.children(axe):
-                self.mtg.remove_tree(axe)
+        # remove emptied axes and plants
+        for axe in axes:
+            self._remove_if_empty(axe)
+        for plant in plants:
+            self._remove_if_empty(plant)
             
         return up
         
         
         
+    # axe and plant consistency
+    # -------------------------
+    # The segments of an axe are one chain of successors: its first segment is
+    # a tree root or a branch ('+'), and the axe of successors ('<') is the axe
+    # of their parent. All axes of a tree are in the same plant.
+    # The components of axes are kept in axis order: with the mtg complex of 
+    # segments, they form the axis index which is patched by edition methods.
+    @_batched
+    def check_axes(self):
+        """ check, and repair, the axe and plant scales of the whole mtg
+        
+        It runs in one pass over the segments, which are attached to the axe
+        of their chain of successors, and axes to the plant of their tree. 
+        Missing axes are created, and emptied axes and plants are removed.
+        Axes components are sorted in axis order.
+        
+        return the set of segments which axe or plant has been changed
+        """
+        g = self.mtg
+        complex_ = g._complex
+        components = g._components
+        children = g._children
+        successor = self._successor
+        
+        axes = {}          # axe -> ordered segments
+        tree_axes = {}     # plant -> list of the axes of its trees
+        repaired = set()
+        
+        roots = [vid for vid in self.get_nodes() if g.parent(vid) is None]
+        stack = [(root,None) for root in reversed(roots)]  # (axis start, plant)
+        while stack:
+            start, plant = stack.pop()
+            axe = complex_.get(start)
+            if axe is None or axe in axes:
+                # axe used by another chain: create a new one
+                parent = g.parent(start)
+                if parent is None:
+                    plant = complex_.get(axe)
+                    if plant is None:
+                        self._touch(g.root)
+                        plant = g.add_component(g.root)
+                        self._created(plant)
+                    self._touch(plant)
+                    axe = g.add_component(plant)
+                else:
+                    self._touch([complex_[parent], plant])
+                    axe = g.add_child(complex_[parent], edge_type='+')
+                self._created(axe)
+            if plant is None:
+                plant = complex_.get(axe)
+                
+            chain = self.local_axis(start)
+            axes[axe] = chain
+            tree_axes.setdefault(plant,[]).append(axe)
+            for vid in chain:
+                old_axe = complex_.get(vid)
+                if old_axe!=axe:
+                    self._touch([vid, old_axe, axe])
+                    complex_[vid] = axe
+                    repaired.add(vid)
+                for child in children.get(vid,()):
+                    if child!=successor.get(vid):
+                        stack.append((child,plant))
+                        
+        for axe, chain in axes.iteritems():
+            if components.get(axe)!=chain:
+                self._touch(axe)
+                components[axe] = chain
+        for axe in g.vertices(scale=self._segment_scale-1):
+            if axe not in axes and components.get(axe):
+                self._touch(axe)
+                components[axe] = []   # all its segments have been moved
+                
+        # plants
+        for plant, plant_axes in tree_axes.iteritems():
+            moved = [axe for axe in plant_axes if complex_.get(axe)!=plant]
+            if moved:
+                self._change_plant(moved, plant)
+                for axe in moved:
+                    repaired.update(axes[axe])
+                    
+        # remove axes without segments, then plants without axes
+        for scale in (self._segment_scale-1, self._segment_scale-2):
+            for complex_id in g.vertices(scale=scale):
+                self._remove_if_empty(complex_id)
+        
+        self.notify('retyped', repaired)
+        return repaired
+        
     # private edition
     # ---------------
     # used internally by public edition methods
@@ -677,52 +1436,109 @@ class PASModel(TreeModel):
         segment scale should be already connected 
         """
         parent_axe = self.get_axe(self.parent(child))
+        self._touch([parent_axe, self.mtg.complex(parent_axe)])
         new_branch = self.mtg.add_child(parent_axe, edge_type='+')
-        successors = list(_mtgalgo.local_axis(self.mtg,child))
+        self._created(new_branch)
+        successors = self.local_axis(child)
         up.update(successors)
         
         self._change_axe(successors, new_branch)
             
     def _change_axe(self, successors, axe):
-        """ attach all successors to axe """
+        """ move the chain of segments `successors` to `axe`
+        
+        `successors` is a local axis (see `local_axis`), which is moved in the 
+        axe components after its parent, or at the start if its parent is not
+        in `axe`. Emptied axes are removed. 
+        It runs in O(len(successors))
+        """
         g = self.mtg
+        complex_, components = g._complex, g._components
+        old_axes = set(complex_.get(sid) for sid in successors)
+        self._touch(list(old_axes)+[axe]+list(successors))
+        
+        # remove chain from previous axes, expected to be a slice of one axe
+        for old_axe in old_axes:
+            content = components.get(old_axe,[])
+            start = content.index(successors[0]) if successors[0] in content else 0
+            if content[start:start+len(successors)]==successors:
+                del content[start:start+len(successors)]
+            else:
+                chain = set(successors)
+                content[:] = [sid for sid in content if sid not in chain]
+        
+        # insert in new axe
         for sid in successors:
-            g.add_component(axe,sid)
+            complex_[sid] = axe
+        content = components.setdefault(axe,[])
+        parent = g.parent(successors[0])
+        start = content.index(parent)+1 if complex_.get(parent)==axe else 0
+        content[start:start] = successors
+        self.notify('retyped', successors)
+        
+        for old_axe in old_axes:
+            if old_axe is not None and old_axe!=axe:
+                self._remove_if_empty(old_axe)
 
     def _change_plant(self, axes, plant):
         """ attach all axes to plant - blindly - """
         g = self.mtg
+        self._touch(plant)
         for aid in axes:
+            self._touch([aid, g.complex(aid)])
             g.add_component(plant,aid)
+        self._invalidate_colors(axes, cascade=True)   # for plant_color
+        self.notify('retyped', [sid for aid in axes for sid in g._components.get(aid,())])
+            
+    def _remove_if_empty(self, complex_id):
+        """ remove `complex_id` from mtg if it has no components """
+        g = self.mtg
+        if not g.has_vertex(complex_id) or len(g.components(complex_id)):
+            return
+        self._touch([complex_id, g.parent(complex_id), g.complex(complex_id)]
+                    + list(g.children(complex_id)))
+        g.remove_vertex(complex_id)
             
     def _check_axe_validity(self, segment, up):
         """ check for structural validity of axe scale """
-        edge = lambda vid: self.mtg.edge_type(vid)
+        edge_type = self.mtg.property('edge_type')
+        complex   = self.mtg.complex
         
-        segment_axe = self.get_axe(segment)
+        segment_axe = complex(segment)
+        successor   = self.successor(segment)
         
         for child in self.children(segment):
-            child_axe = self.get_axe(child)
-            if edge(child)=='<' and child_axe!=segment_axe:
-                # successor should have same axe as parent
-                successors = list(_mtgalgo.local_axis(self.mtg,child))
-                up.update(successors)
-                
-                self._change_axe(successors, segment_axe)
+            child_axe = complex(child)
+            if child==successor:
+                if child_axe!=segment_axe:
+                    # successor should have same axe as parent
+                    successors = self.local_axis(child)
+                    up.update(successors)
                     
-            elif edge(child)=='+' and child_axe==segment_axe:
+                    self._change_axe(successors, segment_axe)
+                    
+            elif edge_type.get(child)=='+' and child_axe==segment_axe:
                 # branch should not have same axe as parent 
                 self._new_axe_branch(child, up)
 
     def _check_plant_validity(self, segment, up):
-        """ check that all descendants of segment's axe have same plant """
-        plant = self.get_plant(segment)
+        """ check that the axes of `segment` subtree are in the plant of its tree
         
-        axes = []
-        map(axes.extend, (_mtgalgo.descendants(axe) for axe in self.mtg.components(plant)))
-            
+        Plants emptied by the change are removed
+        """
         complex = self.mtg.complex
-        self._change_plant([a for a in axes if complex(a)!=plant])
+        plant = self.get_plant(self.tree_root(segment))
+        if self.get_plant(segment)==plant:
+            return
+            
+        segments = _mtgalgo.descendants(self.mtg, segment)
+        axes = set(map(complex, segments))
+        old_plants = set(map(complex, axes))
+        self._change_plant([a for a in axes if complex(a)!=plant], plant)
+        up.update(segments)
+        
+        for old_plant in old_plants:
+            self._remove_if_empty(old_plant)
         
     
     # appearance
@@ -0,0 +1,212 @@
+"""
+Copy-on-write snapshots of tree models
+
+A `Snapshot` is an immutable view of the mtg of a `TreeModel` at the time it
+is taken, which can be read by a worker thread while the model is being
+edited. It is created in constant time and does not copy the mtg: it reads
+the live mtg, except for the vertices that have been modified since then. The
+model records the state of these vertices in all its live snapshots *before*
+modifying them (see `treeeditor.tree.history.capture_vertex`), such that all
+the unchanged vertices, topology and properties, are shared by the snapshot
+and the model. Memory and time overheads are proportional to the number of
+vertices edited while the snapshot is alive.
+
+Usage
+-----
+    snapshot = model.snapshot()
+    # in a worker thread
+    for vid in snapshot.get_nodes():
+        snapshot.parent(vid), snapshot.get_position(vid), ...
+    # when done
+    snapshot.release()
+
+Reading is lock free: a value read from the live mtg is only returned if the
+vertex has not been recorded in the meantime, otherwise its recorded state is
+used. New vertex ids are expected to be greater than all existing ones, as
+allocated by the MTG class.
+
+A snapshot stops recording vertices when it is released or garbage collected.
+"""
+import numpy as _np
+
+from treeeditor.tree.history import capture_vertex as _capture_vertex
+from treeeditor.tree.history import _TOPOLOGY, _ABSENT
+
+_LIVE = object()
+_INDEX = dict((name,i) for i,name in enumerate(_TOPOLOGY))
+
+
+class Snapshot(object):
+    """ Immutable view of the mtg of a TreeModel, at the time of its creation """
+    def __init__(self, model):
+        """ create the snapshot of `model` current state
+
+        Should be created through `TreeModel.snapshot`, which records the
+        vertices in the snapshot before their edition
+        """
+        mtg = model.mtg
+        self.mtg  = mtg
+        self.root = mtg.root
+        self.position_property = model.position_property
+        self.radius_property   = model.radius_property
+        self._segment_scale = model._segment_scale
+        self._max_scale = mtg.max_scale()
+        self._records = {}     # vertex id -> state at snapshot time (or None)
+        self._last_id = getattr(mtg,'_id',None)
+        if self._last_id is None:
+            self._last_id = max(mtg._scale) if mtg._scale else 0
+        self._model = model
+
+    def release(self):
+        """ stop recording the model editions: the snapshot should not be used """
+        if self._model is not None:
+            self._model._release_snapshot(self)
+            self._model = None
+
+    def _preserve(self, vertices):
+        """ record the current state of `vertices`, if not done already """
+        records = self._records
+        mtg = self.mtg
+        last_id = self._last_id
+        for vid in vertices:
+            if vid is not None and vid<=last_id and vid not in records:
+                records[vid] = _capture_vertex(mtg, vid)
+
+    # lock free reading
+    # -----------------
+    def _topology(self, vid, name):
+        """ return the `name` topology content of `vid`, or _ABSENT """
+        record = self._records.get(vid,_LIVE)
+        if record is _LIVE:
+            value = getattr(self.mtg,name).get(vid,_ABSENT)
+            if isinstance(value,list):
+                value = list(value)
+            record = self._records.get(vid,_LIVE)
+            if record is _LIVE:
+                return value
+        if record is None:
+            return _ABSENT
+        return record[0][_INDEX[name]]
+
+    def _property(self, vid, name):
+        """ return the `name` property of `vid`, or _ABSENT """
+        record = self._records.get(vid,_LIVE)
+        if record is _LIVE:
+            value = self.mtg.property(name).get(vid,_ABSENT)
+            record = self._records.get(vid,_LIVE)
+            if record is _LIVE:
+                return value
+        if record is None:
+            return _ABSENT
+        return record[1].get(name,_ABSENT)
+
+    def _get(self, value, default=None):
+        return default if value is _ABSENT else value
+
+    # mtg api
+    # -------
+    def has_vertex(self, vid):
+        return self._topology(vid,'_scale') is not _ABSENT and vid<=self._last_id
+
+    def max_scale(self):
+        return self._max_scale
+
+    def scale(self, vid):
+        return self._get(self._topology(vid,'_scale'))
+
+    def parent(self, vid):
+        return self._get(self._topology(vid,'_parent'))
+
+    def children(self, vid):
+        return self._get(self._topology(vid,'_children'),[])
+
+    def complex(self, vid):
+        return self._get(self._topology(vid,'_complex'))
+
+    def components(self, vid):
+        return self._get(self._topology(vid,'_components'),[])
+
+    def edge_type(self, vid):
+        return self._get(self._property(vid,'edge_type'),'')
+
+    def vertices(self, scale=None):
+        """ return the list of the vertices (at `scale`) in the snapshot """
+        records = self._records
+        last_id = self._last_id
+        live = [vid for vid in list(self.mtg._scale) if vid<=last_id and vid not in records]
+        vertices = live + [vid for vid,record in records.items() if record is not None]
+        if scale is None:
+            return vertices
+        return [vid for vid in vertices if self.scale(vid)==scale]
+
+    def property(self, name):
+        """ return a read-only dict-like view of property `name` """
+        return _SnapshotProperty(self, name)
+
+    # model api
+    # ---------
+    def get_nodes(self):
+        """ return the ids of the segments """
+        return self.vertices(scale=self._segment_scale)
+
+    def successor(self, vid):
+        """ return the successor of `vid`, or None """
+        for child in self.children(vid):
+            if self.edge_type(child)=='<':
+                return child
+        return None
+
+    def get_position(self, vid):
+        """ return the position of `vid` as a list (NaN if missing) """
+        return self.get_positions([vid])[0].tolist()
+
+    def get_positions(self, vertices=None):
+        """ return the positions of `vertices` (or all segments) as a (N,3) array """
+        if vertices is None:
+            vertices = self.get_nodes()
+        nan = float('nan')
+        if isinstance(self.position_property,basestring):
+            missing = (nan,)*3
+            positions = [tuple(self._get(self._property(vid,self.position_property),missing))
+                                for vid in vertices]
+            return _np.array(positions, dtype=float).reshape(-1,3)
+        else:
+            positions = [[self._get(self._property(vid,name),nan) for vid in vertices]
+                                for name in self.position_property]
+            return _np.array(positions, dtype=float).T.reshape(-1,3)
+
+    def get_radius(self, vid):
+        """ return the radius of `vid` """
+        return self._get(self._property(vid,self.radius_property),1)
+
+    def get_radii(self, vertices=None):
+        """ return the radius of `vertices` (or all segments) as an array """
+        if vertices is None:
+            vertices = self.get_nodes()
+        return _np.array(map(self.get_radius, vertices), dtype=float)
+
+
+class _SnapshotProperty(object):
+    """ Read-only dict-like view of a property of a Snapshot """
+    def __init__(self, snapshot, name):
+        self._snapshot = snapshot
+        self._name = name
+
+    def get(self, vid, default=None):
+        return self._snapshot._get(self._snapshot._property(vid,self._name),default)
+
+    def __getitem__(self, vid):
+        value = self._snapshot._property(vid,self._name)
+        if value is _ABSENT:
+            raise KeyError(vid)
+        return value
+
+    def __contains__(self, vid):
+        return self._snapshot._property(vid,self._name) is not _ABSENT
+
+    def iteritems(self):
+        snapshot, name = self._snapshot, self._name
+        for vid in snapshot.vertices():
+            value = snapshot._property(vid,name)
+            if value is not _ABSENT:
+                yield vid, value
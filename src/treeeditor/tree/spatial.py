@@ -0,0 +1,361 @@
+"""
+Spatial index of 3d points, used to accelerate picking of control points
+
+`PointGrid` stores points in the cells of a uniform grid. Adding, moving or
+removing a point is done in constant time, and a query for the points close to
+a ray (such as the line generated by a mouse click) only looks at the points
+stored in the cells that the (thickened) ray traverses.
+
+`PointBounds` maintains the bounding box of a set of points incrementally, as
+the bounding boxes of views.
+
+The views are drawn by chunks which are culled out of the camera view volume:
+`view_planes` returns the planes bounding this volume, `boxes_outside` tests
+the chunk bounding boxes against them, and `morton_order` sorts points such
+that consecutive points are close, i.e. blocks of them have small bounding
+boxes.
+"""
+from math import floor as _floor, ceil as _ceil, sqrt as _sqrt
+
+import numpy as _np
+
+
+class PointGrid(object):
+    """ Uniform grid of identified 3d points """
+    points_per_cell = 8
+
+    def __init__(self, cell_size=1.):
+        """ create an empty PointGrid with cells of size `cell_size` """
+        self.clear(cell_size)
+
+    def clear(self, cell_size=None):
+        """ remove all points, and set grid `cell_size` if given """
+        if cell_size is not None:
+            self.cell_size = float(cell_size)
+        self._points  = {}   # point id -> (x,y,z)
+        self._cell_of = {}   # point id -> cell key
+        self._cells   = {}   # cell key -> set of point id
+        self._lower = [float('inf')]*3
+        self._upper = [-float('inf')]*3
+
+    @staticmethod
+    def from_points(points, min_cell_size=0):
+        """ create a PointGrid containing `points`
+
+        `points`: a list of (id, position) pairs
+        `min_cell_size`: lower bound of the grid cell size. Queries are faster
+                         if it is at least twice the query distance.
+
+        The cell size is selected such that cells contain about
+        `PointGrid.points_per_cell` points.
+        """
+        points = [(pid,tuple(map(float,pos))) for pid,pos in points]
+        cell_size = PointGrid.select_cell_size([pos for pid,pos in points])
+
+        grid = PointGrid(max(cell_size, min_cell_size))
+        for pid, pos in points:
+            grid.add(pid,pos)
+        return grid
+
+    @staticmethod
+    def select_cell_size(positions):
+        """ return a cell size such that cells contains few of `positions`
+
+        Dimensions of null extent are ignored, i.e. for points in a plane the
+        area of their bounding box is used.
+        """
+        if len(positions)<2:
+            return 1.
+        extent = [max(coord)-min(coord) for coord in zip(*positions)]
+        extent = [e for e in extent if e>1e-9*max(extent)]
+        if len(extent)==0:
+            return 1.
+
+        measure = reduce(lambda x,y: x*y, extent)
+        cells   = max(1., len(positions)/float(PointGrid.points_per_cell))
+        return (measure/cells)**(1./len(extent))
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, pid):
+        return pid in self._points
+
+    def _cell(self, position):
+        """ return the key of the cell containing `position` """
+        size = self.cell_size
+        return tuple(int(_floor(c/size)) for c in position)
+
+    # edition
+    # -------
+    def add(self, pid, position):
+        """ add (or move) point `pid` at `position` """
+        position = tuple(map(float,position))
+        cell = self._cell(position)
+
+        previous = self._cell_of.get(pid)
+        if previous!=cell:
+            if previous is not None:
+                self._remove_from_cell(pid, previous)
+            self._cells.setdefault(cell,set()).add(pid)
+            self._cell_of[pid] = cell
+        self._points[pid] = position
+
+        self._lower = map(min, self._lower, position)
+        self._upper = map(max, self._upper, position)
+
+    move = add
+
+    def remove(self, pid):
+        """ remove point `pid` (do nothing if it is not in the grid) """
+        cell = self._cell_of.pop(pid,None)
+        if cell is not None:
+            self._remove_from_cell(pid, cell)
+            del self._points[pid]
+
+    def _remove_from_cell(self, pid, cell):
+        content = self._cells[cell]
+        content.discard(pid)
+        if not content:
+            del self._cells[cell]
+
+    def rebuild(self, cell_size):
+        """ redistribute all points in a grid with cells of size `cell_size` """
+        points = self._points.items()
+        self.clear(cell_size)
+        for pid, pos in points:
+            self.add(pid, pos)
+
+    # query
+    # -----
+    def ray_query(self, start, direction, distance, z_min=0, z_max=float('inf')):
+        """ find the points close to a ray
+
+        `start`     start position of the ray
+        `direction` unit vector giving the direction of the ray
+        `distance`  maximum (perpendicular) distance of the points to the ray
+        `z_min`     minimum distance from `start` (depth along the ray)
+        `z_max`     maximum distance from `start`
+
+        return the list of (z,d,pid) for all points `pid` that are at depth `z`
+        in [z_min,z_max] along the ray and at a distance `d`<`distance` to it.
+        """
+        if not self._points:
+            return []
+        start     = tuple(map(float,start))
+        direction = tuple(map(float,direction))
+
+        # grow cells if they are too small compared to the query distance
+        if distance > self.cell_size:
+            self.rebuild(2*distance)
+        size = self.cell_size
+
+        # clip the ray to the points bounding box, thickened by `distance`
+        z_lo, z_hi = float(z_min), float(z_max)
+        for s,d,lo,hi in zip(start,direction,self._lower,self._upper):
+            lo -= distance
+            hi += distance
+            if abs(d)<1e-12:
+                if not lo<=s<=hi:
+                    return []
+            else:
+                t1, t2 = (lo-s)/d, (hi-s)/d
+                if t1>t2: t1,t2 = t2,t1
+                z_lo, z_hi = max(z_lo,t1), min(z_hi,t2)
+        if z_lo>z_hi:
+            return []
+
+        # select cells close to regularly sampled positions along the ray
+        #  a point at less than distance to the ray is at less than
+        #  distance+size/2 of its closest sample
+        m = int(_ceil(distance/size + .5))
+        offsets = [(i,j,k) for i in xrange(-m,m+1)
+                            for j in xrange(-m,m+1)
+                            for k in xrange(-m,m+1)]
+        sample_number = int((z_hi-z_lo)/size)+2
+        step = (z_hi-z_lo)/(sample_number-1)
+
+        cells = self._cells
+        selected = set()
+        previous = None
+        for n in xrange(sample_number):
+            t = z_lo + n*step
+            x,y,z = self._cell([s+t*d for s,d in zip(start,direction)])
+            if (x,y,z)==previous:
+                continue
+            previous = (x,y,z)
+            for i,j,k in offsets:
+                key = (x+i,y+j,z+k)
+                if key in cells:
+                    selected.add(key)
+
+        # exact test on the points of selected cells
+        sx,sy,sz = start
+        dx,dy,dz = direction
+        found = []
+        points = self._points
+        for key in selected:
+            for pid in cells[key]:
+                px,py,pz = points[pid]
+                px,py,pz = px-sx, py-sy, pz-sz
+                z = px*dx + py*dy + pz*dz
+                if not z_min<=z<=z_max:
+                    continue
+                px,py,pz = px-z*dx, py-z*dy, pz-z*dz
+                d = _sqrt(px*px + py*py + pz*pz)
+                if d<distance:
+                    found.append((z,d,pid))
+
+        return found
+
+
+class PointBounds(object):
+    """ Bounding box of identified points, updated incrementally
+
+    Adding a point, or moving one outward, extends the box in constant time.
+    The ids of the points on the 6 faces of the box are recorded: removing one
+    of them, or moving it inward, only marks the box for recomputation. It is
+    done by the next call to `get`, from the arrays of all points ids and
+    positions returned by `source`. Points with NaN coordinates are ignored.
+    """
+    def __init__(self, source):
+        """ create the bounds of the points given by `source`
+
+        `source`: function that returns the arrays of the ids and (N,3)
+                  positions of all points
+        """
+        self.source = source
+        self.reset()
+
+    def reset(self):
+        """ mark the bounds for recomputation """
+        self._valid = False
+        self._lower = self._upper = None   # lists of coordinates
+        self._lower_ids = self._upper_ids = [None]*3
+
+    def _compute(self):
+        """ compute the bounds from `source` """
+        ids, positions = self.source()
+        positions = _np.asarray(positions, dtype=float).reshape(-1,3)
+        valid = ~_np.isnan(positions).any(axis=1)
+        ids, positions = _np.asarray(ids)[valid], positions[valid]
+        self._valid = True
+        if len(ids)==0:
+            self._lower = self._upper = None
+            self._lower_ids = self._upper_ids = [None]*3
+        else:
+            lower = positions.argmin(axis=0)
+            upper = positions.argmax(axis=0)
+            self._lower = positions[lower,[0,1,2]].tolist()
+            self._upper = positions[upper,[0,1,2]].tolist()
+            self._lower_ids = ids[lower].tolist()
+            self._upper_ids = ids[upper].tolist()
+
+    def get(self):
+        """ return the (lower,upper) corners of the bounds, or None if empty """
+        if not self._valid:
+            self._compute()
+        if self._lower is None:
+            return None
+        return list(self._lower), list(self._upper)
+
+    def add(self, pid, position):
+        """ extend the bounds with point `pid` at `position` """
+        if not self._valid:
+            return
+        position = map(float,position)
+        if any(coord!=coord for coord in position):   # NaN
+            return
+        if self._lower is None:
+            self._lower, self._upper = list(position), list(position)
+            self._lower_ids, self._upper_ids = [pid]*3, [pid]*3
+            return
+        lower, upper = self._lower, self._upper
+        for axis,coord in enumerate(position):
+            if coord<lower[axis]:
+                lower[axis] = coord
+                self._lower_ids[axis] = pid
+            if coord>upper[axis]:
+                upper[axis] = coord
+                self._upper_ids[axis] = pid
+
+    def move(self, pid, position):
+        """ update the bounds for point `pid` moved to `position` """
+        if not self._valid:
+            return
+        position = map(float,position)
+        for axis,coord in enumerate(position):
+            if (self._lower_ids[axis]==pid and not coord<=self._lower[axis]) or \
+               (self._upper_ids[axis]==pid and not coord>=self._upper[axis]):
+                self._valid = False
+                return
+        self.add(pid, position)
+
+    def remove(self, pid):
+        """ update the bounds for the removal of point `pid` """
+        if pid in self._lower_ids or pid in self._upper_ids:
+            self._valid = False
+
+
+# view culling
+# ------------
+def view_planes(position, direction, up, right, near, far, tan_half_fov=None, aspect=1.):
+    """ return the (N,4) array of the planes bounding a camera view volume
+
+    A point p is in the volume if dot(plane[:3],p)+plane[3] >= 0 for all planes.
+    The volume is between the `near` and `far` depth along the view `direction`
+    from the camera `position`, and inside the pyramid given by the tangent of
+    half the vertical field of view `tan_half_fov` and the `aspect` ratio
+    (width/height). If `tan_half_fov` is None (orthographic camera), only the
+    depth planes are used.
+    """
+    position, direction, up, right = [_np.asarray(v, dtype=float)
+                                         for v in (position, direction, up, right)]
+    depth = direction.dot(position)
+    normals = [direction, -direction]
+    offsets = [-depth-near, depth+far]
+    if tan_half_fov is not None:
+        tan_half_width = tan_half_fov*aspect
+        for normal in [ right+tan_half_width*direction, -right+tan_half_width*direction,
+                        up+tan_half_fov*direction,      -up+tan_half_fov*direction]:
+            normals.append(normal)
+            offsets.append(-normal.dot(position))
+    return _np.hstack([_np.array(normals), _np.array(offsets)[:,None]])
+
+def boxes_outside(lower, upper, planes):
+    """ return the boolean array of the boxes entirely outside of `planes`
+
+    `lower`, `upper`: (N,3) arrays of the boxes corners
+    `planes`: the planes bounding a volume, see `view_planes`
+
+    A box is outside if it is on the outer side of one of the planes. Boxes
+    with NaN corners are never outside.
+    """
+    normals = planes[:,:3]
+    offsets = planes[:,3]
+    # corner of each box the farthest along each plane normal
+    corners = _np.where(normals>0, upper[:,None,:], lower[:,None,:])
+    with _np.errstate(invalid='ignore'):
+        return ((corners*normals).sum(axis=2)+offsets<0).any(axis=1)
+
+def morton_order(positions, bits=10):
+    """ return the indices sorting `positions` along a Z-order curve
+
+    Positions are quantized in a grid of cubic cells, with 2^`bits` cells in
+    the largest dimension of their bounding box. Successive positions in this
+    order are in the same cells of an octree, as much as possible.
+    """
+    positions = _np.nan_to_num(_np.asarray(positions, dtype=float).reshape(-1,3))
+    if len(positions)==0:
+        return _np.array([], dtype=int)
+    lower  = positions.min(axis=0)
+    extent = (positions.max(axis=0)-lower).max()
+    if not extent>0:
+        extent = 1.
+    cells = ((positions-lower)/extent*(2**bits-1)).astype(_np.int64)
+
+    codes = _np.zeros(len(positions), dtype=_np.int64)
+    for bit in xrange(bits):
+        for axis in xrange(3):
+            codes |= ((cells[:,axis]>>bit)&1) << (3*bit+axis)
+    return _np.argsort(codes, kind='mergesort')
@@ -0,0 +1,154 @@
+"""
+Array storage of tree geometry
+
+`GeometryStore` keeps the position and radius of a set of vertices in
+contiguous numpy arrays: an (N,3) array of positions and an (N,) array of
+radius, indexed through a vertex-id-to-row dictionary. It provides vectorized
+bulk accessors used to create views and to export models.
+
+Rows are kept contiguous: removing a vertex moves the last row in its place.
+"""
+import numpy as _np
+
+_NAN3 = (_np.nan,)*3
+
+
+class GeometryStore(object):
+    """ Array storage of the positions and radius of identified vertices """
+    def __init__(self, capacity=64):
+        """ create an empty GeometryStore """
+        capacity = max(capacity,1)
+        self._positions = _np.empty((capacity,3))
+        self._radii     = _np.empty(capacity)
+        self._vids      = _np.empty(capacity, dtype=int)
+        self.rows = {}     # vertex id -> row in arrays
+        self.size = 0
+
+    @staticmethod
+    def from_arrays(vids, positions, radii=None):
+        """ create a GeometryStore from arrays of vertex ids, positions and radius
+
+        `positions` should be a (N,3) array, and `radii` a (N,) array. If not
+        given, radius are set to 1.
+        """
+        vids = _np.asarray(vids, dtype=int).ravel()
+        store = GeometryStore(capacity=len(vids))
+        size = len(vids)
+        store._vids[:size] = vids
+        store._positions[:size] = _np.asarray(positions, dtype=float).reshape(-1,3)
+        store._radii[:size] = 1 if radii is None else radii
+        store.rows = dict(zip(vids.tolist(), xrange(size)))
+        store.size = size
+        return store
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, vid):
+        return vid in self.rows
+
+    # array views
+    # -----------
+    @property
+    def vids(self):
+        """ array of the stored vertex ids (in row order) """
+        return self._vids[:self.size]
+
+    @property
+    def positions(self):
+        """ (N,3) array of the stored positions (in row order) """
+        return self._positions[:self.size]
+
+    @property
+    def radii(self):
+        """ (N,) array of the stored radius (in row order) """
+        return self._radii[:self.size]
+
+    def row_indices(self, vids):
+        """ return the array of the rows of `vids` """
+        rows = self.rows
+        return _np.fromiter((rows[vid] for vid in vids), dtype=int)
+
+    # edition
+    # -------
+    def _reserve(self, size):
+        """ grow arrays, if necessary, to store `size` rows """
+        capacity = len(self._radii)
+        if size <= capacity:
+            return
+        capacity = max(size, 2*capacity)
+        for name in ('_positions','_radii','_vids'):
+            array = getattr(self,name)
+            new = _np.empty((capacity,)+array.shape[1:], dtype=array.dtype)
+            new[:self.size] = array[:self.size]
+            setattr(self,name,new)
+
+    def add(self, vid, position=_NAN3, radius=1):
+        """ add (or set) vertex `vid` with given `position` and `radius` """
+        row = self.rows.get(vid)
+        if row is None:
+            self._reserve(self.size+1)
+            row = self.size
+            self.size += 1
+            self.rows[vid] = row
+            self._vids[row] = vid
+        self._positions[row] = position
+        self._radii[row] = radius
+
+    def remove(self, vid):
+        """ remove vertex `vid`, if stored """
+        row = self.rows.pop(vid, None)
+        if row is None:
+            return
+        last = self.size-1
+        if row!=last:
+            moved = self._vids[last]
+            self._vids[row] = moved
+            self._positions[row] = self._positions[last]
+            self._radii[row] = self._radii[last]
+            self.rows[int(moved)] = row
+        self.size = last
+
+    # single vertex accessors
+    # -----------------------
+    def get_position(self, vid):
+        """ return the position of `vid` as a list """
+        return self._positions[self.rows[vid]].tolist()
+
+    def set_position(self, vid, position):
+        """ set the position of `vid` (which is added if not stored) """
+        row = self.rows.get(vid)
+        if row is None: self.add(vid, position=position)
+        else:           self._positions[row] = position
+
+    def get_radius(self, vid):
+        """ return the radius of `vid` """
+        return float(self._radii[self.rows[vid]])
+
+    def set_radius(self, vid, radius):
+        """ set the radius of `vid` (which is added if not stored) """
+        row = self.rows.get(vid)
+        if row is None: self.add(vid, radius=radius)
+        else:           self._radii[row] = radius
+
+    # bulk accessors
+    # --------------
+    def get_positions(self, vids=None):
+        """ return the (N,3) array of the positions of `vids` (all if None) """
+        if vids is None:
+            return self.positions.copy()
+        return self._positions[self.row_indices(vids)]
+
+    def set_positions(self, vids, positions):
+        """ set the positions of `vids` from (N,3) array `positions` """
+        self._positions[self.row_indices(vids)] = positions
+
+    def get_radii(self, vids=None):
+        """ return the array of the radius of `vids` (all if None) """
+        if vids is None:
+            return self.radii.copy()
+        return self._radii[self.row_indices(vids)]
+
+    def set_radii(self, vids, radii):
+        """ set the radius of `vids` from array `radii` """
+        self._radii[self.row_indices(vids)] = radii
@@ -0,0 +1,250 @@
+"""
+Structural validation of tree models
+
+`TreeValidator` checks the invariants expected by `TreeModel` on all the
+segments of its mtg, and returns the violating segments grouped by kind:
+
+  - successors: segments with more than one successor ('<') child
+  - cycles:     segments on a cycle of parents
+  - dangling:   segments which parent is not a segment of the mtg
+  - orphans:    segments without parent nor children, such as those created
+                by `TreeModel.new_vertex` and never connected
+  - positions:  segments with a missing (NaN) position
+  - complexes:  segments which axe or plant disagrees with their parent: a
+                successor should be in the axe of its parent, a branch in
+                another axe, and both in the plant of their parent. This is
+                only checked for models with axe and plant scales (PASModel)
+
+The first validation is done in one vectorized pass over the flattened arrays
+of segment parents and edge types. Then the validator subscribes to the model
+changes (see `treeeditor.mvp.Model.subscribe`) and, by default, following
+validations only recheck the segments changed since the last one, their
+parents and children, and the segments in violation. It can thus be run after
+every edition.
+
+Usage
+-----
+    validator = TreeValidator(model)
+    violations = validator.validate()   # dict kind -> sorted list of segments
+    model.remove_vertex(vid)
+    violations = validator.validate()   # only recheck changed segments
+    validator.close()                   # stop following model changes
+"""
+import numpy as _np
+
+KINDS = ('successors', 'cycles', 'dangling', 'orphans', 'positions', 'complexes')
+
+
+class TreeValidator(object):
+    """ Check the structure of the segments of a TreeModel """
+    def __init__(self, model, complexes=None):
+        """ create a validator of `model`, which follows its changes
+
+        `complexes`: if True, check the axe and plant of segments. By default,
+                     it is done for models which have a `check_axes` method.
+        """
+        if complexes is None:
+            complexes = hasattr(model, 'check_axes')
+        self.model = model
+        self.complexes = complexes
+        self._violations = None   # kind -> set of segments, of last validation
+        self._parent_ids = None   # parent of segments (-1 if None) at last full validation...
+        self._row_of = None       # ...indexed by the array of segment id -> row
+        self._parents = {}        # segment -> parent, updated since then
+        self._changed = set()     # segments changed since last validation
+        self._removed = set()     # segments removed since last validation
+        model.subscribe(self._model_changed)
+
+    def close(self):
+        """ stop following the model changes """
+        self.model.unsubscribe(self._model_changed)
+
+    def _model_changed(self, changes):
+        self._changed.update(changes.added)
+        self._changed.update(changes.updated())
+        self._changed.difference_update(changes.removed)
+        self._removed.update(changes.removed)
+
+    def validate(self, full=False):
+        """ check the tree structure and return the violations
+
+        If `full` is False, and a validation has already been done, only the
+        segments which can have changed since are checked.
+
+        return a dict of (kind, sorted list of segments) for all `KINDS`
+        """
+        if full or self._violations is None:
+            self._validate_all()
+        else:
+            self._validate_changed()
+        self._changed = set()
+        self._removed = set()
+        return dict((kind, sorted(self._violations[kind])) for kind in KINDS)
+
+    # full validation
+    # ---------------
+    def _validate_all(self):
+        """ check all segments, with vectorized operations """
+        model = self.model
+        g = model.mtg
+        geometry = model._geometry
+        vids = geometry.vids.copy()
+        vid_list = vids.tolist()
+        n = len(vid_list)
+
+        parents = _np.array([-1 if pid is None else pid for pid in map(g._parent.get, vid_list)],
+                            dtype=int).reshape(-1)
+
+        # row of the parent segment, -1 for roots and non-segment parents
+        size = max(vids.max() if n else 0, parents.max() if n else 0)+1
+        row_of = _np.empty(size, dtype=int)
+        row_of[:] = -1
+        row_of[vids] = _np.arange(n)
+        self._row_of, self._parent_ids, self._parents = row_of, parents, {}
+        
+        successor_ids = [vid for vid,edge in g.property('edge_type').iteritems()
+                                 if edge=='<' and vid<size]
+        successor_rows = row_of[_np.array(successor_ids, dtype=int)]
+        is_successor = _np.zeros(n, dtype=bool)
+        is_successor[successor_rows[successor_rows>=0]] = True
+        
+        has_parent = parents>=0
+        parent_rows = _np.where(has_parent, row_of[_np.maximum(parents,0)], -1)
+        connected = parent_rows>=0
+
+        children = _np.bincount(parent_rows[connected], minlength=n)
+        successors = _np.bincount(parent_rows[connected & is_successor], minlength=n)
+
+        violations = dict((kind,set()) for kind in KINDS)
+        violations['successors'].update(vids[successors>1].tolist())
+        violations['dangling'].update(vids[has_parent & ~connected].tolist())
+        violations['orphans'].update(vids[~has_parent & (children==0)].tolist())
+        violations['positions'].update(vids[_np.isnan(geometry.positions).any(axis=1)].tolist())
+        violations['cycles'].update(vids[self._cycle_rows(parent_rows)].tolist())
+        if self.complexes:
+            complex_of = g._complex.get
+            axe_list = map(complex_of, vid_list)
+            axes   = _np.array([-1 if axe is None else axe for axe in axe_list], dtype=int)
+            plants = _np.array([-1 if axe is None else complex_of(axe,-1) for axe in axe_list], dtype=int)
+            rows = _np.flatnonzero(connected)
+            prows = parent_rows[rows]
+            invalid = axes<0
+            invalid[rows] |= (axes[rows]==axes[prows])!=is_successor[rows]
+            invalid[rows] |= plants[rows]!=plants[prows]
+            violations['complexes'].update(vids[invalid].tolist())
+
+        self._violations = violations
+
+    @staticmethod
+    def _cycle_rows(parent_rows):
+        """ return the rows on a cycle of `parent_rows` (-1 for roots)
+
+        Ancestors are found by pointer jumping: after k steps, `up` is the
+        2^k-th ancestor of each row, or the sentinel row n if it is a root.
+        """
+        n = len(parent_rows)
+        up = _np.append(_np.where(parent_rows>=0, parent_rows, n), n)
+        for step in xrange(n.bit_length()+1):
+            next_up = up[up]
+            if (next_up==up).all():
+                break
+            up = next_up
+        lost = _np.flatnonzero(up[:n]!=n)
+        if not len(lost):
+            return lost
+
+        # rows reached by lost rows are on cycles: walk these cycles
+        cycles = set()
+        for row in _np.unique(up[lost]).tolist():
+            while row not in cycles:
+                cycles.add(row)
+                row = int(parent_rows[row])
+        return _np.array(sorted(cycles), dtype=int)
+
+    # incremental validation
+    # ----------------------
+    def _validate_changed(self):
+        """ check the changed segments, their parents, children and violations """
+        g = self.model.mtg
+        geometry = self.model._geometry
+        parents = self._parents
+        violations = self._violations
+
+        check = set(self._changed)
+        for vid in self._removed:
+            check.add(self._old_parent(vid))
+            parents[vid] = None
+            for kind in KINDS:
+                violations[kind].discard(vid)
+        for vid in self._changed:
+            check.add(self._old_parent(vid))
+            if vid in geometry:
+                parents[vid] = g._parent.get(vid)
+                check.add(parents[vid])
+                check.update(g._children.get(vid,()))
+        for kind in KINDS:
+            check.update(violations[kind])
+        check = [vid for vid in check if vid in geometry]
+
+        for kind in KINDS:
+            violations[kind].difference_update(check)
+        for vid in check:
+            for kind in self._check_segment(vid):
+                violations[kind].add(vid)
+        violations['cycles'].update(self._walk_cycles(check))
+
+    def _old_parent(self, vid):
+        """ return the parent of segment `vid` at last validation """
+        if vid in self._parents:
+            return self._parents[vid]
+        if vid<len(self._row_of):
+            row = self._row_of[vid]
+            if row>=0 and self._parent_ids[row]>=0:
+                return int(self._parent_ids[row])
+        return None
+        
+    def _check_segment(self, vid):
+        """ return the kinds of violations of segment `vid`, but cycles """
+        g = self.model.mtg
+        geometry = self.model._geometry
+        edge_type = g.property('edge_type')
+        parent = g._parent.get(vid)
+        children = [cid for cid in g._children.get(vid,()) if cid in geometry]
+
+        if sum(1 for cid in children if edge_type.get(cid)=='<')>1:
+            yield 'successors'
+        if parent is not None and parent not in geometry:
+            yield 'dangling'
+        if parent is None and not children:
+            yield 'orphans'
+        if _np.isnan(geometry.get_position(vid)).any():
+            yield 'positions'
+        if self.complexes:
+            complex_of = g._complex.get
+            axe = complex_of(vid)
+            if axe is None:
+                yield 'complexes'
+            elif parent in geometry:
+                parent_axe = complex_of(parent)
+                if (axe==parent_axe)!=(edge_type.get(vid)=='<') or \
+                   complex_of(axe)!=complex_of(parent_axe):
+                    yield 'complexes'
+
+    def _walk_cycles(self, vertices):
+        """ return the segments on a cycle of parents containing an ancestor of `vertices` """
+        parent_of = self.model.mtg._parent.get
+        geometry = self.model._geometry
+        done = set()
+        cycles = set()
+        for vid in vertices:
+            path = []
+            index = {}
+            while vid is not None and vid in geometry and vid not in done:
+                if vid in index:
+                    cycles.update(path[index[vid]:])
+                    break
+                index[vid] = len(path)
+                path.append(vid)
+                vid = parent_of(vid)
+            done.update(path)
+        return cycles
@@ -1,6 +1,7 @@
 """
 Implements Views to draw tree
 """
+import numpy as _np
 import openalea.plantgl.all as _pgl
 
 if _pgl.PGL_VERSION > 0x20e00:
@@ -9,14 +10,54 @@ else:
   from editablectrlpoint import CtrlPoint
 
 from treeeditor.mvp import View as _View
+from treeeditor.tree.spatial import PointGrid     as _PointGrid
+from treeeditor.tree.spatial import PointBounds   as _PointBounds
+from treeeditor.tree.spatial import view_planes   as _view_planes
+from treeeditor.tree.spatial import boxes_outside as _boxes_outside
+from treeeditor.tree.spatial import morton_order  as _morton_order
+from treeeditor.tree.lod     import AxisLOD       as _AxisLOD
 
 def _pgl_vec(position):
     """ create a plantgl Vector3 from an iterable """
     return _pgl.Vector3(*position)
     
+def _vec_list(vec):
+    """ convert a QGLViewer Vec to a list """
+    return [vec.x, vec.y, vec.z]
+    
+def camera_planes(editor):
+    """ return the planes bounding the space visible by the `editor` camera
+    
+    It is the camera frustum, restricted to the depth slab of the editor
+    clipping planes if they are enabled (see `TreeEditorWidget.draw`). 
+    See `treeeditor.tree.spatial.view_planes`
+    """
+    camera = editor.camera()
+    z_near, z_far = camera.zNear(), camera.zFar()
+    near, far = z_near, z_far
+    if getattr(editor,'clippingPlaneEnabled',False):
+        z_delta = (z_far-z_near)/2
+        if editor.frontVisibility > 0:
+            near = z_near + z_delta*editor.frontVisibility
+        if editor.backVisibility < 1.0:
+            far = z_near + z_delta*editor.backVisibility
+    
+    tan_half_fov = None
+    if camera.type()!=camera.ORTHOGRAPHIC:
+        tan_half_fov = _np.tan(camera.fieldOfView()/2)
+    return _view_planes(_vec_list(camera.position()),  _vec_list(camera.viewDirection()),
+                        _vec_list(camera.upVector()),  _vec_list(camera.rightVector()),
+                        near, far, tan_half_fov, camera.aspectRatio())
+    
                  
 class AbstractView(_View):
-    """ Abstract class of views """
+    """ Abstract class of views 
+    
+    The bounding box of views is not computed from their scene, but from the
+    running `bounds` of the positions of the model nodes (see `PointBounds`),
+    which subclasses update incrementally when nodes are added, moved and 
+    removed.
+    """
     def __init__(self, theme=None):
         """ Shared construcor behavior of view classes
         
@@ -29,18 +70,47 @@ class AbstractView(_View):
         self.content = {}         # main content as a dict (tree-id, plantgl objects) 
         self.scene = _pgl.Scene() # graphical representation as a PlantGL.Scene object 
         self.scene_index = {}     # map key of `content`  to  index in `scene`
+        self.model = None
+        self.bounds = _PointBounds(self._geometry)
+        
+    def _geometry(self):
+        """ return the arrays of ids and positions of all nodes of the model """
+        if self.model is None:
+            return _np.array([],dtype=int), _np.zeros((0,3))
+        return self.model.get_geometry()
+        
+    def _compute_boundingbox(self):
+        """ set the boundingbox from the running `bounds` """
+        bounds = self.bounds.get()
+        bbox = _pgl.BoundingBox(tuple(bounds[0]),tuple(bounds[1])) if bounds else None
+        _View._compute_boundingbox(self,bbox)
 
         
 
 class ControlPointsView(AbstractView):
     """
     Class that implements a graphical representation of a control points set
+    
+    All control points are drawn in batch, as PlantGL PointSets with per 
+    point colors. Only the selected and focused points are drawn as (sphere)
+    editable CtrlPoint objects, which are created on demand by `get_point`.
+    
+    Points are stored in blocks of at most `block_size` points, one PointSet
+    for each, ordered such that blocks are spatially compact. Blocks out of 
+    the camera view are not drawn (see `visible_scene`).
     """
-    def __init__(self, theme=None):
+    block_size = 1024
+    
+    def __init__(self, theme=None, spatial_index=True, culling=True):
         """ Construct an empty ControlPointView 
         
         `theme` can be a alternative dictionary to this module's THEME_DEFAULT
+        `spatial_index` if True, use a spatial index to find points selected 
+                        by mouse (see `point_at`)
+        `culling` if True, do not draw the blocks of points out of the camera view
         """
+        self.spatial_index = spatial_index
+        self.culling = culling
         AbstractView.__init__(self,theme=theme)
         self.focus = None
         scale  = self.theme['point_diameter']
@@ -61,6 +131,15 @@ class ControlPointsView(AbstractView):
             point.hasFocus = True
             self.update(self.focus.id)
 
+    def clear(self):
+        AbstractView.clear(self)
+        self.blocks = []          # list of _PointBlock drawing all points (`content`: node id -> block)
+        self.points = {}          # node id -> editable CtrlPoint, see `get_point`
+        self.point_index = None   # spatial index of the control points
+        self.update_callback = None
+        self._block_bounds = None # (lower,upper) arrays of blocks bounding box
+        self._visible = None      # (outside blocks, scene) of last culling
+
     # accessors
     # ---------
     def point_at(self, line_start, direction, z_min, z_max, factor=2):
@@ -79,32 +158,45 @@ class ControlPointsView(AbstractView):
         allows to look for close enough points: it will return the closest point
         (in depth along the line) that is a less that `factor`*point-radius 
         perpendicular distance to the line.
-        """
-        norm = _pgl.norm
         
+        If this view has a spatial index, only the control points close to the 
+        line are tested. Otherwise, all of them are.
+        """
         possibles = []
-        if self.display and self.content:
-            start = line_start
-            ray_dir  = direction
-            for ctrl_point in self.content.itervalues():
-                p = (ctrl_point.position()-start)  # position relative to line start
-                z = ray_dir * p                    # distance from start along line (depth)
-                d = norm(p-z*ray_dir)              # distance from p to line
+        radius = self.theme['point_diameter']
+        if self.display and self.point_index is not None:
+            for z,d,node_id in self.point_index.ray_query(line_start, direction,
+                                                   factor*radius, z_min, z_max):
+                if d>radius: z = float('inf')  ## induce a sort by d only
+                possibles.append((z,d,node_id))
                 
-                radius = self.theme['point_diameter']
-                if d<factor*radius and z_min<=z<=z_max:
-                    if d>radius: z = float('inf')  ## induce a sort by d only
-                    possibles.append((z,d,ctrl_point))
+        elif self.display and self.content:
+            ids     = list(self.content)
+            start   = _np.array(map(float,line_start))
+            ray_dir = _np.array(map(float,direction))
+            p = self.model.get_positions(ids)-start        # position relative to line start
+            z = p.dot(ray_dir)                             # distance from start along line (depth)
+            d = ((p-z[:,None]*ray_dir)**2).sum(axis=1)**.5 # distance from p to line
+            
+            for i in _np.flatnonzero((d<factor*radius)&(z>=z_min)&(z<=z_max)):
+                zi = z[i] if d[i]<=radius else float('inf')  ## induce a sort by d only
+                possibles.append((zi,d[i],ids[i]))
                     
         if len(possibles) > 0:
             possibles.sort()
-            return possibles[0][2]
+            return self.get_point(possibles[0][2])
         else:
             return None
         
     def get_point(self, node_id):
-        """ return the control point related to model vertex `node_id` """
-        return self.content[node_id]
+        """ return the (editable) control point related to model vertex `node_id` """
+        point = self.points.get(node_id)
+        if point is None:
+            point = ControlPointsView.create_ctrl_point(self.model,node_id,
+                                                        color=self.theme['point_color'].ambient,
+                                                        callback=self.update_callback)
+            self.points[node_id] = point
+        return point
 
     # draw
     # ----
@@ -112,114 +204,348 @@ class ControlPointsView(AbstractView):
         """ draw the control points """
         if self.display and self.scene:
             if self.focus is None:
-                self.scene.apply(glrenderer)
+                self.visible_scene().apply(glrenderer)
+                for point in self.points.itervalues():
+                    if point.selected:
+                        point.representation(self.graphical_primitive).apply(glrenderer)
             else:
-                scene_index = self.scene_index[self.focus.id]
-                self.scene[scene_index].apply(glrenderer)
+                self.focus.representation(self.graphical_primitive).apply(glrenderer)
         
     def fastDraw(self,glrenderer):
         """ draw the control points """
         if self.display and self.focus and self.scene:
-            scene_index = self.scene_index[self.focus.id]
-            self.scene[scene_index].apply(glrenderer)
+            self.focus.representation(self.graphical_primitive).apply(glrenderer)
+        
+    def visible_scene(self):
+        """ return the scene of the blocks of points in the camera view 
+        
+        See `camera_planes`. The scene is only recreated when the set of
+        visible blocks changes.
+        """
+        editor = self.get_editor()
+        if not self.culling or len(self.blocks)<2 or not hasattr(editor,'camera'):
+            return self.scene
+            
+        lower, upper = self.block_bounds()
+        outside = _boxes_outside(lower, upper, camera_planes(editor))
+        if self._visible is None or not _np.array_equal(self._visible[0],outside):
+            shapes = [block.shape for block,out in zip(self.blocks,outside.tolist()) if not out]
+            self._visible = outside, _pgl.Scene(shapes)
+        return self._visible[1]
+        
+    def block_bounds(self):
+        """ return the arrays of the lower and upper corners of the blocks """
+        if self._block_bounds is None:
+            nan    = [float('nan')]*3
+            bounds = [block.bounds.get() or (nan,nan) for block in self.blocks]
+            lower  = _np.array([lo for lo,up in bounds], dtype=float).reshape(-1,3)
+            upper  = _np.array([up for lo,up in bounds], dtype=float).reshape(-1,3)
+            self._block_bounds = lower, upper
+        return self._block_bounds
         
 
     # edition and update
     # ------------------
     def create(self, model, update_callback):
         """ Create the ControlPointView graphical content from  `model` """
+        self.clear()
         if model is None:
-            self.clear()
             return
-
-        ## create ctrlPoint in create representation...
-        self.content = ControlPointsView.create_ctrl_points(model=model, 
-                                                            color=self.theme['point_color'].ambient,
-                                                            callback=update_callback)
+            
+        self.model = model
+        self.update_callback = update_callback
         
-        primitive = self.graphical_primitive
-        point_repr = [point.representation(primitive) for point in self.content.itervalues()]
+        ids = list(model.get_nodes())
+        positions = model.get_positions(ids)
+        order = _morton_order(positions).tolist()
+        positions = positions.tolist()
         
-        self.scene = _pgl.Scene(point_repr)
-        self.scene_index = dict((point.id,i) for i,point in enumerate(self.scene))
-        self.update_boundingbox()
+        color = self.point_color()
+        for start in xrange(0,len(ids),self.block_size):
+            rows  = order[start:start+self.block_size]
+            block = _PointBlock(model, self.theme['point_color'], self.point_width(),
+                                [(ids[i],positions[i],color) for i in rows])
+            self.blocks.append(block)
+            for i in rows:
+                self.content[ids[i]] = block
+        if self.spatial_index:
+            self.point_index = _PointGrid.from_points(
+                                   zip(ids, positions),
+                                   min_cell_size=4*self.theme['point_diameter'])
+        self._update_scene()
 
     def update(self,node_id):
         """ update representation of the control point related to `node_id` """
-        scene_index = self.scene_index[node_id]
-        self.scene[scene_index] = self.content[node_id].representation(self.graphical_primitive)
+        block = self.content.get(node_id)
+        if block is None:
+            return
+        position = self.model.get_position(node_id)
+        block.set(node_id, position, self.point_color(node_id))
+        self._block_bounds = None
+        self.bounds.move(node_id, position)
+        self.update_boundingbox()
+        if self.point_index is not None:
+            self.point_index.move(node_id, position)
+            
+        # release editable point if it is not used anymore
+        point = self.points.get(node_id)
+        if point is not None and not point.selected and not point.hasFocus:
+            del self.points[node_id]
         
     def add_point(self, node_id, model, update_callback):
         """ add node `node_id` from model """
-        point = ControlPointsView.create_ctrl_point(model,node_id,
-                                                    color=self.theme['point_color'].ambient,
-                                                    callback=update_callback)
-        self.content[node_id] = point
-        self.scene += point.representation(self.graphical_primitive)
-        self.scene_index[point.id] = len(self.scene)-1
-        self.update_boundingbox()
+        position = model.get_position(node_id)
+        if not self.content:
+            self.model = model
+            self.update_callback = update_callback
+            
+        # add to the block of the parent if possible, to keep blocks compact
+        block = self.content.get(model.parent(node_id))
+        if block is None or len(block)>=self.block_size:
+            block = self.blocks[-1] if self.blocks else None
+        self.bounds.add(node_id, position)
+        if block is None or len(block)>=self.block_size:
+            block = _PointBlock(model, self.theme['point_color'], self.point_width(),
+                                [(node_id,position,self.point_color())])
+            self.blocks.append(block)
+            self.content[node_id] = block
+            self._update_scene()
+        else:
+            block.add(node_id, position, self.point_color())
+            self.content[node_id] = block
+            self._block_bounds = None
+            self.update_boundingbox()
+            
+        if self.point_index is not None:
+            self.point_index.add(node_id, position)
         
-        return point
+        return self.get_point(node_id)
         
     def delete_points(self, node_ids):
         """ remove all node in `node_ids` from model """
+        emptied = False
         for node_id in node_ids:
-            print 'del node', node_id
-            del self.content[node_id]
-            scene_index = self.scene_index[node_id]
-            del self.scene[scene_index]
-            self.scene_index = dict((point.id,i) for i,point in enumerate(self.scene))
-        #self.update_boundingbox()
+            block = self.content.pop(node_id,None)
+            if block is None:
+                continue
+            block.remove(node_id)
+            if len(block)==0:
+                self.blocks.remove(block)
+                emptied = True
+            self._block_bounds = None
+            self.bounds.remove(node_id)
+            
+            self.points.pop(node_id,None)
+            if self.point_index is not None:
+                self.point_index.remove(node_id)
+        if emptied:
+            self._update_scene()
+        else:
+            self.update_boundingbox()
+        
+    def _update_scene(self):
+        """ make the scene containing the point sets of all blocks """
+        self.scene = _pgl.Scene([block.shape for block in self.blocks])
+        self._block_bounds = None
+        self._visible = None
+        self.update_boundingbox()
         
     @staticmethod
-    def create_ctrl_points(model, color, callback):
-        """ return a set of control point, as a dict (mtg-node-id, ctrl-pt-obj) """
-        return dict((node,ControlPointsView.create_ctrl_point(model,node,color,callback)) 
-                                for node in model.get_nodes())
-    
-    @staticmethod
-    def create_ctrl_point(model,node_id,color, callback):
-        """ create a CtrlPoint for node `node_id` of `mtg` """
+    def create_ctrl_point(model,node_id,color, callback, position=None):
+        """ create a CtrlPoint for node `node_id` of `mtg` 
+        
+        If `position` is not given, it is read from `model`
+        """
+        if position is None:
+            position = model.get_position(node_id)
         pos_setter = _PositionSetter(model,node_id)
-        ccp = CtrlPoint(model.get_position(node_id), pos_setter,color=color,id=node_id)
+        ccp = CtrlPoint(position, pos_setter,color=color,id=node_id)
         if callback: 
             ccp.setCallBack(callback)
         return ccp
         
     # appearance
     # ----------
-    def inc_point_size(self):
-        """ scale control point sphere by 25% """
-        self.theme['point_diameter'] *= 1.25
+    def point_color(self, node_id=None):
+        """ color of `node_id` in the point set (default color if None) """
+        point = self.points.get(node_id)
+        if point is not None and point.selected:
+            color = self.theme['highlight'].ambient
+        else:
+            color = self.theme['point_color'].ambient
+        return _pgl.Color4(color.red,color.green,color.blue,0)
+        
+    def point_width(self):
+        """ width, in pixels, of the points of the point set """
+        return max(1,int(round(self.theme['point_width'])))
+        
+    def _set_point_size(self, factor):
+        """ scale control point sphere and point set width by `factor` """
+        self.theme['point_diameter'] *= factor
+        self.theme['point_width']    *= factor
         diameter = self.theme['point_diameter']
-        scale = self.scene[0].geometry.geometry.scale
-        scale[0] = scale[1] = scale[2] = diameter
+        self.graphical_primitive.scale = _pgl.Vector3(diameter,diameter,diameter)
+        for block in self.blocks:
+            block.pointset.width = self.point_width()
         self.updateGL()
+        
+    def inc_point_size(self):
+        """ scale control point sphere by 25% """
+        self._set_point_size(1.25)
             
     def dec_point_size(self):
         """ scale down control point sphere by 20% """
-        self.theme['point_diameter'] *= 0.8
-        diameter = self.theme['point_diameter']
-        scale = self.scene[0].geometry.geometry.scale
-        scale[0] = scale[1] = scale[2] = diameter
-        self.updateGL()
+        self._set_point_size(0.8)
         
+class _PointBlock(object):
+    """ Block of control points drawn as one PlantGL PointSet
+
+    Points are indexed by their node id, and removing one moves the last point
+    in its place, such that addition and removal are done in constant time.
+    The bounding box of the block is maintained incrementally, and recomputed
+    from the positions of its nodes in `model` when required (see `PointBounds`).
+    """
+    def __init__(self, model, appearance, width, points):
+        """ create the block of `points`: a list of (node_id,position,color) """
+        self.model = model
+        self.ids   = [node_id for node_id,position,color in points]   # index -> node id
+        self.index = dict((node_id,i) for i,node_id in enumerate(self.ids))
+        self.pointset = _pgl.PointSet(_pgl.Point3Array([_pgl_vec(position) for n,position,c in points]),
+                                      _pgl.Color4Array([color for n,p,color in points]),
+                                      width=width)
+        self.shape  = _pgl.Shape(self.pointset, appearance)
+        self.bounds = _PointBounds(self._geometry)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _geometry(self):
+        return _np.array(self.ids,dtype=int), self.model.get_positions(self.ids)
+
+    def add(self, node_id, position, color):
+        self.index[node_id] = len(self.ids)
+        self.ids.append(node_id)
+        self.pointset.pointList.append(_pgl_vec(position))
+        self.pointset.colorList.append(color)
+        self.bounds.add(node_id, position)
+
+    def set(self, node_id, position, color):
+        index = self.index[node_id]
+        self.pointset.pointList[index] = _pgl_vec(position)
+        self.pointset.colorList[index] = color
+        self.bounds.move(node_id, position)
+
+    def remove(self, node_id):
+        """ remove point of `node_id` """
+        points = self.pointset.pointList
+        colors = self.pointset.colorList
+        index = self.index.pop(node_id)
+        last  = len(self.ids)-1
+        if index!=last:
+            moved = self.ids[last]
+            self.ids[index] = moved
+            self.index[moved] = index
+            points[index] = points[last]
+            colors[index] = colors[last]
+        self.ids.pop()
+        points.pop()
+        colors.pop()
+        self.bounds.remove(node_id)
+
+
+class _EdgeGroup(object):
+    """ Set of edges drawn with the same appearance as one PlantGL Shape
+
+    The edges are 2-points Polylines stored in the geometry list of a PlantGL
+    Group. Edges are indexed by their node id, and removing one moves the last
+    edge in its place, such that addition and removal are done in constant time.
+    """
+    def __init__(self, appearance, lines):
+        """ create the group of edges `lines`: a list of (node_id,Polyline) """
+        self.ids   = [node_id for node_id,line in lines]      # index -> node id
+        self.index = dict((node_id,i) for i,node_id in enumerate(self.ids))
+        self.shape = _pgl.Shape(_pgl.Group([line for node_id,line in lines]),appearance)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lines(self):
+        """ the (PlantGL) array of edge lines """
+        return self.shape.geometry.geometryList
+
+    def add(self, node_id, line):
+        self.index[node_id] = len(self.ids)
+        self.ids.append(node_id)
+        self.lines().append(line)
+
+    def remove(self, node_id):
+        """ remove edge of `node_id`, and return its line """
+        lines = self.lines()
+        index = self.index.pop(node_id)
+        line  = lines[index]
+        last  = len(self.ids)-1
+        if index!=last:
+            moved = self.ids[last]
+            self.ids[index] = moved
+            self.index[moved] = index
+            lines[index] = lines[last]
+        self.ids.pop()
+        lines.pop()
+        return line
+
+
 class EdgesView(AbstractView):
     """
     Class that implements a graphical representation of an edges set
     
-    Edges are represented by graphical lines
+    Edges are represented by graphical lines. All edges with the same color
+    are batched in one PlantGL Shape, such that the view is drawn with a few
+    shapes whatever the number of edges.
+    
+    Trees with more than `lod_min_edges` edges are drawn with a level of detail
+    depending on the camera: axes are drawn as polylines simplified such that
+    the error is less than `lod_pixel_error` pixels (see `treeeditor.tree.lod`).
+    Edges closer than `lod_near` pixels to the selected node are always drawn
+    at full resolution. The chunks of axes out of the camera view are not 
+    drawn (see `camera_planes`). Only the polylines of the chunks which level
+    or visibility changes are replaced in the `lod_scene`.
     
     ##TODO: alternative "cylinder" reprensentation
     """
-    def __init__(self, theme=None):
+    lod_min_edges   = 4096
+    lod_pixel_error = 1.
+    lod_near        = 64.
+    
+    def __init__(self, theme=None, lod=True, culling=True):
         """ 
         Construct an empty EdgesView 
         
         `theme` can be a alternative dictionary to this module's THEME_DEFAULT
+        `lod` if True, use level of detail to draw large trees
+        `culling` if True, do not draw the chunks of large trees out of the 
+                  camera view
         """
+        self.lod_enabled = lod
+        self.culling = culling
         AbstractView.__init__(self,theme=theme)
-        self.not_rendered = set()  # list of node id that are not rendered (no parent)
+        
+    def clear(self):
+        AbstractView.clear(self)
+        self.groups = {}            # color key -> _EdgeGroup
+        self.group_of = {}          # node id -> color key
+        self.not_rendered = set()   # list of node id that are not rendered (no parent)
+        self.selection = None       # node id drawn at full resolution (if any)
+        
+        # level of detail
+        self.lod = _AxisLOD() if self.lod_enabled or self.culling else None
+        self.lod_groups = {}        # color key -> _EdgeGroup of lod lines, with id (chunk,run)
+        self.lod_scene = _pgl.Scene()
+        self._lod_built = False
+        self._lod_lines = {}        # chunk id -> list of (color key, line id) drawn
+        self._lod_ids = _np.array([],dtype=int)    # chunks drawn (sorted)...
+        self._lod_levels = _np.array([],dtype=int) # ...and their level
+        self._lod_updated = set()   # node id changed since last lod update
+        self._lod_removed = set()   # node id removed since last lod update
         
     ## todo: 
     ##   draw cylinder if selected
@@ -229,77 +555,271 @@ class EdgesView(AbstractView):
     # ------------------
     def create(self,model):
         """ Create the EdgesView graphical content from  `model` """
+        self.clear()
         if model is None:
-            self.clear()
             return
 
-        self.content = dict(
-            (node_id,EdgesView.create_edge(model.get_position(model.parent(node_id)),
-                                           model.get_position(node_id),
-                                           model.color(node_id),
-                                           node_id,
-                                           self.theme))
-                              for node_id in model.get_nodes() 
-                              if model.parent(node_id))
-        self.not_rendered.update(node_id for node_id in model.get_nodes() if model.parent(node_id) is None)
-        
-        self.scene = _pgl.Scene(self.content.values())
-        self.scene_index = dict((edge.id,i) for i,edge in enumerate(self.scene))
-        self.update_boundingbox()
+        self.model = model
+        nodes   = list(model.get_nodes())
+        parents = map(model.parent, nodes)
+        edges   = [(node,parent) for node,parent in zip(nodes,parents) if parent]
+        node_positions   = model.get_positions([node   for node,parent in edges]).tolist()
+        parent_positions = model.get_positions([parent for node,parent in edges]).tolist()
+        keys = map(self.color_key, model.get_colors([node for node,parent in edges]))
+        
+        grouped = {}
+        for (node_id,parent),node_pos,parent_pos,key in zip(edges,node_positions,parent_positions,keys):
+            line = EdgesView.create_line(parent_pos,node_pos)
+            grouped.setdefault(key,[]).append((node_id,line))
+            self.content[node_id]  = line
+            self.group_of[node_id] = key
+        
+        for key,lines in grouped.iteritems():
+            self.groups[key] = _EdgeGroup(self.appearance(key),lines)
+        self.not_rendered.update(node for node,parent in zip(nodes,parents) if parent is None)
+        
+        self._update_scene()
 
     def update(self, node_id, model):
         """ update representation of edges in contact to node `node_id` """
+        self._lod_updated.add(node_id)
         if node_id in self.not_rendered:
             return
             
-        scene_index = self.scene_index[node_id]
-                
-        color = model.color(node_id)
+        key = self.color_key(model.color(node_id))
+        if key!=self.group_of[node_id]:
+            self._remove_edge(node_id)
+            self._add_edge(node_id, key, self.content[node_id])
+            
         node_pos   = model.get_position(node_id)
         parent_pos = model.get_position(model.parent(node_id))
-        self.scene[scene_index] = EdgesView.create_edge(parent_pos,node_pos,color,node_id,self.theme)
+        self.bounds.move(node_id, node_pos)
+        self.update_boundingbox()
+        points = self.content[node_id].pointList
+        points[0] = _pgl_vec(parent_pos)
+        points[1] = _pgl_vec(node_pos)
 
+    def recolor(self, model):
+        """ update the color of all edges from `model` 
+        
+        Edges lines are kept, and only moved to the group of their new color
+        """
+        group_of, groups = self.group_of, self.groups
+        node_ids = group_of.keys()
+        keys = map(self.color_key, model.get_colors(node_ids))
+        
+        new_group = False
+        for node_id,key in zip(node_ids,keys):
+            old_key = group_of[node_id]
+            if key==old_key:
+                continue
+            line = groups[old_key].remove(node_id)
+            group_of[node_id] = key
+            self._lod_updated.add(node_id)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = _EdgeGroup(self.appearance(key),[(node_id,line)])
+                new_group = True
+            else:
+                group.add(node_id, line)
+                
+        empty = [key for key,group in groups.iteritems() if len(group)==0]
+        for key in empty:
+            del groups[key]
+        if new_group or empty:
+            self._update_scene()
+        
     def add_edge(self, node_id, model):
         """ add edge for `node_id` of model """
+        self._lod_updated.add(node_id)
+        self.bounds.add(node_id, model.get_position(node_id))
         if model.parent(node_id) is None:
             self.not_rendered.add(node_id)
             return None
             
-        edge = EdgesView.create_edge(model.get_position(model.parent(node_id)),
-                                     model.get_position(node_id),
-                                     model.color(node_id),
-                                     node_id,
-                                     self.theme)
-        self.content[node_id] = edge
-            
-        
-        self.scene += edge
-        self.scene_index[edge.id] = len(self.scene)-1
+        line = EdgesView.create_line(model.get_position(model.parent(node_id)),
+                                     model.get_position(node_id))
+        self.content[node_id] = line
+        self._add_edge(node_id, self.color_key(model.color(node_id)), line)
         self.update_boundingbox()
         
-        return edge
+        return line
         
     def delete_edges(self, node_ids):
         """ remove all nodes from `node_ids` from model """
+        self._lod_removed.update(node_ids)
+        self._lod_updated.difference_update(node_ids)
         for node_id in node_ids:
+            self.bounds.remove(node_id)
             if node_id in self.not_rendered:
                 self.not_rendered.remove(node_id)
-            else:
+            elif node_id in self.content:
+                self._remove_edge(node_id)
                 del self.content[node_id]
-                scene_index = self.scene_index[node_id]
-                del self.scene[scene_index]
-                self.scene_index = dict((point.id,i) for i,point in enumerate(self.scene))
-        #self.update_boundingbox()
+        self.update_boundingbox()
         
-    @staticmethod
-    def create_edge(pos1,pos2,color, edge_id, theme):
-        line = _pgl.Polyline([_pgl_vec(pos1), _pgl_vec(pos2)],width=3)
-        if color in theme.keys():
-            appearance = theme[color]
+    def _add_edge(self, node_id, key, line):
+        """ add `line` to the group of color `key` """
+        self.group_of[node_id] = key
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = _EdgeGroup(self.appearance(key),[(node_id,line)])
+            self._update_scene()
+        else:
+            group.add(node_id, line)
+            
+    def _remove_edge(self, node_id):
+        """ remove edge of `node_id` from its color group """
+        key = self.group_of.pop(node_id)
+        group = self.groups[key]
+        group.remove(node_id)
+        if len(group)==0:
+            del self.groups[key]
+            self._update_scene()
+            
+    def _update_scene(self):
+        """ make the scene with the shapes of all color groups """
+        self.scene = _pgl.Scene([group.shape for group in self.groups.itervalues()])
+        self.update_boundingbox()
+        
+    def set_selection(self, node_id):
+        """ set the node which edges are drawn at full resolution (or None) """
+        self.selection = node_id
+        
+    # draw
+    # ----
+    def draw(self, glrenderer):
+        """ draw the edges, simplified if the level of detail is used """
+        if not (self.display and self.scene):
+            return
+        camera = self.lod_camera()
+        if camera is None:
+            self.scene.apply(glrenderer)
+        else:
+            planes = camera_planes(self.get_editor()) if self.culling else None
+            self.update_lod(camera, planes)
+            self.lod_scene.apply(glrenderer)
+            
+    def lod_camera(self):
+        """ return the camera used to select the chunks drawn, or None if not used """
+        if self.lod is None or self.model is None or len(self.content)<self.lod_min_edges:
+            return None
+        camera = getattr(self.get_editor(),'camera',None)
+        return camera() if camera else None
+        
+    def pixel_size(self, camera, distances):
+        """ size of a pixel at `distances` from the `camera` position """
+        if camera.type()==camera.ORTHOGRAPHIC:
+            return camera.pixelGLRatio(camera.revolveAroundPoint())
+        return distances*(2*_np.tan(camera.fieldOfView()/2)/camera.screenHeight())
+        
+    def update_lod(self, camera, planes=None):
+        """ update the `lod_scene` for the `camera`
+        
+        `planes`: if not None, the chunks outside of these planes are not drawn
+                  (see `treeeditor.tree.spatial.view_planes`)
+        """
+        if not self._lod_built:
+            self._clear_lod_scene()
+            self.lod.build(self.model, self._edge_keys)
+            self._lod_built = True
+        elif self._lod_updated or self._lod_removed:
+            replaced = self.lod.update(self.model, self._edge_keys,
+                                       self._lod_updated, self._lod_removed)
+            self._hide_chunks(replaced)
+        self._lod_updated = set()
+        self._lod_removed = set()
+        
+        if self.lod_enabled:
+            eye = _vec_list(camera.position())
+            pixel_sizes = self.pixel_size(camera, self.lod.distances(eye))*self.lod_pixel_error
+            protected = []
+            if self.selection in self.content or self.selection in self.not_rendered:
+                position = self.model.get_position(self.selection)
+                distance = _np.linalg.norm(_np.subtract(position,eye))
+                protected.append((position, self.lod_near*self.pixel_size(camera,distance)))
+            ids, levels = self.lod.select(pixel_sizes, protected)
+        else:
+            ids, levels = self.lod.select(0)
+        if planes is not None:
+            ids, lower, upper = self.lod.bounds()
+            levels[_boxes_outside(lower, upper, planes)] = -1
+        self._show_levels(ids, levels)
+        
+    def _edge_keys(self, node_ids):
+        """ return the color keys of the edges of `node_ids` """
+        return map(self.color_key, self.model.get_colors(node_ids))
+        
+    def _show_levels(self, ids, levels):
+        """ replace the lines of the chunks `ids` which `levels` have changed """
+        shown_ids, shown_levels = self._lod_ids, self._lod_levels
+        if len(shown_ids):
+            index = _np.minimum(_np.searchsorted(shown_ids, ids), len(shown_ids)-1)
+            same = (shown_ids[index]==ids) & (shown_levels[index]==levels)
+            kept = _np.zeros(len(shown_ids), dtype=bool)
+            kept[index[same]] = True
+            self._hide_chunks(shown_ids[~kept].tolist())
         else:
-            cmap = theme['colormap']
-            appearance = cmap[color%len(cmap)]
-        return _pgl.Shape(geometry=line,appearance=appearance, id=edge_id)
+            same = _np.zeros(len(ids), dtype=bool)
+            
+        changed = _np.flatnonzero(~same)
+        scene_changed = False
+        for chunk_id, level in zip(ids[changed].tolist(), levels[changed].tolist()):
+            lines = []
+            for run, (key, points) in enumerate(self.lod.lines(chunk_id, level)):
+                line_id = (chunk_id, run)
+                line = EdgesView.create_polyline(points.tolist())
+                group = self.lod_groups.get(key)
+                if group is None:
+                    self.lod_groups[key] = _EdgeGroup(self.appearance(key),[(line_id,line)])
+                    scene_changed = True
+                else:
+                    group.add(line_id, line)
+                lines.append((key, line_id))
+            self._lod_lines[chunk_id] = lines
+        self._lod_ids, self._lod_levels = ids, levels
+        
+        empty = [key for key,group in self.lod_groups.iteritems() if len(group)==0]
+        for key in empty:
+            del self.lod_groups[key]
+        if scene_changed or empty:
+            self.lod_scene = _pgl.Scene([group.shape for group in self.lod_groups.itervalues()])
+            
+    def _hide_chunks(self, chunk_ids):
+        """ remove the lines of chunks `chunk_ids` from the lod groups """
+        for chunk_id in chunk_ids:
+            for key, line_id in self._lod_lines.pop(chunk_id,()):
+                self.lod_groups[key].remove(line_id)
+                
+    def _clear_lod_scene(self):
+        """ remove all lines of the lod scene """
+        self.lod_groups = {}
+        self.lod_scene = _pgl.Scene()
+        self._lod_lines = {}
+        self._lod_ids = _np.array([],dtype=int)
+        self._lod_levels = _np.array([],dtype=int)
+        
+    # color
+    # -----
+    def color_key(self, color):
+        """ key of the appearance used for `color` (a theme key or an int) """
+        if color in self.theme:
+            return color
+        return color%len(self.theme['colormap'])
+        
+    def appearance(self, key):
+        """ appearance of color `key` (see `color_key`) """
+        if key in self.theme:
+            return self.theme[key]
+        return self.theme['colormap'][key]
+        
+    @staticmethod
+    def create_line(pos1,pos2):
+        return _pgl.Polyline([_pgl_vec(pos1), _pgl_vec(pos2)],width=3)
+        
+    @staticmethod
+    def create_polyline(positions):
+        return _pgl.Polyline(map(_pgl_vec,positions),width=3)
 
 
 # control point callback that update models
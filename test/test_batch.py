@@ -0,0 +1,83 @@
+
+def test_batch_no_gui_import():
+    # the batch module should not import Qt, PyQGLViewer or OpenGL
+    import os, sys, subprocess
+    code = ("import sys, treeeditor.batch, treeeditor.tree.model\n"
+            "print [m for m in sys.modules if m.split('.')[0] in ('PyQt4','PyQGLViewer','OpenGL')"
+            " or m.startswith('openalea.vpltk') or m.startswith('openalea.plantgl.all')]")
+    output = subprocess.check_output([sys.executable, '-c', code], env=os.environ)
+    assert output.strip()=='[]', 'gui modules imported: '+output
+    
+def test_process_directory():
+    import os, json, shutil, tempfile
+    from StringIO import StringIO
+    from test_io import _MTG_TEXT
+    from treeeditor.batch import process_directory
+    from treeeditor.tree.model import TreeModel
+    
+    directory = tempfile.mkdtemp()
+    try:
+        for name in ('a.mtg','b.mtg'):
+            with open(os.path.join(directory,name),'w') as f:
+                f.write(_MTG_TEXT)
+        with open(os.path.join(directory,'c.mtg'),'w') as f:
+            f.write('not an mtg')
+        with open(os.path.join(directory,'notes.txt'),'w') as f:
+            f.write('not a tree file')
+        script = os.path.join(directory,'script.py')
+        with open(script,'w') as f:
+            f.write("nodes = model.get_nodes()\n"
+                    "model.set_positions(nodes, model.get_positions(nodes)*2)\n"
+                    "result['moved'] = len(nodes)\n")
+                    
+        output = os.path.join(directory,'out')
+        report = StringIO()
+        reports = process_directory(directory, operations=['stats'], script=script,
+                                    output=output, report=report, processes=2)
+        
+        lines = map(json.loads, report.getvalue().splitlines())
+        assert sorted(r['file'] for r in lines)==sorted(r['file'] for r in reports)
+        status = dict((os.path.basename(r['file']),r['status']) for r in reports)
+        assert status=={'a.mtg':'ok', 'b.mtg':'ok', 'c.mtg':'error'}, 'invalid status: '+str(status)
+        for r in reports:
+            if r['status']=='ok':
+                assert r['results']['stats']==dict(segments=5, roots=1)
+                assert r['results']['script']==dict(moved=5)
+                assert 'total' in r['time'] and 'save' in r['time']
+                
+        model = TreeModel(mtg=os.path.join(output,'a.mtg'), position=None)
+        assert model.get_positions().max()==4, 'edited file not saved'
+        assert open(os.path.join(directory,'a.mtg')).read()==_MTG_TEXT, 'input file should not be changed'
+    finally:
+        shutil.rmtree(directory)
+
+def test_process_file_unchanged():
+    import os, shutil, tempfile
+    from test_io import _MTG_TEXT
+    from treeeditor.batch import process_file
+    
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory,'a.mtg')
+        with open(filename,'w') as f:
+            f.write(_MTG_TEXT)
+        script = os.path.join(directory,'script.py')
+        with open(script,'w') as f:
+            f.write("model.set_position(model.get_nodes()[0], (7,7,7))\n")
+            
+        # read-only operations do not save the file, even in place
+        for operations in (['stats'],['validate']):
+            report = process_file(filename, operations, in_place=True)
+            assert report['status']=='ok' and not report['modified'], 'file should not be modified'
+            assert 'saved' not in report, 'unchanged file should not be saved'
+            assert open(filename).read()==_MTG_TEXT, 'unchanged file should be byte-identical'
+        
+        # edited files are only saved in place on demand
+        report = process_file(filename, ['stats'], script=script)
+        assert report['modified'] and 'saved' not in report, 'file should not be saved by default'
+        assert open(filename).read()==_MTG_TEXT, 'file should not be saved by default'
+        report = process_file(filename, ['stats'], script=script, in_place=True)
+        assert report['saved']==filename, 'edited file should be saved in place'
+        assert open(filename).read()!=_MTG_TEXT, 'edited file should be saved in place'
+    finally:
+        shutil.rmtree(directory)
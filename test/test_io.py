@@ -44,3 +44,186 @@ def test_save_mtg():
     save_mtg(mtg, PASModel)
 
     ##todo: test save to .mtg (no binary)
+            
+_MTG_TEXT = '''CODE:\tFORM-A
+
+CLASSES:
+SYMBOL\tSCALE\tDECOMPOSITION\tINDEXATION\tDEFINITION
+$\t0\tFREE\tFREE\tIMPLICIT
+P\t1\tFREE\tFREE\tIMPLICIT
+A\t2\tFREE\tFREE\tIMPLICIT
+S\t3\tFREE\tFREE\tIMPLICIT
+
+DESCRIPTION:
+LEFT\tRIGHT\tRELTYPE\tMAX
+
+FEATURES:
+NAME\tTYPE
+XX\tREAL
+YY\tREAL
+ZZ\tREAL
+
+MTG:
+ENTITY-CODE\t\t\tXX\tYY\tZZ
+/P1/A1/S1\t\t\t0\t0\t0
+^<S2\t\t\t0\t0\t1
+\t+A2/S1\t\t1\t0\t1
+\t^<S2\t\t2\t0\t1
+^<S3\t\t\t0\t0\t2
+'''
+
+def read_mtg_text(text=_MTG_TEXT, **options):
+    """ write `text` in a temporary file and read it with MTGReader """
+    import os, tempfile
+    from treeeditor.io import MTGReader
+    
+    fd, filename = tempfile.mkstemp(suffix='.mtg')
+    try:
+        with os.fdopen(fd,'w') as f:
+            f.write(text)
+        reader = MTGReader(filename, **options)
+        return reader.read(), reader
+    finally:
+        os.remove(filename)
+    
+def test_MTGReader():
+    progress = []
+    g, reader = read_mtg_text(progress=progress.append)
+    assert progress[-1]==1, 'progress should end at 1'
+    
+    segments = dict((tuple(p),vid) for vid,p in zip(reader.vids,reader.positions.tolist()))
+    assert len(segments)==5, 'unexpected number of segments: '+str(len(segments))
+    s1,s2,s3 = [segments[(0,0,z)] for z in (0,1,2)]
+    b1,b2    = [segments[(x,0,1)] for x in (1,2)]
+    
+    assert g.parent(s2)==s1 and g.edge_type(s2)=='<'
+    assert g.parent(s3)==s2 and g.edge_type(s3)=='<'
+    assert g.parent(b1)==s2 and g.edge_type(b1)=='+', 'invalid branch parent'
+    assert g.parent(b2)==b1 and g.edge_type(b2)=='<'
+    assert g.complex(b1)==g.complex(b2)!=g.complex(s1), 'branch should be in its own axe'
+    assert g.parent(g.complex(b1))==g.complex(s1), 'invalid parent of branch axe'
+    assert g.property('ZZ')[s3]==2.
+    
+def test_MTGReader_stop():
+    g, reader = read_mtg_text(max_vertices=2)
+    assert len(g.vertices(scale=3))==2, 'reading should stop after 2 segments'
+    
+    g, reader = read_mtg_text(bbox=((-1,-1,-1),(3,1,1.5)))
+    assert len(reader.vids)==4, 'segment outside bbox should not be loaded'
+    g, reader = read_mtg_text(bbox=((-1,-1,-1),(.5,1,3)))
+    assert len(reader.vids)==3, 'descendants of segment outside bbox should not be loaded'
+    
+def test_tmtg():
+    import os, tempfile
+    from treeeditor.io import write_tmtg, read_tmtg
+    from treeeditor.tree.model import TreeModel
+    
+    g, reader = read_mtg_text()
+    g.property('XX')[g.root] = None   # None values are not stored
+    g.properties()['position'] = dict((vid,(1.,2.,vid)) for vid in g.vertices(scale=3))
+    fd, filename = tempfile.mkstemp(suffix='.tmtg')
+    os.close(fd)
+    try:
+        write_tmtg(filename, g)
+        g2 = read_tmtg(filename)
+        
+        for vid in g.vertices():
+            assert g2.parent(vid)==g.parent(vid), 'invalid parent of %d' % vid
+            assert g2.complex(vid)==g.complex(vid), 'invalid complex of %d' % vid
+            assert g2.scale(vid)==g.scale(vid)
+            assert g2.children(vid)==g.children(vid), 'invalid children of %d' % vid
+            assert g2.components(vid)==g.components(vid)
+        del g.property('XX')[g.root]
+        for name in g.property_names():
+            assert g2.property(name)==g.property(name), 'property %s is not correctly stored' % name
+            
+        model = TreeModel(mtg=filename, position=None)
+        assert model.position_property==['XX','YY','ZZ']
+        assert (model.get_positions(reader.vids)==reader.positions).all(), 'invalid positions'
+        model = TreeModel(mtg=filename, position='position')
+        assert model.get_position(reader.vids[-1])==[1,2,reader.vids[-1]]
+    finally:
+        os.remove(filename)
+        
+def test_write_mtg_stream():
+    import os, tempfile
+    from treeeditor.io import write_mtg_file, atomic_write
+    from treeeditor.tree.model import TreeModel
+    
+    g, reader = read_mtg_text()
+    fd, filename = tempfile.mkstemp(suffix='.mtg')
+    os.close(fd)
+    try:
+        write_mtg_file(filename, g, properties=[('XX','REAL'),('YY','REAL'),('ZZ','REAL')])
+        with open(filename) as f:
+            g2, reader2 = read_mtg_text(f.read())
+        assert reader2.positions.tolist()==reader.positions.tolist(), 'segments not written in order'
+        
+        vid2 = dict(zip(reader.vids,reader2.vids))
+        for vid in reader.vids:
+            assert vid2.get(g.parent(vid))==g2.parent(vid2[vid]), 'invalid parent of %d' % vid
+            assert g2.edge_type(vid2[vid])==g.edge_type(vid)
+            assert g2.label(vid2[vid])==g.label(vid)
+        assert len(g2)==len(g), 'complexes not correctly written'
+        
+        # save model to .mtg, atomically
+        model = TreeModel(mtg=g, presenter=None)
+        model.set_position(reader.vids[0], [.5,0,0])
+        model.save_model(filename)
+        g3, reader3 = read_mtg_text(open(filename).read())
+        assert reader3.positions[0].tolist()==[.5,0,0], 'model positions not saved'
+        
+        try:
+            with atomic_write(filename) as tmpname:
+                open(tmpname,'w').write('partial')
+                raise ValueError()
+        except ValueError:
+            pass
+        assert open(filename).read().startswith('CODE:'), 'failed write should not change file'
+        assert not [f for f in os.listdir(os.path.dirname(filename)) if f.startswith('.'+os.path.basename(filename))],\
+               'temporary file not removed'
+    finally:
+        os.remove(filename)
+        
+def test_convert_files():
+    import os, shutil, tempfile
+    from treeeditor.io import convert_files, read_tree, compare_trees
+    
+    directory = tempfile.mkdtemp()
+    try:
+        sources = []
+        for i in range(3):
+            sources.append(os.path.join(directory,'tree%d.mtg' % i))
+            with open(sources[-1],'w') as f:
+                f.write(_MTG_TEXT)
+        
+        for ext in ('.tmtg','.bmtg'):
+            reports, throughput = convert_files(sources, ext, processes=2)
+            assert throughput['converted']==3, 'errors in conversion: '+str(reports)
+            assert throughput['files_per_s']>0 and throughput['mb_per_s']>0
+        
+        g = read_tree(sources[0])
+        for ext in ('.tmtg','.bmtg'):
+            g2 = read_tree(sources[0][:-4]+ext)
+            assert compare_trees(g,g2) is None, 'converted %s file differs' % ext
+            
+        # up-to-date files are skipped
+        reports, throughput = convert_files(sources, '.tmtg', processes=1)
+        assert throughput['skipped']==3, 'up-to-date files should be skipped'
+        
+        output = os.path.join(directory,'out')
+        tmtg = [s[:-4]+'.tmtg' for s in sources]
+        reports, throughput = convert_files(tmtg, '.mtg', output=output, skip='hash', processes=1)
+        assert throughput['converted']==3, 'errors in conversion: '+str(reports)
+        g2 = read_tree(os.path.join(output,'tree0.mtg'))
+        assert compare_trees(g,g2) is None, 'converted .mtg file differs'
+        reports, throughput = convert_files(tmtg, '.mtg', output=output, skip='hash', processes=1)
+        assert throughput['skipped']==3, 'files with same content hash should be skipped'
+        
+        # differences are detected
+        g2.property('XX')[g2.vertices(scale=3)[-1]] = 5.
+        assert compare_trees(g,g2)=='different segment positions'
+        g2.property('edge_type')[g2.vertices(scale=3)[-1]] = '+'
+        assert compare_trees(g,g2)=='different segment edge types'
+    finally:
+        shutil.rmtree(directory)
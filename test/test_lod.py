@@ -0,0 +1,104 @@
+def test_douglas_peucker():
+    from treeeditor.tree.lod import douglas_peucker, simplification_errors
+    points = [(0,0,0),(1,.1,0),(2,-.1,0),(3,5,0),(4,6.5,0),(5,7,0),(6,8.05,0),(7,0,0)]
+
+    assert douglas_peucker(points,0).tolist()==range(8), 'null tolerance should keep all points'
+    assert douglas_peucker(points,100).tolist()==[0,7], 'only end points should be kept'
+    assert douglas_peucker(points,1).tolist()==[0,2,3,6,7]
+
+    # errors are consistent with direct simplifications at all tolerances
+    errors = simplification_errors(points)
+    for tolerance in [0.01,0.1,0.5,1,2,5]:
+        kept = set(douglas_peucker(points,tolerance).tolist())
+        assert set(i for i,e in enumerate(errors) if e>tolerance)==kept
+        assert set([0,7]).issubset(kept), 'end points should be kept'
+
+    # polylines separated by fixed points are independent
+    fixed = [True]+[False]*6+[True]*2+[False]*6+[True]
+    other = [(x,2*y,z) for x,y,z in points]
+    errors2 = simplification_errors(points+other, fixed)
+    expected = errors.tolist()+simplification_errors(other).tolist()
+    assert errors2.tolist()==expected, 'fixed points should split polylines'
+
+def make_tree(segments=200):
+    from treeeditor.tree.model import TreeModel
+    m = TreeModel()
+    axis = [m.new_vertex(position=(0,0,0))]
+    for i in range(1,segments):
+        axis.append(m.add_successor(axis[-1],(i,(i%7)*.01,0))[0])
+    branch = [m.add_branching(axis[100],(100,1,0))[0]]
+    for i in range(2,50):
+        branch.append(m.add_successor(branch[-1],(100,i,i%2*.01))[0])
+    return m, axis, branch
+
+def check_edges(lod, m, msg):
+    """ check that chunks cover exactly the edges of model `m` """
+    edges = []
+    for chunk_id in lod.bounds()[0]:
+        chunk = lod._chunks[chunk_id]
+        assert lod._is_valid(m, chunk), msg+': invalid chunk'
+        previous = chunk.anchor
+        for vid in chunk.vids:
+            if previous is not None:
+                edges.append((previous,vid))
+            previous = vid
+    expected = [(m.parent(vid),vid) for vid in m.get_nodes() if m.parent(vid) is not None]
+    assert sorted(edges)==sorted(expected), msg+': chunks differ from model edges'
+
+def test_AxisLOD_select():
+    from treeeditor.tree.lod import AxisLOD
+    m, axis, branch = make_tree()
+    key_of = lambda vids: [0]*len(vids)
+
+    lod = AxisLOD()
+    lod.build(m, key_of)
+    check_edges(lod, m, 'build')
+    assert len(lod)==5, 'axis should be split in chunks of 64 edges'
+
+    ids, levels = lod.select(0)
+    assert (levels==0).all(), 'null pixel size should select full resolution'
+    points = sum(len(p) for i in ids for key,p in lod.lines(i,0))
+    assert points==199+49+len(ids), 'full resolution should have all points'
+
+    ids, levels = lod.select(10)
+    assert (levels==lod.level_number).all(), 'large pixel size should select coarsest level'
+    points = [len(p) for i in ids for key,p in lod.lines(i,lod.level_number)]
+    assert points==[2]*len(ids), 'straight chunks should be simplified to end points'
+
+    # chunks close to protected position are at full resolution
+    ids, levels = lod.select(10*lod.distances((0,0,0)), protected=[((199,0,0),1)])
+    assert levels[ids.tolist().index(lod.chunk_of(axis[0]))]==0, 'chunk at distance 0 should be full resolution'
+    assert levels[ids.tolist().index(lod.chunk_of(axis[-1]))]==0, 'protected chunk should be full resolution'
+    assert levels[ids.tolist().index(lod.chunk_of(branch[-1]))]>0, 'far chunk should be simplified'
+
+def test_AxisLOD_update():
+    from treeeditor.tree.lod import AxisLOD
+    m, axis, branch = make_tree()
+    colors = {}
+    key_of = lambda vids: [colors.get(vid,0) for vid in vids]
+    lod = AxisLOD()
+    lod.build(m, key_of)
+
+    # color runs are separated polylines
+    colors[axis[10]] = 1
+    replaced = lod.update(m, key_of, [axis[10]])
+    assert len(replaced)==1, 'only chunk of changed vertex should be replaced'
+    lines = lod.lines(lod.chunk_of(axis[10]), lod.level_number)
+    assert [key for key,p in lines]==[0,1,0], 'color runs should be separated'
+    assert lines[1][1].tolist()==[[9,.02,0],[10,.03,0]], 'invalid color run points'
+
+    # edition of topology
+    m.set_position(axis[5],(5,3,0))
+    lod.update(m, key_of, [axis[5]])
+    assert lod.lines(lod.chunk_of(axis[5]),0)[0][1][5].tolist()==[5,3,0], 'position not updated'
+
+    changes = []
+    m.subscribe(changes.append)
+    m.insert_parent(axis[70],(69.5,0,0))
+    m.add_branching(axis[30],(30,2,0))
+    m.replace_parent(branch[10], axis[150], edge_type='+')
+    m.remove_vertex(axis[120])
+    removed = set().union(*[change.removed for change in changes])
+    updated = set().union(*[change.added|change.updated() for change in changes])
+    lod.update(m, key_of, updated-removed, removed)
+    check_edges(lod, m, 'update')
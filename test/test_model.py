@@ -111,3 +111,479 @@ def test_TreeModel_remove_branch_with_successor_sibling():
     assert edg[v4]=='+',  'successor of removed vertex should have become branch'
     assert edg[v5]=='+',  'branch child of removed vertex is not branch anymore'
     assert up==set((v2,v4,v5)), 'unexpected update node list:'+str(up)
+    
+def test_TreeModel_undo_redo():
+    # undo/redo restore topology and positions of edited vertices only
+    from treeeditor.tree.model import TreeModel
+    m = TreeModel()
+    v1 = m.new_vertex(position=(0,0,0))
+    v2 = m.add_successor(v1,(1,0,0))[0]
+    assert m.undo_number()==0, 'edition not recorded should not be undoable'
+    
+    m.push_backup(state=dict(selection_id=v2))
+    v3 = m.add_branching(v2,(1,1,0))[0]
+    m.set_position(v2,(2,0,0))
+    m.push_backup()
+    m.remove_vertex(v2)
+    assert m.undo_number()==2, 'unexpected number of undo:'+str(m.undo_number())
+    
+    m.undo()
+    assert m.mtg.has_vertex(v2), 'removed vertex was not restored'
+    assert m.parent(v3)==v2, 'parent of restored vertex children is not correct'
+    assert tuple(m.get_position(v2))==(2,0,0), 'position should not be undone yet'
+    
+    state = m.undo()
+    assert state==dict(selection_id=v2), 'unexpected undo state:'+str(state)
+    assert not m.mtg.has_vertex(v3), 'added vertex was not removed'
+    assert tuple(m.get_position(v2))==(1,0,0), 'position was not restored'
+    assert m.children(v2)==[], 'children of vertex were not restored'
+    
+    assert m.redo_number()==2
+    m.redo()
+    m.redo()
+    assert not m.mtg.has_vertex(v2), 'vertex removal was not redone'
+    assert m.parent(v3)==v1, 'reparenting of vertex children was not redone'
+    assert tuple(m.get_position(v3))==(1,1,0), 'position of redone vertex is not correct'
+    
+def test_PASModel_undo_remove_vertex():
+    from treeeditor.tree.model import PASModel
+    m = PASModel()
+    s0 = m.new_vertex(position=(0,0,0))
+    s1 = m.add_branching(s0,(1,0,0))[0]
+    a1 = m.get_axe(s1)
+    
+    m.push_backup()
+    m.remove_vertex(s1)
+    assert not m.mtg.has_vertex(a1), 'axe was not deleted from mtg'
+    
+    m.undo()
+    assert m.mtg.has_vertex(a1), 'axe was not restored'
+    assert m.get_axe(s1)==a1, 'complex of restored segment is not correct'
+    assert s1 in m.mtg.components(a1), 'components of restored axe are not correct'
+    assert m.mtg.parent(a1)==m.get_axe(s0), 'parent of restored axe is not correct'
+    
+def test_TreeModel_bulk_geometry():
+    # bulk position/radius accessors are consistent with single vertex ones
+    from treeeditor.tree.model import TreeModel
+    m = TreeModel(position=['XX','YY','ZZ'])
+    v1 = m.new_vertex(position=(0,0,0))
+    v2 = m.add_successor(v1,(1,0,0))[0]
+    v3 = m.add_branching(v1,(0,1,0))[0]
+    
+    positions = m.get_positions([v3,v2])
+    assert positions.tolist()==[[0,1,0],[1,0,0]], 'unexpected positions: '+str(positions)
+    
+    m.set_positions([v1,v3],[[0,0,1],[0,2,0]])
+    m.set_radii([v2],[0.5])
+    assert m.get_position(v3)==[0,2,0], 'position not set by set_positions'
+    assert m.mtg.property('ZZ')[v1]==1, 'mtg properties not updated by set_positions'
+    assert m.get_radius(v2)==0.5 and m.get_radius(v3)==1, 'unexpected radius'
+    assert m.mtg.property('radius')[v2]==0.5, 'mtg properties not updated by set_radii'
+    
+    m.remove_vertex(v2)
+    assert sorted(m.get_positions().tolist())==[[0,0,1],[0,2,0]], 'removed vertex still in positions'
+    
+def test_TreeModel_successor_index():
+    # the successor index stays consistent with the mtg edge types
+    from treeeditor.tree.model import TreeModel
+    m = TreeModel()
+    
+    def check(msg):
+        for vid in m.get_nodes():
+            successors = [c for c in m.children(vid) if m.mtg.edge_type(c)=='<']
+            assert m.successor(vid)==(successors[0] if successors else None), msg+': invalid successor of '+str(vid)
+            
+    v1 = m.new_vertex(position=(0,0,0))
+    v2 = m.add_successor(v1,(1,0,0))[0]
+    v3 = m.add_branching(v2,(1,1,0))[0]
+    v4 = m.add_successor(v2,(2,0,0))[0]
+    check('add vertices')
+    assert m.local_axis(v1)==[v1,v2,v4], 'invalid local axis: '+str(m.local_axis(v1))
+    assert m.successors([v1,v3,v4])==[v2,None,None]
+    
+    m.push_backup()
+    v5 = m.add_successor(v2,(3,0,0))[0]
+    check('add_successor replacing existing one')
+    m.push_backup()
+    m.replace_parent(v3,v2,edge_type='<')
+    check('replace_parent')
+    m.push_backup()
+    m.insert_parent(v3,(1,.5,0))
+    check('insert_parent')
+    m.push_backup()
+    m.remove_vertex(v2)
+    check('remove_vertex')
+    
+    for i in range(4):
+        m.undo()
+        check('undo %d' % i)
+    assert m.successor(v2)==v4, 'successor not restored by undo'
+    for i in range(4):
+        m.redo()
+        check('redo %d' % i)
+    m.remove_tree(v1)
+    check('remove_tree')
+    
+def test_TreeModel_transaction():
+    # editions of a transaction are one undo step, and one notification
+    from treeeditor.tree.model import TreeModel
+    
+    m = TreeModel()
+    v1 = m.new_vertex(position=(0,0,0))
+    v2 = m.add_successor(v1,(1,0,0))[0]
+    notified = []
+    m.subscribe(notified.append)
+    
+    with m.transaction(state='bulk') as transaction:
+        v3 = m.add_successor(v2,(2,0,0))[0]
+        m.push_backup()
+        v4 = m.add_branching(v3,(2,1,0))[0]
+        v5 = m.add_successor(v3,(3,0,0))[0]
+        m.remove_vertex(v5)
+        m.set_position(v1,(0,0,1))
+    assert len(notified)==1, 'subscribers should be notified once'
+    assert notified[0].added==set([v3,v4]) and notified[0].moved==set([v1])
+    assert transaction.added==set([v3,v4]), 'unexpected added: '+str(transaction.added)
+    assert transaction.removed==set(), 'vertex added then removed should not be reported'
+    assert transaction.updated==set([v1,v2]), 'unexpected updated: '+str(transaction.updated)
+    assert m.undo_number()==1, 'transaction should be one undo step'
+    
+    assert m.undo()=='bulk'
+    assert not m.mtg.has_vertex(v3) and m.get_position(v1)==[0,0,0], 'transaction not undone'
+    
+    # an exception cancels the transaction
+    try:
+        with m.transaction():
+            m.remove_vertex(v2)
+            raise ValueError()
+    except ValueError:
+        pass
+    assert m.successor(v1)==v2 and m.get_position(v2)==[1,0,0], 'transaction not cancelled'
+    assert len(notified)==2 and m.undo_number()==0, 'cancelled transaction should not be notified'
+    
+def test_TreeModel_notification():
+    # editions notify subscribers of the changed segments, by kind of change
+    from treeeditor.tree.model import TreeModel
+    
+    m = TreeModel()
+    notified = []
+    m.subscribe(notified.append)
+    def changes(kind):
+        return getattr(notified.pop(),kind)
+    
+    v1 = m.new_vertex(position=(0,0,0))
+    assert changes('added')==set([v1]) and not notified, 'new_vertex should be notified once'
+    v2 = m.add_successor(v1,(1,0,0))[0]
+    v3 = m.add_successor(v1,(0,1,0))[0]
+    assert changes('retyped')==set([v2]), 'previous successor should be retyped'
+    m.set_position(v2,(2,0,0))
+    assert changes('moved')==set([v2])
+    m.replace_parent(v2,v3)
+    assert changes('reparented')==set([v2])
+    m.push_backup()
+    m.remove_vertex(v3)
+    c = notified.pop()
+    assert c.removed==set([v3]) and c.reparented==set([v2]), 'invalid removal notification'
+    
+    m.undo()
+    c = notified.pop()
+    assert c.added==set([v3]) and c.reparented==set([v2]), 'invalid undo notification'
+    del notified[:]
+    m.unsubscribe(notified.append)
+    m.set_position(v2,(3,0,0))
+    assert not notified, 'unsubscribed callback should not be called'
+    
+def test_TreeModel_ancestry():
+    # is_ancestor follows editions, undo and redo
+    from treeeditor.tree.model import TreeModel
+    m = TreeModel()
+    v1 = m.new_vertex(position=(0,0,0))
+    v2 = m.add_successor(v1,(1,0,0))[0]
+    v3 = m.add_branching(v2,(1,1,0))[0]
+    v4 = m.add_successor(v3,(1,2,0))[0]
+    r  = m.new_vertex(position=(5,0,0))
+    
+    assert m.is_ancestor(v1,v4) and m.is_ancestor(v4,v4) and not m.is_ancestor(v4,v1)
+    assert not m.is_ancestor(r,v4), 'vertices of different trees are not ancestors'
+    assert m.common_ancestor(v4,v2)==v2 and m.common_ancestor(v4,r) is None
+    
+    m.push_backup()
+    m.replace_parent(v3, r)
+    assert m.is_ancestor(r,v4) and not m.is_ancestor(v1,v4), 'ancestry not updated by replace_parent'
+    assert m.tree_root(v4)==r
+    try:
+        m.replace_parent(r, v4)
+        assert False, 'reparenting to a descendant should raise a TypeError'
+    except TypeError:
+        pass
+    
+    m.push_backup()
+    v5 = m.insert_parent(v4,(1,1.5,0))[0]
+    m.remove_vertex(v3)
+    assert m.parent(v5)==r and m.is_ancestor(r,v4) and m.is_ancestor(v5,v4)
+    
+    m.undo()
+    m.undo()
+    assert m.is_ancestor(v1,v4) and not m.is_ancestor(r,v4), 'ancestry not restored by undo'
+    m.redo()
+    assert m.is_ancestor(r,v4) and m.tree_root(v3)==r, 'ancestry not restored by redo'
+    
+def test_PASModel_reparent_plant():
+    # a subtree reparented to another tree is moved to its plant
+    from treeeditor.tree.model import PASModel
+    m = PASModel()
+    s1 = m.new_vertex(position=(0,0,0))
+    s2 = m.add_successor(s1,(1,0,0))[0]
+    t1 = m.new_vertex(position=(5,0,0))
+    t2 = m.add_branching(t1,(5,1,0))[0]
+    plant, old_plant = m.get_plant(s1), m.get_plant(t1)
+    
+    m.replace_parent(t1, s2, edge_type='+')
+    assert m.get_plant(t1)==m.get_plant(t2)==plant, 'reparented subtree not moved to new plant'
+    assert not m.mtg.has_vertex(old_plant), 'emptied plant was not removed'
+    
+def check_PAS_axes(m, msg):
+    """ assert that axes of PASModel `m` are its chains of successors, in order """
+    g = m.mtg
+    for axe in g.vertices(scale=2):
+        segments = g._components.get(axe,[])
+        assert segments, msg+': empty axe %d' % axe
+        assert segments==m.local_axis(segments[0]), msg+': invalid axe %d: %s' % (axe, segments)
+        parent = m.parent(segments[0])
+        assert parent is None or m.successor(parent)!=segments[0], msg+': axe %d should be merged' % axe
+    for seg in m.get_nodes():
+        assert seg in g._components[m.get_axe(seg)], msg+': %d not in its axe components' % seg
+        assert m.get_plant(seg)==m.get_plant(m.tree_root(seg)), msg+': invalid plant of %d' % seg
+    
+def test_PASModel_axes():
+    # axes are updated locally by editions, and repaired in bulk at loading
+    from treeeditor.tree.model import PASModel
+    m = PASModel()
+    s = [m.new_vertex(position=(0,0,0))]
+    for i in range(5):
+        s.append(m.add_successor(s[-1],(0,0,i))[0])
+    b1 = m.add_branching(s[1],(1,0,0))[0]
+    b2 = m.add_successor(b1,(2,0,0))[0]
+    check_PAS_axes(m, 'creation')
+    
+    m.add_successor(s[2],(0,1,0))
+    check_PAS_axes(m, 'add_successor of segment with successor')
+    m.insert_parent(s[1],(0,0,.5))
+    check_PAS_axes(m, 'insert_parent')
+    m.replace_parent(s[4],b2,edge_type='<')
+    check_PAS_axes(m, 'merge by replace_parent')
+    m.replace_parent(b1,s[0],edge_type='<')
+    check_PAS_axes(m, 'replace_parent with successor')
+    m.remove_vertex(b1)
+    check_PAS_axes(m, 'remove_vertex')
+    
+    # corrupt the mtg: branch in its parent axe, unordered components
+    g = m.mtg
+    branch = [c for c in m.get_nodes() if g.edge_type(c)=='+' and m.parent(c)][0]
+    axe = m.get_axe(m.parent(branch))
+    g.add_component(axe, branch)
+    g._components[axe].reverse()
+    m2 = PASModel(mtg=g)
+    check_PAS_axes(m2, 'bulk check')
+    
+def test_TreeModel_default_color():
+    # models start with the branch color mode, other modes are extra
+    from treeeditor.tree.model import TreeModel, PASModel
+    for model_class in (TreeModel, PASModel):
+        m = model_class()
+        name = m._color_fct[m._current_color][0]
+        assert name=='branch', model_class.__name__+' should start in branch color mode, not '+name
+        names = [name for name,fct in m._color_fct]
+        assert 'strahler' in names, 'metric color modes should be available'
+
+def test_PASModel_color_cache():
+    # cached colors are recomputed for edited vertices only
+    from treeeditor.tree.model import PASModel
+    m = PASModel()
+    s1 = m.new_vertex(position=(0,0,0))
+    s2 = m.add_successor(s1,(1,0,0))[0]
+    b1 = m.add_branching(s2,(1,1,0))[0]
+    t1 = m.new_vertex(position=(5,0,0))
+    
+    computed = []
+    color_fct = dict(m._color_fct)
+    m._color_fct = [(name,lambda vid,f=fct: computed.append(vid) or f(vid))
+                                 for name,fct in m._color_fct]
+    m.next_color('branch')
+    assert m.get_colors([s1,s2,b1])==['highlight','default','highlight']
+    assert m.get_colors([s1,s2,b1])==['highlight','default','highlight']
+    assert sorted(computed)==sorted([s1,s2,b1]), 'colors should be cached'
+    
+    del computed[:]
+    m.replace_parent(b1, s2, edge_type='<')
+    assert m.get_colors([s1,s2,b1])[2]=='default', 'color of edited vertex not updated'
+    assert b1 in computed and s1 not in computed, 'only edited vertices should be recomputed'
+    
+    # changing plant of an axe updates the plant color of its segments
+    m.next_color('plant')
+    assert m.get_colors([s1,s2,b1])==[m.get_plant(s1)]*3
+    m.replace_parent(s1, t1, edge_type='+')
+    assert m.get_colors([s1,s2,b1])==[m.get_plant(t1)]*3, 'plant color not updated'
+    m.undo()
+    assert m.get_colors([s1,s2,b1])==[color_fct['plant'](s1)]*3, 'plant color not updated by undo'
+    
+def test_TreeModel_snapshot():
+    # snapshots are not changed by later editions
+    from copy import deepcopy
+    from treeeditor.tree.model import PASModel
+    m = PASModel()
+    s1 = m.new_vertex(position=(0,0,0))
+    s2 = m.add_successor(s1,(1,0,0))[0]
+    b1 = m.add_branching(s2,(1,1,0))[0]
+    b2 = m.add_successor(b1,(1,2,0))[0]
+    
+    m.push_backup()
+    m.remove_vertex(b2)
+    g = deepcopy(m.mtg)
+    positions = m.get_positions(sorted(m.get_nodes()))
+    snapshot = m.snapshot()
+    
+    def check(msg):
+        assert sorted(snapshot.vertices())==sorted(g.vertices()), msg+': invalid vertices'
+        assert sorted(snapshot.get_nodes())==sorted(g.vertices(scale=3))
+        for vid in g.vertices():
+            assert snapshot.parent(vid)==g.parent(vid), msg+': invalid parent of %d' % vid
+            assert snapshot.children(vid)==g.children(vid), msg+': invalid children of %d' % vid
+            assert snapshot.complex(vid)==g.complex(vid), msg+': invalid complex of %d' % vid
+            assert snapshot.components(vid)==g.components(vid)
+            assert snapshot.edge_type(vid)==g.edge_type(vid)
+        assert (snapshot.get_positions(sorted(g.vertices(scale=3)))==positions).all(), msg+': invalid positions'
+        assert not snapshot.has_vertex(b2)
+        
+    check('initial')
+    m.push_backup()
+    s3 = m.add_successor(s2,(2,0,0))[0]
+    m.set_position(s1,(0,0,5))
+    m.replace_parent(b1, s3)
+    m.remove_vertex(s2)
+    check('after edition')
+    assert not snapshot.has_vertex(s3), 'new vertex should not be in snapshot'
+    
+    m.undo()
+    m.undo()
+    check('after undo')
+    try:
+        with m.transaction():
+            m.remove_tree(b1)
+            raise ValueError()
+    except ValueError:
+        pass
+    check('after rollback')
+    
+    snapshot.release()
+    assert len(m._snapshots)==0, 'released snapshot should not be recorded'
+    
+def test_TreeModel_validate():
+    # incremental validation gives the same violations as a full one
+    from treeeditor.tree.model import PASModel
+    m = PASModel()
+    s = [m.new_vertex(position=(0,0,0))]
+    for i in range(4):
+        s.append(m.add_successor(s[-1],(0,0,i))[0])
+    b1 = m.add_branching(s[1],(1,0,0))[0]
+    
+    violations = m.validate()
+    assert not any(violations.values()), 'unexpected violations: '+str(violations)
+    
+    def check(expected, msg):
+        violations = m.validate()
+        assert violations==m.validate(full=True), msg+': incremental validation differs'
+        for kind, vids in expected.iteritems():
+            assert violations[kind]==vids, msg+': invalid %s: %s' % (kind,violations[kind])
+        assert not any(v for k,v in violations.iteritems() if k not in expected), msg
+        
+    orphan = m.new_vertex(position=(float('nan'),0,0))
+    check(dict(orphans=[orphan], positions=[orphan]), 'new_vertex')
+    m.set_position(orphan, (1,1,1))
+    m.replace_parent(orphan, s[-1], edge_type='+')
+    check({}, 'connected orphan')
+    
+    g = m.mtg
+    with m.batch():
+        g.property('edge_type')[b1] = '<'    # 2 successors, b1 in another axe
+        m.notify('retyped', [b1])
+    check(dict(successors=[s[1]], complexes=[b1]), 'two successors')
+    with m.batch():
+        g.property('edge_type')[b1] = '+'
+        m.notify('retyped', [b1])
+    check({}, 'repaired successors')
+    
+    with m.batch():
+        g._children[s[0]].remove(s[1])       # cycle s1 -> s3 -> s2 -> s1
+        g._children[s[3]].append(s[1])
+        g._parent[s[1]] = s[3]
+        m.notify('reparented', [s[1]])
+    check(dict(cycles=[s[1],s[2],s[3]], successors=[s[3]], orphans=[s[0]]), 'cycle')
+    
+def test_TreeModel_metrics():
+    # metrics are updated locally, and equal to a full computation
+    from treeeditor.tree.model import TreeModel
+    from treeeditor.tree.metrics import TreeMetrics, METRICS
+    m = TreeModel()
+    s = [m.new_vertex(position=(0,0,0))]
+    for i in range(1,4):
+        s.append(m.add_successor(s[-1],(0,0,i))[0])
+    b1 = m.add_branching(s[1],(3,0,1))[0]
+    b2 = m.add_successor(b1,(3,4,1))[0]
+    
+    assert m.get_metric('length',[s[1],b1,b2]).tolist()==[1,3,4]
+    assert m.get_metric('path_length',[s[3],b2]).tolist()==[3,8]
+    assert m.get_metric('order',[s[3],b2]).tolist()==[0,1]
+    assert m.get_metric('depth',[s[3],b2]).tolist()==[3,3]
+    assert m.get_metric('strahler',s+[b2]).tolist()==[2,2,1,1,1]
+    
+    def check(msg):
+        full = TreeMetrics(m)
+        for name in METRICS:
+            assert (m.get_metric(name)==full.get(name)).all(), msg+': invalid '+name
+        full.close()
+        
+    computed = []
+    compute_all = m.metrics()._compute_all
+    m.metrics()._compute_all = lambda: computed.append(1) or compute_all()
+    m.set_position(s[1],(0,0,2))
+    check('set_position')
+    m.add_branching(s[2],(1,0,2))
+    check('add_branching')
+    m.replace_parent(b1, s[3], edge_type='+')
+    check('replace_parent')
+    m.remove_vertex(s[2])
+    check('remove_vertex')
+    m.undo()
+    assert computed==[], 'metrics should be updated locally'
+    check('undo')
+    
+    m.next_color('strahler')
+    assert m.get_colors([s[0],b2])==[2,1]
+    
+def test_TreeModel_estimate_radii():
+    # radius estimated by the pipe model, as one undoable edition
+    from treeeditor.tree.model import TreeModel
+    m = TreeModel()
+    s = [m.new_vertex(position=(0,0,0))]
+    for i in range(1,4):
+        s.append(m.add_successor(s[-1],(0,0,i))[0])
+    b1 = m.add_branching(s[1],(1,0,1))[0]
+    b2 = m.add_branching(s[1],(2,0,1))[0]
+    
+    m.push_backup()
+    m.estimate_radii(tip_radius=1., exponent=2.)
+    radii = m.get_radii(s+[b1,b2])
+    assert (abs(radii**2-[3,3,1,1,1,1])<1e-9).all(), 'invalid pipe model radius: '+str(radii)
+    
+    m.undo()
+    assert (m.get_radii(s)==1).all(), 'estimation should be undone in one step'
+    m.redo()
+    assert (m.get_radii(s+[b1,b2])==radii).all(), 'estimation not redone'
+    m.undo()
+    
+    m.set_radii(s+[b1,b2], [1,1,1,1,2,1])
+    del m.mtg.property(m.radius_property)[s[1]]
+    changed = m.estimate_radii(tip_radius=.5, exponent=3., missing_only=True)
+    assert changed==[s[1]], 'only missing radius should be estimated'
+    assert abs(m.get_radius(s[1])**3-(1+8+1))<1e-9
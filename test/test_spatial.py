@@ -0,0 +1,112 @@
+def brute_force_query(points, start, direction, distance, z_min, z_max):
+    from math import sqrt
+    found = []
+    for pid, pos in points:
+        p = [a-b for a,b in zip(pos,start)]
+        z = sum(a*b for a,b in zip(p,direction))
+        d = sqrt(sum((a-z*b)**2 for a,b in zip(p,direction)))
+        if d<distance and z_min<=z<=z_max:
+            found.append(pid)
+    return sorted(found)
+    
+def test_PointGrid_ray_query():
+    import random
+    from treeeditor.tree.spatial import PointGrid
+    
+    random.seed(0)
+    points = [(i,(random.uniform(0,100),random.uniform(0,50),0)) for i in range(2000)]
+    grid = PointGrid.from_points(points, min_cell_size=4)
+    
+    for i in range(20):
+        start = (random.uniform(-50,150),random.uniform(-50,100),100)
+        direction = (0,0,-1) if i%2 else (0.6,0,-0.8)
+        found = sorted(pid for z,d,pid in grid.ray_query(start,direction,2,0,1000))
+        expected = brute_force_query(points,start,direction,2,0,1000)
+        assert found==expected, 'ray query result differs from brute force'
+        
+def test_PointGrid_edition():
+    from treeeditor.tree.spatial import PointGrid
+    grid = PointGrid.from_points([(1,(0,0,0)),(2,(10,0,0))])
+    
+    grid.move(1,(5,5,5))
+    grid.add(3,(20,0,0))
+    grid.remove(2)
+    
+    assert len(grid)==2 and 2 not in grid, 'point was not removed'
+    found = [pid for z,d,pid in grid.ray_query((5,5,-10),(0,0,1),1)]
+    assert found==[1], 'moved point not found: '+str(found)
+    found = [pid for z,d,pid in grid.ray_query((20,0,-10),(0,0,1),1, z_min=0, z_max=5)]
+    assert found==[], 'point out of depth range should not be found'
+    
+    # query distance larger than cell size
+    found = sorted(pid for z,d,pid in grid.ray_query((12,2,-10),(0,0,1),50))
+    assert found==[1,3], 'unexpected points found: '+str(found)
+
+def test_PointBounds():
+    import numpy as np
+    from treeeditor.tree.spatial import PointBounds
+    points = {1:(0,0,0), 2:(10,5,0), 3:(5,-5,2), 4:(float('nan'),0,0)}
+    computed = []
+    def source():
+        computed.append(1)
+        ids = sorted(points)
+        return np.array(ids), np.array([points[i] for i in ids])
+    bounds = PointBounds(source)
+    assert bounds.get()==([0,-5,0],[10,5,2]), 'invalid bounds: '+str(bounds.get())
+
+    # add and outward moves extend the bounds without recomputation
+    points[5] = (20,0,0)
+    bounds.add(5, points[5])
+    points[1] = (-1,0,0)
+    bounds.move(1, points[1])
+    points[3] = (5,-4,1)
+    bounds.move(3, (5,-5,2))   # unchanged extreme
+    bounds.move(4, (float('nan'),)*3)
+    assert bounds.get()==([-1,-5,0],[20,5,2]), 'invalid extended bounds: '+str(bounds.get())
+    assert len(computed)==1, 'bounds should not be recomputed'
+
+    # removing or moving inward an extreme point recomputes the bounds
+    del points[5]
+    bounds.remove(5)
+    assert bounds.get()==([-1,-4,0],[10,5,1]), 'invalid bounds after removal: '+str(bounds.get())
+    points[2] = (3,0,0)
+    bounds.move(2, points[2])
+    assert bounds.get()==([-1,-4,0],[5,0,1]), 'invalid bounds after move: '+str(bounds.get())
+    assert len(computed)==3, 'bounds should be recomputed'
+
+    # bounds extended from empty
+    points.clear()
+    bounds.reset()
+    assert bounds.get() is None, 'bounds of no point should be None'
+    points.update({1:(0,0,0), 2:(-1,5,2)})
+    bounds.add(1, points[1])
+    bounds.add(2, points[2])
+    del points[1]
+    bounds.remove(1)
+    assert bounds.get()==([-1,5,2],[-1,5,2]), 'invalid bounds from empty: '+str(bounds.get())
+
+def test_view_culling():
+    import numpy as np
+    from treeeditor.tree.spatial import view_planes, boxes_outside
+    # camera at origin looking along x, with a 90 degrees field of view
+    planes = view_planes((0,0,0),(1,0,0),(0,0,1),(0,-1,0), near=1, far=100, tan_half_fov=1)
+    lower = np.array([[5,-1,-1],[5,20,0],[-10,-1,-1],[200,0,0],[1,2,0],[np.nan]*3], dtype=float)
+    upper = lower+2
+    outside = boxes_outside(lower, upper, planes).tolist()
+    assert outside==[False,True,True,True,False,False], 'invalid culling: '+str(outside)
+
+    # orthographic camera: only depth is tested
+    planes = view_planes((0,0,0),(1,0,0),(0,0,1),(0,-1,0), near=1, far=100)
+    outside = boxes_outside(lower, upper, planes).tolist()
+    assert outside==[False,False,True,True,False,False], 'invalid depth culling: '+str(outside)
+
+def test_morton_order():
+    import random
+    from treeeditor.tree.spatial import morton_order
+    random.seed(0)
+    centers = [(x,y,z) for x in (0,100) for y in (0,100) for z in (0,100)]
+    points = [(random.randrange(8),random.random(),random.random(),random.random()) for i in range(400)]
+    positions = [[c+r for c,r in zip(centers[i],p)] for i,x,y,z in points for p in [(x,y,z)]]
+    clusters = [points[i][0] for i in morton_order(positions)]
+    changes = sum(1 for a,b in zip(clusters[:-1],clusters[1:]) if a!=b)
+    assert changes==7, 'points of a cluster should be consecutive'
@@ -0,0 +1,27 @@
+def test_Task():
+    from treeeditor.task import Task
+    
+    def work(x, progress):
+        progress(.5)
+        return 2*x
+        
+    task = Task(work, 21)
+    task.start()
+    assert task.wait(10), 'task was not processed'
+    assert task.get_result()==42, 'invalid task result'
+    assert task.progress==.5, 'progress was not reported'
+    
+def test_Task_error():
+    from treeeditor.task import Task
+    
+    def fail(progress):
+        raise IOError('failed')
+        
+    task = Task(fail)
+    task.run()
+    try:
+        task.get_result()
+    except IOError:
+        pass
+    else:
+        assert False, 'exception of the task function should be raised by get_result'